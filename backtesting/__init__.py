@@ -0,0 +1,4 @@
+from .data import MarketData, synthetic_market_data
+from .matching import QueueMatcher
+from .engine import Backtester, BacktestResult, GridParams
+from .sweep import run_sweep, parameter_grid, SweepStore
\ No newline at end of file
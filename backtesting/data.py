@@ -0,0 +1,102 @@
+# data.py
+# market data of a backtest: IB (NYMEX) ticks and MOEX book snapshots of one symbol pair as NumPy structured arrays
+# (the record layouts of data_processing.tick_store, MOEX snapshots with best level volumes), merged into one
+# time ordered event stream
+import numpy as np
+from data_processing.tick_store import IB_TICK_DTYPE
+
+# bid_volume / ask_volume: lots at the best bid / ask, nan if not recorded (queue position is then unknown, see matching)
+MOEX_BOOK_DTYPE = np.dtype([("time", "f8"), ("bid", "f8"), ("ask", "f8"), ("deep_bid", "f8"), ("deep_ask", "f8"),
+                            ("bid_volume", "f8"), ("ask_volume", "f8")])
+
+EVENT_IB = 0
+EVENT_MOEX = 1
+
+
+class MarketData:
+    def __init__(self, ib_ticks, moex_books):
+        self.ib_ticks = np.asarray(ib_ticks, dtype=IB_TICK_DTYPE)
+        self.moex_books = np.asarray(moex_books, dtype=MOEX_BOOK_DTYPE)
+
+# MOEX snapshots from the tick store records (data_processing.tick_store.MOEX_QUOTE_DTYPE), level volumes unknown
+    @classmethod
+    def from_tick_store(cls, ib_ticks, moex_quotes):
+        moex_books = np.zeros(len(moex_quotes), dtype=MOEX_BOOK_DTYPE)
+        for name in moex_quotes.dtype.names:
+            moex_books[name] = moex_quotes[name]
+        moex_books["bid_volume"] = moex_books["ask_volume"] = np.nan
+        return cls(ib_ticks, moex_books)
+
+# recorded IB ticks and MOEX books (database.tick_recorder records), times to epoch seconds
+    @classmethod
+    def from_recordings(cls, ib_records, moex_records):
+        ib_ticks = np.zeros(len(ib_records), dtype=IB_TICK_DTYPE)
+        for name in IB_TICK_DTYPE.names:
+            ib_ticks[name] = ib_records[name]
+        ib_ticks["time"] = ib_records["time"] / 1e9
+        moex_books = np.zeros(len(moex_records), dtype=MOEX_BOOK_DTYPE)
+        for name in ("bid", "ask", "deep_bid", "deep_ask"):
+            moex_books[name] = moex_records[name]
+        moex_books["time"] = moex_records["time"] / 1e9
+        moex_books["bid_volume"] = moex_records["bid_volumes"][:, 0]
+        moex_books["ask_volume"] = moex_records["ask_volumes"][:, 0]
+        return cls(ib_ticks, moex_books)
+
+    def __len__(self):
+        return len(self.ib_ticks) + len(self.moex_books)
+
+    @property
+    def start(self):
+        return min(self.ib_ticks["time"][:1].tolist() + self.moex_books["time"][:1].tolist())
+
+    @property
+    def end(self):
+        return max(self.ib_ticks["time"][-1:].tolist() + self.moex_books["time"][-1:].tolist())
+
+# (times, kinds, indexes) of all events in time order. On equal times IB ticks come first (stable sort)
+    def events(self):
+        times = np.concatenate((self.ib_ticks["time"], self.moex_books["time"]))
+        kinds = np.concatenate((np.full(len(self.ib_ticks), EVENT_IB, dtype=np.int8), np.full(len(self.moex_books), EVENT_MOEX, dtype=np.int8)))
+        indexes = np.concatenate((np.arange(len(self.ib_ticks)), np.arange(len(self.moex_books))))
+        order = np.argsort(times, kind="stable")
+        return times[order], kinds[order], indexes[order]
+
+
+# random market for trying parameters without recorded data: IB mid as a random walk on the tick grid, MOEX mid as
+# IB mid plus a mean reverting (Ornstein-Uhlenbeck) spread, level volumes random. Prices in the symbol's units
+def synthetic_market_data(seconds = 8 * 3600, ib_rate = 4.0, moex_rate = 10.0, start_price = 2.5, tick_size = 0.001,
+                          volatility = 0.0005, mid_spread = 0.0, spread_std = 0.01, reversion = 0.01,
+                          moex_half_spread = 0.002, deep_offset = 0.001, level_volume = 200, seed = None):
+    rng = np.random.default_rng(seed)
+    ib_times = np.cumsum(rng.exponential(1 / ib_rate, int(seconds * ib_rate)))
+    ib_times = ib_times[ib_times < seconds]
+    ib_mid = start_price + np.cumsum(rng.normal(0, volatility, len(ib_times)))
+    ib_ticks = np.zeros(len(ib_times), dtype=IB_TICK_DTYPE)
+    ib_ticks["time"] = ib_times
+    ib_ticks["bid"] = np.around(np.floor(ib_mid / tick_size) * tick_size, 6)
+    ib_ticks["ask"] = np.around(ib_ticks["bid"] + tick_size, 6)
+    ib_ticks["bid_size"] = rng.integers(1, 50, len(ib_times))
+    ib_ticks["ask_size"] = rng.integers(1, 50, len(ib_times))
+
+    moex_times = np.cumsum(rng.exponential(1 / moex_rate, int(seconds * moex_rate)))
+    moex_times = moex_times[moex_times < seconds]
+    # OU spread sampled at the MOEX times (exact for the uneven steps), stationary std spread_std, half life ln 2 / reversion
+    steps = np.diff(moex_times, prepend=0.0)
+    decay = np.exp(-reversion * steps)
+    shocks = rng.normal(0, 1, len(moex_times)) * spread_std * np.sqrt(1 - decay ** 2)
+    spread = np.empty(len(moex_times))
+    value = mid_spread
+    for i, (d, shock) in enumerate(zip(decay.tolist(), shocks.tolist())):
+        value = mid_spread + (value - mid_spread) * d + shock
+        spread[i] = value
+    ib_index = np.maximum(np.searchsorted(ib_times, moex_times, side="right") - 1, 0)
+    moex_mid = (ib_ticks["bid"] + ib_ticks["ask"])[ib_index] / 2 + spread
+    moex_books = np.zeros(len(moex_times), dtype=MOEX_BOOK_DTYPE)
+    moex_books["time"] = moex_times
+    moex_books["bid"] = np.around(np.floor((moex_mid - moex_half_spread) / tick_size) * tick_size, 6)
+    moex_books["ask"] = np.around(np.ceil((moex_mid + moex_half_spread) / tick_size) * tick_size, 6)
+    moex_books["deep_bid"] = np.around(moex_books["bid"] - deep_offset, 6)
+    moex_books["deep_ask"] = np.around(moex_books["ask"] + deep_offset, 6)
+    moex_books["bid_volume"] = rng.integers(1, level_volume, len(moex_times))
+    moex_books["ask_volume"] = rng.integers(1, level_volume, len(moex_times))
+    return MarketData(ib_ticks, moex_books)
@@ -0,0 +1,302 @@
+# engine.py
+# event driven backtest of one symbol pair: recorded IB ticks and MOEX book snapshots are replayed in time order
+# through the decisions of MeanReversionStrategy (data_processing.grid_rules, CompiledGrid, OrderLadder):
+#  - "grid" (market grid): MOEX market order at the deep price, then the IB lot, one trade at a time;
+#  - "limit_grid": order_flow ladder reconciled against simulated MOEX limit orders (backtesting.matching),
+#    with the fingerprint skip and price tolerance of order_flow, and the hedger on IB.
+# Requests take the venue latency to arrive and a round trip to be answered; a loop busy with a round trip sees
+# only the latest market state when it is free again (as the conflating market bus). Simulated time only, no sleeps
+import heapq
+import math
+import time
+from collections import namedtuple
+import numpy as np
+from data_processing.compiled_grid import CompiledGrid
+from data_processing.order_ladder import OrderLadder, ORDER_TYPE_BUY_LIMIT
+from data_processing.grid_rules import grid_signal, hedge_lots, SIGNAL_NONE
+from backtesting.data import EVENT_IB
+from backtesting.matching import QueueMatcher
+
+STRATEGY_GRID = "grid"
+STRATEGY_LIMIT_GRID = "limit_grid"
+
+VENUE_MOEX = 0
+VENUE_NYMEX = 1
+
+TRADE_DTYPE = np.dtype([("time", "f8"), ("venue", "i1"), ("volume", "f8"), ("price", "f8")]) # volume < 0: sell
+
+# strategy parameters, as in start_grid_trading / start_limit_trading plus the per-symbol config values
+GridParams = namedtuple("GridParams", ["spread_step", "pose_step", "number_of_steps", "mid_spread", "mid_pose"])
+
+
+def first_valid(values):
+    valid = values[~np.isnan(values)]
+    return float(valid[0]) if len(valid) else 0.0
+
+
+class BacktestResult:
+    def __init__(self, trades, times, equity, open_risk, summary):
+        self.trades = trades # TRADE_DTYPE records in time order
+        self.times = times # event times
+        self.equity = equity # PnL marked to mid prices at the event times, in price units x MOEX lots
+        self.open_risk = open_risk # MOEX lots not hedged on IB at the event times
+        self.summary = summary
+
+    def report(self):
+        return ", ".join(f"{name}: {round(value, 4) if isinstance(value, float) else value}" for name, value in self.summary.items())
+
+
+class Backtester:
+    def __init__(self, data, params, strategy = STRATEGY_LIMIT_GRID, lots = 100, moex_max_lots = 100, nymex_max_lots = 1,
+                 risk_coef = 0.66, decimals = 3, price_tolerance_ticks = 0, moex_latency = 0.010, ib_latency = 0.050,
+                 hedger_interval = 1.0, moex_pose = 0.0, nymex_pose = 0.0):
+        if strategy not in (STRATEGY_GRID, STRATEGY_LIMIT_GRID):
+            raise ValueError(f"unknown strategy {strategy}")
+        self.data = data
+        self.params = GridParams(*params)
+        self.strategy = strategy
+        self.lots = lots # MOEX lots per IB contract
+        self.moex_max_lots = moex_max_lots
+        self.nymex_max_lots = nymex_max_lots
+        self.max_risk = lots * risk_coef
+        self.decimals = decimals
+        self.tick_size = 10 ** -decimals
+        self.price_tolerance_ticks = price_tolerance_ticks # as MOEX_PRICE_TOLERANCE_TICKS
+        self.moex_latency = moex_latency # one way, seconds
+        self.ib_latency = ib_latency
+        self.hedger_interval = hedger_interval # hedger sleep between checks
+        self.start_moex_pose = moex_pose
+        self.start_nymex_pose = nymex_pose
+
+    def reset(self):
+        self.now = 0.0
+        self.pending = [] # heap of (time, sequence, callback, args)
+        self.sequence = 0
+        self.moex_pose = self.start_moex_pose
+        self.nymex_pose = self.start_nymex_pose
+        self.trades = []
+        self.ib_bid = self.ib_ask = math.nan
+        self.book = (math.nan,) * 6 # bid, ask, deep_bid, deep_ask, bid_volume, ask_volume
+        self.grid = CompiledGrid(*self.params)
+        self.ladder = OrderLadder(self.params.number_of_steps)
+        self.matcher = QueueMatcher()
+        self.orders_version = 0 # as OpenOrders.versions: any change of the live orders
+        self.sent_fingerprint = None
+        self.busy = {"flow": False, "hedger": False, "grid": False}
+        self.due = {"flow": False, "hedger": False, "grid": False}
+        self.risk_open = False
+        self.cycles = self.skipped = self.requests = 0
+
+    def schedule(self, at, callback, *args):
+        self.sequence += 1
+        heapq.heappush(self.pending, (at, self.sequence, callback, args))
+
+# actions due up to (and at) a market event run before it: they act on the state the venue had then
+    def run_pending(self, until):
+        pending = self.pending
+        while pending and pending[0][0] <= until:
+            self.now, _, callback, args = heapq.heappop(pending)
+            callback(*args)
+
+    def run(self):
+        timer = time.perf_counter()
+        self.reset()
+        times, kinds, indexes = self.data.events()
+        ib_ticks, moex_books = self.data.ib_ticks, self.data.moex_books
+        ib_columns = list(zip(ib_ticks["bid"].tolist(), ib_ticks["ask"].tolist()))
+        moex_columns = list(zip(*[moex_books[name].tolist() for name in ("bid", "ask", "deep_bid", "deep_ask", "bid_volume", "ask_volume")]))
+        on_tick = self.on_flow_signal if self.strategy == STRATEGY_LIMIT_GRID else self.on_grid_signal
+        for now, kind, index in zip(times.tolist(), kinds.tolist(), indexes.tolist()):
+            if self.pending and self.pending[0][0] <= now:
+                self.run_pending(now)
+            self.now = now
+            if kind == EVENT_IB:
+                self.ib_bid, self.ib_ask = ib_columns[index]
+                on_tick()
+            else:
+                self.book = moex_columns[index]
+                if self.strategy == STRATEGY_LIMIT_GRID:
+                    self.on_moex_fills(self.matcher.on_book(self.book[0], self.book[1], self.book[4], self.book[5]))
+                else:
+                    self.on_grid_signal()
+        self.run_pending(math.inf)
+        return self.result(times, time.perf_counter() - timer)
+
+    def trade(self, venue, volume, price):
+        self.trades.append((self.now, venue, volume, price))
+        if venue == VENUE_MOEX:
+            self.moex_pose += volume
+        else:
+            self.nymex_pose += volume
+
+# loops: a signal runs the loop if it is free, otherwise it runs once more when the current pass ends
+    def signal(self, loop, run):
+        if self.busy[loop]:
+            self.due[loop] = True
+        else:
+            run()
+
+    def done(self, loop, run, again = False):
+        self.busy[loop] = False
+        if self.due[loop] or again:
+            self.due[loop] = False
+            run()
+
+    def hold(self, loop, until, run, again = False):
+        self.busy[loop] = True
+        self.schedule(until, self.done, loop, run, again)
+
+# limit grid: order_flow
+    def on_flow_signal(self):
+        self.signal("flow", self.order_flow)
+
+    def order_flow(self):
+        if math.isnan(self.ib_bid) or math.isnan(self.ib_ask):
+            return
+        ladder = self.ladder
+        ladder.update(*self.grid.ladder(self.ib_bid, self.ib_ask, self.moex_pose, self.moex_max_lots, self.decimals))
+        fingerprint = ladder.fingerprint()
+        if (fingerprint, self.orders_version) == self.sent_fingerprint:
+            self.cycles += 1
+            self.skipped += 1
+            return
+        self.sent_fingerprint = None
+        self.cycles += 1
+        to_cancel, to_modify, to_place = ladder.reconcile(self.matcher.orders, self.tick_size, self.price_tolerance_ticks)
+        # cancels and modifies as one batch, new orders in a second batch only if nothing was cancelled
+        round_trip = 2 * self.moex_latency
+        finished = self.now
+        if to_cancel or to_modify:
+            for ticket in to_cancel:
+                self.schedule(self.now + self.moex_latency, self.cancel_order, ticket)
+            for ticket, price, volume in to_modify:
+                self.schedule(self.now + self.moex_latency, self.modify_order, ticket, price, volume)
+            finished += round_trip
+        if not to_cancel:
+            for level, _, order_type, volume, price in ladder.orders(to_place):
+                order = self.matcher.new_order(level, order_type, price, volume)
+                ladder.set_ticket(level, order.ticket)
+                self.schedule(finished + self.moex_latency, self.place_order, order)
+            if to_place:
+                finished += round_trip
+        self.requests += len(to_cancel) + len(to_modify) + (0 if to_cancel else len(to_place))
+        # the ladder is fully placed only without cancels (order_flow waits for the cancel results otherwise)
+        self.busy["flow"] = True
+        self.schedule(finished, self.order_flow_done, None if to_cancel else fingerprint)
+
+    def order_flow_done(self, fingerprint):
+        if fingerprint is not None:
+            self.sent_fingerprint = (fingerprint, self.orders_version)
+        self.done("flow", self.order_flow)
+
+    def place_order(self, order):
+        self.orders_version += 1
+        self.on_moex_fills(self.matcher.activate(order))
+
+    def modify_order(self, ticket, price, volume):
+        self.orders_version += 1
+        self.on_moex_fills(self.matcher.modify(ticket, price, volume))
+
+    def cancel_order(self, ticket):
+        self.orders_version += 1
+        self.matcher.cancel(ticket)
+
+    def on_moex_fills(self, fills):
+        if not fills:
+            return
+        for order, price, volume in fills:
+            self.trade(VENUE_MOEX, volume if order.type == ORDER_TYPE_BUY_LIMIT else -volume, price)
+        self.orders_version += 1
+        # fills reach the strategy as a position update (order_flow and hedger)
+        self.schedule(self.now + self.moex_latency, self.on_position)
+
+    def on_position(self):
+        self.on_flow_signal()
+        self.signal("hedger", self.hedger)
+
+# limit grid: hedger
+    def hedger(self):
+        lots_to_trade = hedge_lots(self.moex_pose, self.nymex_pose, self.lots, self.max_risk, self.nymex_max_lots)
+        self.risk_open = lots_to_trade != 0
+        finished = self.now + self.hedger_interval
+        if self.risk_open:
+            self.requests += 1
+            self.schedule(self.now + self.ib_latency, self.ib_market_order, float(lots_to_trade))
+            finished += 2 * self.ib_latency
+        # with open risk the hedger checks again without waiting for a position update
+        self.hold("hedger", finished, self.hedger, self.risk_open)
+
+    def ib_market_order(self, volume):
+        self.trade(VENUE_NYMEX, volume, self.ib_ask if volume > 0 else self.ib_bid)
+
+# market grid: grid
+    def on_grid_signal(self):
+        self.signal("grid", self.grid_step)
+
+    def grid_step(self):
+        deep_bid, deep_ask = self.book[2], self.book[3]
+        if math.isnan(self.ib_bid) or math.isnan(self.ib_ask) or math.isnan(deep_bid) or math.isnan(deep_ask):
+            return
+        signal = grid_signal(self.grid, deep_bid, deep_ask, self.ib_bid, self.ib_ask, self.moex_pose)
+        if signal == SIGNAL_NONE:
+            return
+        self.cycles += 1
+        self.requests += 2
+        # MOEX market order round trip, then the IB order and its fill
+        self.schedule(self.now + self.moex_latency, self.moex_market_order, signal * self.lots)
+        ib_sent = self.now + 2 * self.moex_latency
+        self.schedule(ib_sent + self.ib_latency, self.ib_market_order, float(-signal))
+        self.hold("grid", ib_sent + 2 * self.ib_latency, self.grid_step, True)
+
+    def moex_market_order(self, volume):
+        self.trade(VENUE_MOEX, volume, self.book[3] if volume > 0 else self.book[2])
+
+# trades, marked to market at every event with the last mid prices
+    def result(self, times, run_time):
+        trades = np.array(self.trades, dtype=TRADE_DTYPE)
+        if len(trades):
+            trades = trades[np.argsort(trades["time"], kind="stable")]
+        ib_ticks, moex_books = self.data.ib_ticks, self.data.moex_books
+        ib_mid = (ib_ticks["bid"] + ib_ticks["ask"]) / 2
+        moex_mid = (moex_books["bid"] + moex_books["ask"]) / 2
+        ib_index = np.searchsorted(ib_ticks["time"], times, side="right") - 1
+        moex_index = np.searchsorted(moex_books["time"], times, side="right") - 1
+        ib_mark = np.where(ib_index >= 0, ib_mid[np.maximum(ib_index, 0)], np.nan)
+        moex_mark = np.where(moex_index >= 0, moex_mid[np.maximum(moex_index, 0)], np.nan)
+        trade_index = np.searchsorted(trades["time"], times, side="right") # trades done by each event
+        columns = {}
+        for venue, start_pose in ((VENUE_MOEX, self.start_moex_pose), (VENUE_NYMEX, self.start_nymex_pose)):
+            venue_trades = trades["venue"] == venue
+            volume = np.where(venue_trades, trades["volume"], 0.0)
+            pose = np.concatenate(([0.0], np.cumsum(volume)))[trade_index] + start_pose
+            cash = np.concatenate(([0.0], np.cumsum(-volume * trades["price"])))[trade_index]
+            columns[venue] = (pose, cash, int(venue_trades.sum()), float(np.abs(volume).sum()))
+        moex_pose, moex_cash, moex_trades, moex_volume = columns[VENUE_MOEX]
+        nymex_pose, nymex_cash, nymex_trades, nymex_volume = columns[VENUE_NYMEX]
+        # starting positions are valued at the first prices
+        moex_start = self.start_moex_pose * first_valid(moex_mark)
+        nymex_start = self.start_nymex_pose * first_valid(ib_mark)
+        moex_value = moex_cash + np.nan_to_num(moex_pose * moex_mark - moex_start)
+        nymex_value = nymex_cash + np.nan_to_num(nymex_pose * ib_mark - nymex_start)
+        equity = moex_value + nymex_value * self.lots
+        open_risk = moex_pose + nymex_pose * self.lots
+        drawdown = np.maximum.accumulate(equity) - equity if len(equity) else np.zeros(1)
+        duration = float(times[-1] - times[0]) if len(times) else 0.0
+        summary = {
+            "pnl": float(equity[-1]) if len(equity) else 0.0,
+            "max_drawdown": float(drawdown.max()),
+            "moex_trades": moex_trades,
+            "moex_volume": moex_volume,
+            "nymex_trades": nymex_trades,
+            "nymex_volume": nymex_volume,
+            "moex_pose": float(self.moex_pose),
+            "nymex_pose": float(self.nymex_pose),
+            "max_open_risk": float(np.abs(open_risk).max()) if len(open_risk) else 0.0,
+            "cycles": self.cycles,
+            "skipped": self.skipped,
+            "requests": self.requests,
+            "events": len(times),
+            "run_time": run_time,
+            "speed": duration / run_time if run_time > 0 else math.inf, # simulated seconds per second
+        }
+        return BacktestResult(trades, times, equity, open_risk, summary)
@@ -0,0 +1,112 @@
+# matching.py
+# simulated MOEX limit orders of a backtest, filled against recorded book snapshots with a queue position model.
+# A snapshot has the best prices and their volumes only, so the queue is inferred:
+#  - an order joining the best level queues behind its volume; one inside the spread is first in the queue;
+#  - a decrease of the volume at the order's price is taken as trades: it consumes the queue ahead, the rest fills the order;
+#  - the queue ahead never grows and is capped by the level volume (cancels ahead of the order);
+#  - the opposite best price reaching the order's price trades through it: filled in full at the order's price;
+#  - a marketable order (buy at or above the ask) fills in full at the touch on arrival.
+# With unknown level volumes (nan) an order at the best level fills only when the price trades through it
+import math
+from data_processing.order_ladder import ORDER_TYPE_BUY_LIMIT
+
+
+class SimLimitOrder:
+    __slots__ = ("ticket", "level", "type", "price_open", "volume_initial", "volume_current", "active",
+                 "queue_ahead", "level_volume")
+
+    def __init__(self, ticket, level, type, price, volume):
+        self.ticket = ticket
+        self.level = level # ladder level of the strategy
+        self.type = type # ORDER_TYPE_BUY_LIMIT / ORDER_TYPE_SELL_LIMIT
+        self.price_open = price # names of OrderRecord: the strategy reconciles its ladder against these
+        self.volume_initial = volume
+        self.volume_current = volume
+        self.active = False # False until the order reaches the exchange
+        self.queue_ahead = math.inf # lots ahead of the order at its price
+        self.level_volume = None # volume at the order's price in the last snapshot it was the best price, None if not
+
+
+class QueueMatcher:
+    def __init__(self):
+        self.orders = {} # ticket : SimLimitOrder sent and not filled or cancelled (what the strategy sees)
+        self.next_ticket = 1
+        self.book = None # last snapshot (bid, ask, bid_volume, ask_volume)
+
+    def new_order(self, level, type, price, volume):
+        order = SimLimitOrder(self.next_ticket, level, type, price, volume)
+        self.next_ticket += 1
+        self.orders[order.ticket] = order
+        return order
+
+# the order reaches the exchange. Returns [(order, price, volume)] filled
+    def activate(self, order):
+        if order.ticket not in self.orders:
+            return []
+        order.active = True
+        order.queue_ahead = math.inf
+        order.level_volume = None
+        if self.book is None:
+            return []
+        bid, ask = self.book[0], self.book[1]
+        if order.type == ORDER_TYPE_BUY_LIMIT and order.price_open >= ask:
+            return [self._fill(order, ask, order.volume_current)]
+        if order.type != ORDER_TYPE_BUY_LIMIT and order.price_open <= bid:
+            return [self._fill(order, bid, order.volume_current)]
+        self._queue(order, *self.book)
+        return []
+
+    def cancel(self, ticket):
+        return self.orders.pop(ticket, None)
+
+# new price loses the queue position, as on the exchange
+    def modify(self, ticket, price, volume = None):
+        order = self.orders.get(ticket)
+        if order is None:
+            return []
+        order.price_open = price
+        if volume is not None:
+            order.volume_current = volume
+        return self.activate(order)
+
+# new snapshot. Returns [(order, price, volume)] filled
+    def on_book(self, bid, ask, bid_volume, ask_volume):
+        self.book = (bid, ask, bid_volume, ask_volume)
+        fills = []
+        for order in list(self.orders.values()):
+            if order.active:
+                volume = self._queue(order, bid, ask, bid_volume, ask_volume)
+                if volume > 0:
+                    fills.append(self._fill(order, order.price_open, volume))
+        return fills
+
+# updates the queue of a resting order. Returns the volume filled by the snapshot
+    def _queue(self, order, bid, ask, bid_volume, ask_volume):
+        price = order.price_open
+        if order.type == ORDER_TYPE_BUY_LIMIT:
+            through, best, volume, inside = ask <= price, bid == price, bid_volume, bid < price
+        else:
+            through, best, volume, inside = bid >= price, ask == price, ask_volume, ask > price
+        if through:
+            return order.volume_current
+        if inside:
+            order.queue_ahead = 0.0
+            order.level_volume = None
+            return 0
+        if not best or volume != volume: # not the best price or unknown volume
+            order.level_volume = None
+            return 0
+        filled = 0
+        if order.level_volume is not None and volume < order.level_volume:
+            traded = order.level_volume - volume
+            filled = min(max(traded - order.queue_ahead, 0), order.volume_current)
+            order.queue_ahead = max(order.queue_ahead - traded, 0)
+        order.queue_ahead = min(order.queue_ahead, volume)
+        order.level_volume = volume
+        return filled
+
+    def _fill(self, order, price, volume):
+        order.volume_current -= volume
+        if order.volume_current <= 0:
+            self.orders.pop(order.ticket, None)
+        return order, price, volume
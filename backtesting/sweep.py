@@ -0,0 +1,221 @@
+# sweep.py
+# parameter sweep of the grid strategies over spread_step / pose_step / number_of_steps / mid_spread / mid_pose.
+# The market data is saved once as .npy files and memory mapped by every worker process, so only parameters and
+# result rows cross process boundaries. Results are written to SQLite as they arrive and a sweep run again under
+# the same name skips the combinations already stored (resume after an interruption)
+# run from the project root: python -m backtesting.sweep --help
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from config import SWEEP_DATABASE_FILE_PATH, SWEEP_DATA_DIRECTORY, SWEEP_WORKERS
+from backtesting.data import MarketData, synthetic_market_data
+from backtesting.engine import Backtester, GridParams, STRATEGY_LIMIT_GRID, STRATEGY_GRID
+
+IB_TICKS_FILE = "ib_ticks.npy"
+MOEX_BOOKS_FILE = "moex_books.npy"
+
+# per combination: pnl and max_drawdown in price units x MOEX lots, turnover in MOEX lots (IB lots x lots),
+# orders - MOEX / IB order requests sent, max_open_risk - peak unhedged MOEX lots
+RESULT_COLUMNS = ("pnl", "turnover", "orders", "max_open_risk", "max_drawdown", "moex_trades", "nymex_trades", "run_time")
+
+
+# all combinations of the values, as GridParams
+def parameter_grid(spread_steps, pose_steps, numbers_of_steps, mid_spreads = (0.0,), mid_poses = (0,)):
+    return [GridParams(*values) for values in itertools.product(spread_steps, pose_steps, numbers_of_steps, mid_spreads, mid_poses)]
+
+
+# "start:stop:step" (stop included) or "a,b,c"
+def value_range(text, type = float):
+    if ":" in text:
+        start, stop, step = (float(value) for value in text.split(":"))
+        values = np.around(np.arange(start, stop + step / 2, step), 10).tolist()
+    else:
+        values = [float(value) for value in text.split(",")]
+    return [type(value) for value in values]
+
+
+def save_market_data(data, directory):
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, IB_TICKS_FILE), data.ib_ticks)
+    np.save(os.path.join(directory, MOEX_BOOKS_FILE), data.moex_books)
+
+
+# content hash of the market data files: a resumed sweep must run on the same data, whatever the directory name
+def market_data_hash(directory, chunk_size = 1 << 20):
+    digest = hashlib.sha256()
+    for file_name in (IB_TICKS_FILE, MOEX_BOOKS_FILE):
+        with open(os.path.join(directory, file_name), "rb") as file:
+            while chunk := file.read(chunk_size):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+# read-only memory maps: the pages are shared by all processes through the OS cache
+def load_market_data(directory):
+    return MarketData(np.load(os.path.join(directory, IB_TICKS_FILE), mmap_mode="r"),
+                      np.load(os.path.join(directory, MOEX_BOOKS_FILE), mmap_mode="r"))
+
+
+def result_row(summary, lots):
+    return {
+        "pnl": summary["pnl"],
+        "turnover": summary["moex_volume"] + summary["nymex_volume"] * lots,
+        "orders": summary["requests"],
+        "max_open_risk": summary["max_open_risk"],
+        "max_drawdown": summary["max_drawdown"],
+        "moex_trades": summary["moex_trades"],
+        "nymex_trades": summary["nymex_trades"],
+        "run_time": summary["run_time"],
+    }
+
+
+# worker process: market data mapped once, then one backtest per combination
+worker_state = {}
+
+def init_worker(directory, options):
+    worker_state["data"] = load_market_data(directory)
+    worker_state["options"] = options
+
+def run_combination(params):
+    options = worker_state["options"]
+    result = Backtester(worker_state["data"], params, **options).run()
+    return params, result_row(result.summary, options.get("lots", 100))
+
+
+class SweepStore:
+    def __init__(self, db_path = SWEEP_DATABASE_FILE_PATH):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS sweeps (
+                name TEXT PRIMARY KEY,
+                data_directory TEXT,
+                options TEXT,
+                created DATETIME,
+                data_hash TEXT
+            )
+        """)
+        if "data_hash" not in {row[1] for row in self.db.execute("PRAGMA table_info(sweeps)")}: # databases of earlier versions
+            self.db.execute("ALTER TABLE sweeps ADD COLUMN data_hash TEXT")
+        self.db.execute(f"""
+            CREATE TABLE IF NOT EXISTS sweep_results (
+                sweep TEXT,
+                spread_step REAL,
+                pose_step REAL,
+                number_of_steps INTEGER,
+                mid_spread REAL,
+                mid_pose REAL,
+                {", ".join(f"{column} REAL" for column in RESULT_COLUMNS)},
+                PRIMARY KEY (sweep, spread_step, pose_step, number_of_steps, mid_spread, mid_pose)
+            )
+        """)
+        self.db.commit()
+
+    def exists(self, name):
+        return self.db.execute("SELECT 1 FROM sweeps WHERE name = ?", (name,)).fetchone() is not None
+
+# registers the sweep; resuming needs the same data (directory and content) and backtest options, results would not be comparable otherwise
+    def open_sweep(self, name, data_directory, options, data_hash = None):
+        options = json.dumps(options, sort_keys=True)
+        row = self.db.execute("SELECT data_directory, options, data_hash FROM sweeps WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO sweeps (name, data_directory, options, created, data_hash) VALUES (?, ?, ?, ?, ?)",
+                            (name, data_directory, options, datetime.now(), data_hash))
+            self.db.commit()
+        elif row[:2] != (data_directory, options):
+            raise ValueError(f"sweep {name} exists with data {row[0]} and options {row[1]}")
+        elif row[2] is None: # registered before data hashes were stored, nothing to compare with
+            print(f"{datetime.now()}: sweep {name} has no data hash, storing the current one")
+            self.db.execute("UPDATE sweeps SET data_hash = ? WHERE name = ?", (data_hash, name))
+            self.db.commit()
+        elif data_hash is not None and row[2] != data_hash:
+            raise ValueError(f"sweep {name} exists, the data in {data_directory} changed since it started (hash {row[2][:12]}, now {data_hash[:12]})")
+
+    def done(self, name):
+        rows = self.db.execute("SELECT spread_step, pose_step, number_of_steps, mid_spread, mid_pose FROM sweep_results WHERE sweep = ?", (name,))
+        return {GridParams(*row) for row in rows}
+
+    def add(self, name, params, row):
+        columns = GridParams._fields + RESULT_COLUMNS
+        self.db.execute(f"INSERT OR REPLACE INTO sweep_results (sweep, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})",
+                        (name, *params, *(row[column] for column in RESULT_COLUMNS)))
+        self.db.commit()
+
+    def results(self, name, order_by = "pnl"):
+        return pd.read_sql_query(f"SELECT * FROM sweep_results WHERE sweep = ? ORDER BY {order_by} DESC", self.db, params=(name,))
+
+    def close(self):
+        self.db.close()
+
+
+def run_sweep(name, data_directory, combinations, options, db_path = SWEEP_DATABASE_FILE_PATH, workers = SWEEP_WORKERS):
+    store = SweepStore(db_path)
+    try:
+        store.open_sweep(name, data_directory, options, market_data_hash(data_directory))
+        done = store.done(name)
+        todo = [params for params in combinations if params not in done]
+        print(f"{datetime.now()}: sweep {name}: {len(combinations)} combinations, {len(combinations) - len(todo)} already done, {len(todo)} to run")
+        if todo:
+            context = multiprocessing.get_context("spawn") # same on Windows and elsewhere
+            with context.Pool(workers, initializer=init_worker, initargs=(data_directory, options)) as pool:
+                for count, (params, row) in enumerate(pool.imap_unordered(run_combination, todo), 1):
+                    store.add(name, params, row)
+                    print(f"{datetime.now()}: {count}/{len(todo)} {tuple(params)}: pnl {row['pnl']:.3f}, turnover {row['turnover']:.0f}, "
+                          f"orders {row['orders']:.0f}, max open risk {row['max_open_risk']:.0f}")
+        return store.results(name)
+    finally:
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="grid strategy parameter sweep. Ranges as start:stop:step (stop included) or a,b,c")
+    parser.add_argument("--name", required=True, help="sweep name, run again to resume")
+    parser.add_argument("--data", default=SWEEP_DATA_DIRECTORY, help=f"directory with {IB_TICKS_FILE} and {MOEX_BOOKS_FILE}")
+    parser.add_argument("--synthetic", type=float, metavar="SECONDS", help="write a synthetic market of this length to --data first")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--strategy", choices=[STRATEGY_LIMIT_GRID, STRATEGY_GRID], default=STRATEGY_LIMIT_GRID)
+    parser.add_argument("--spread-step", required=True)
+    parser.add_argument("--pose-step", required=True)
+    parser.add_argument("--number-of-steps", required=True)
+    parser.add_argument("--mid-spread", default="0")
+    parser.add_argument("--mid-pose", default="0")
+    parser.add_argument("--lots", type=float, default=117)
+    parser.add_argument("--moex-max-lots", type=float, default=117)
+    parser.add_argument("--nymex-max-lots", type=float, default=1)
+    parser.add_argument("--risk-coef", type=float, default=0.66)
+    parser.add_argument("--decimals", type=int, default=3)
+    parser.add_argument("--price-tolerance-ticks", type=int, default=0)
+    parser.add_argument("--moex-latency", type=float, default=0.010)
+    parser.add_argument("--ib-latency", type=float, default=0.050)
+    parser.add_argument("--workers", type=int, default=SWEEP_WORKERS)
+    parser.add_argument("--db", default=SWEEP_DATABASE_FILE_PATH)
+    parser.add_argument("--top", type=int, default=20, help="best combinations to print")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        if args.seed is None:
+            store = SweepStore(args.db)
+            try:
+                if store.exists(args.name): # an unseeded market differs every time, the finished combinations would not match it
+                    parser.error(f"sweep {args.name} exists: pass the --seed it was started with to resume with --synthetic, or drop --synthetic")
+            finally:
+                store.close()
+        save_market_data(synthetic_market_data(args.synthetic, seed=args.seed), args.data)
+    combinations = parameter_grid(value_range(args.spread_step), value_range(args.pose_step), value_range(args.number_of_steps, int),
+                                  value_range(args.mid_spread), value_range(args.mid_pose))
+    options = {"strategy": args.strategy, "lots": args.lots, "moex_max_lots": args.moex_max_lots, "nymex_max_lots": args.nymex_max_lots,
+               "risk_coef": args.risk_coef, "decimals": args.decimals, "price_tolerance_ticks": args.price_tolerance_ticks,
+               "moex_latency": args.moex_latency, "ib_latency": args.ib_latency}
+    results = run_sweep(args.name, os.path.abspath(args.data), combinations, options, args.db, args.workers)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(results.head(args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
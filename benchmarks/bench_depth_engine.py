@@ -0,0 +1,61 @@
+# bench_depth_engine.py
+# compares numpy depth walk (moex_connection.depth_engine) with the previous pandas deep quotes calculation
+# run from the project root: python -m benchmarks.bench_depth_engine
+import timeit
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from moex_connection.depth_engine import deep_quotes_ladder
+
+BookInfo = namedtuple("BookInfo", ["type", "price", "volume", "volume_dbl"])
+
+
+# synthetic mt5.market_book_get result: asks descending then bids descending, as the terminal sends them
+def synthetic_book(levels, mid=2.5, tick=0.001, seed=0):
+    rng = np.random.default_rng(seed)
+    volumes = rng.integers(1, 200, size=2 * levels)
+    asks = [BookInfo(1, round(mid + tick * (levels - i), 3), int(v), float(v)) for i, v in enumerate(volumes[:levels])]
+    bids = [BookInfo(2, round(mid - tick * (i + 1), 3), int(v), float(v)) for i, v in enumerate(volumes[levels:])]
+    return tuple(asks + bids)
+
+
+# previous MoexAsyncWrapper.symbol_deep_quotes calculation, one size per call
+def pandas_deep_quotes(quotes, lots):
+    Order_book = pd.DataFrame(list(quotes), columns = ["type","price","volume","volume_dbl"])
+    Ask_book = Order_book.loc[Order_book["type"] == 1].sort_values(by = "price", ascending = True)
+    Bid_book = Order_book.loc[Order_book["type"] == 2].sort_values(by = "price", ascending = False)
+    current_ask = Ask_book["price"].min()
+    current_bid = Bid_book["price"].max()
+    if lots > Ask_book["volume_dbl"].sum() or lots > Bid_book["volume_dbl"].sum():
+        return current_bid, current_ask, np.nan, np.nan
+    Ask_book["technical"] = Ask_book["volume_dbl"] + lots - Ask_book["volume_dbl"].cumsum()
+    Ask_book = Ask_book[Ask_book["technical"]>0]
+    Deep_ask = ((Ask_book[["volume_dbl","technical"]].min(axis=1) * Ask_book["price"]).sum()/lots)
+    Bid_book["technical"] = Bid_book["volume_dbl"] + lots - Bid_book["volume_dbl"].cumsum()
+    Bid_book = Bid_book[Bid_book["technical"]>0]
+    Deep_bid = ((Bid_book[["volume_dbl","technical"]].min(axis=1) * Bid_book["price"]).sum()/lots)
+    return current_bid, current_ask, Deep_bid, Deep_ask
+
+
+def main(lots=117, multiples=(1, 2, 3), number=200):
+    sizes = np.asarray(multiples, dtype=np.float64) * lots
+    print(f"lots = {lots}, sizes = {sizes.tolist()}, {number} runs each")
+    for levels in (10, 50, 200):
+        quotes = synthetic_book(levels)
+
+        # same results for every size before timing
+        _, _, bid_vwap, bid_filled, ask_vwap, ask_filled = deep_quotes_ladder(quotes, sizes)
+        for i, size in enumerate(sizes):
+            _, _, deep_bid, deep_ask = pandas_deep_quotes(quotes, size)
+            if bid_filled[i] and ask_filled[i]:
+                assert np.isclose(deep_bid, bid_vwap[i]) and np.isclose(deep_ask, ask_vwap[i]), (levels, size)
+            else:
+                assert np.isnan(deep_bid) and np.isnan(deep_ask), (levels, size)
+
+        pandas_time = timeit.timeit(lambda: [pandas_deep_quotes(quotes, size) for size in sizes], number=number) / number
+        numpy_time = timeit.timeit(lambda: deep_quotes_ladder(quotes, sizes), number=number) / number
+        print(f"{levels:>4} levels: pandas {pandas_time * 1e6:9.1f} us, numpy {numpy_time * 1e6:7.1f} us, speedup x{pandas_time / numpy_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
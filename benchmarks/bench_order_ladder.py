@@ -0,0 +1,103 @@
+# bench_order_ladder.py
+# compares the array target ladder + ticket reconciliation (data_processing.order_ladder) with the previous
+# pandas loop + outer merge of order_flow, and the ladder from the cached templates of data_processing.compiled_grid
+# run from the project root: python -m benchmarks.bench_order_ladder
+import timeit
+import numpy as np
+import pandas as pd
+from data_processing.order_ladder import OrderLadder, target_ladder, ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_SELL_LIMIT
+from data_processing.compiled_grid import CompiledGrid
+from moex_connection.open_orders import OrderRecord
+
+SYMBOL = "NG-7.23"
+DECIMALS = 3
+MAX_LOTS = 117
+
+
+def grids(number_of_steps, spread_step = 0.002, pose_step = 117, mid_spread = 0.0, mid_pose = 0):
+    grid = [(i-(number_of_steps - 1)/2) for i in range(number_of_steps)]
+    spread_grid = np.around([spread_step * i + mid_spread for i in grid],3)
+    pose_grid = np.around([pose_step * i + mid_pose for i in grid],0)
+    return spread_grid, pose_grid
+
+
+# previous order_flow calculation: target orders cell by cell, then outer merge with live orders
+def pandas_order_flow(target_orders, moex_orders, spread_grid, pose_grid, ib_bid, ib_ask, moex_pose):
+    number_of_steps = len(spread_grid)
+    pose_index = np.searchsorted(pose_grid, moex_pose, side = "left")
+    orders = target_orders.copy()
+    for i in range(number_of_steps):
+        if i < pose_index:
+            orders.loc[number_of_steps-i-1,"type"] = ORDER_TYPE_SELL_LIMIT
+            orders.loc[number_of_steps-i-1,"price_open"] = np.around(ib_ask + spread_grid[number_of_steps-i-1],DECIMALS)
+            orders.loc[number_of_steps-i-1,"volume_current"] = np.around((np.min([(pose_grid[i+1] if i < (number_of_steps - 1) else moex_pose), moex_pose]) - (pose_grid[i]) ),0)
+        else:
+            orders.loc[number_of_steps-i-1,"type"] = ORDER_TYPE_BUY_LIMIT
+            orders.loc[number_of_steps-i-1,"price_open"] = np.around(ib_bid + spread_grid[number_of_steps-i-1], DECIMALS)
+            orders.loc[number_of_steps-i-1,"volume_current"] = np.around(( (pose_grid[i]) - np.max([(pose_grid[i-1] if i > 0 else moex_pose), moex_pose]) ),0)
+    orders = orders.sort_values(by=['price_open'], ascending=True)
+    orders = orders[orders["volume_current"] != 0]
+    orders["symbol"] = SYMBOL
+    orders_capped = orders.copy()
+    orders_capped["volume_current"] = np.minimum(orders_capped["volume_current"], MAX_LOTS)
+    orders_reset = orders_capped.reset_index(names="target_index")
+    merged = pd.merge(moex_orders, orders_reset, how = "outer", on = ['ticket', 'symbol', 'type', 'volume_current'], indicator = True)
+    cancel_df = merged[merged['_merge'] == 'left_only']
+    modify_df = merged[(merged['_merge'] == 'both') & (merged['price_open_x'] != merged['price_open_y'])]
+    place_df = merged[merged['_merge'] == 'right_only']
+    return orders_capped, cancel_df['ticket'].tolist(), modify_df[['ticket', 'price_open_y']].to_dict('records'), place_df["target_index"].to_list()
+
+
+# live orders placed for the ladder at a previous position / price, some of them partially filled
+def scenario(number_of_steps, seed = 0):
+    rng = np.random.default_rng(seed)
+    spread_grid, pose_grid = grids(number_of_steps)
+    ladder = OrderLadder(number_of_steps)
+    ladder.update(*target_ladder(spread_grid, pose_grid, 2.5, 2.502, 0.0, MAX_LOTS, DECIMALS))
+    live = {}
+    for n, (level, _, order_type, volume, price) in enumerate(ladder.orders()):
+        ticket = 1000 + n
+        ladder.set_ticket(level, ticket)
+        if rng.random() < 0.1:
+            volume -= 1 # partially filled
+        live[ticket] = OrderRecord(ticket, SYMBOL, order_type, volume, volume, price)
+    target_orders = pd.DataFrame({"ticket": ladder.tickets, "symbol": SYMBOL, "type": ladder.types, "volume_current": ladder.volumes, "price_open": ladder.prices})
+    target_orders = target_orders[target_orders["volume_current"] != 0].astype({"ticket": float})
+    records = sorted(live.values(), key=lambda record: record.price_open)
+    moex_orders = pd.DataFrame({"ticket": [record.ticket for record in records], "symbol": SYMBOL, "type": [record.type for record in records],
+                                "volume_current": [record.volume_current for record in records], "price_open": [record.price_open for record in records]})
+    return spread_grid, pose_grid, ladder, live, target_orders, moex_orders
+
+
+def main(number = 50):
+    ib_bid, ib_ask, moex_pose = 2.503, 2.505, 234.0 # prices and position moved since the orders were placed
+    for number_of_steps in (11, 51, 101, 201):
+        spread_grid, pose_grid, ladder, live, target_orders, moex_orders = scenario(number_of_steps)
+
+        # same decisions before timing
+        _, cancel, modify, place = pandas_order_flow(target_orders, moex_orders, spread_grid, pose_grid, ib_bid, ib_ask, moex_pose)
+        ladder.update(*target_ladder(spread_grid, pose_grid, ib_bid, ib_ask, moex_pose, MAX_LOTS, DECIMALS))
+        to_cancel, to_modify, to_place = ladder.reconcile(live)
+        assert sorted(cancel) == sorted(to_cancel), number_of_steps
+        assert sorted((int(item["ticket"]), item["price_open_y"]) for item in modify) == sorted((ticket, price) for ticket, price, _ in to_modify), number_of_steps
+        assert sorted(place) == sorted(to_place), number_of_steps
+        compiled = CompiledGrid(0.002, 117, number_of_steps, 0.0, 0)
+        for expected, result in zip(target_ladder(spread_grid, pose_grid, ib_bid, ib_ask, moex_pose, MAX_LOTS, DECIMALS),
+                                    compiled.ladder(ib_bid, ib_ask, moex_pose, MAX_LOTS, DECIMALS)):
+            assert (expected == result).all(), number_of_steps
+
+        def numpy_flow():
+            ladder.update(*target_ladder(spread_grid, pose_grid, ib_bid, ib_ask, moex_pose, MAX_LOTS, DECIMALS))
+            return ladder.reconcile(live)
+
+        pandas_time = timeit.timeit(lambda: pandas_order_flow(target_orders, moex_orders, spread_grid, pose_grid, ib_bid, ib_ask, moex_pose), number=number) / number
+        numpy_time = timeit.timeit(numpy_flow, number=number * 20) / (number * 20)
+        ladder_time = timeit.timeit(lambda: target_ladder(spread_grid, pose_grid, ib_bid, ib_ask, moex_pose, MAX_LOTS, DECIMALS), number=number * 20) / (number * 20)
+        compiled_time = timeit.timeit(lambda: compiled.ladder(ib_bid, ib_ask, moex_pose, MAX_LOTS, DECIMALS), number=number * 20) / (number * 20)
+        print(f"{number_of_steps:>4} levels: pandas {pandas_time * 1e3:8.2f} ms, numpy {numpy_time * 1e3:6.3f} ms, speedup x{pandas_time / numpy_time:.0f}, "
+              f"ladder only {ladder_time * 1e6:5.1f} us, cached template {compiled_time * 1e6:5.1f} us"
+              f"  (cancel {len(to_cancel)}, modify {len(to_modify)}, new {len(to_place)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# load_harness.py
+# load test of the live strategy code: N synthetic symbol pairs run limit grid trading in MeanReversionStrategy
+# against the in-process fakes (simulation.FakeMetaTrader5, simulation.FakeIB ticking at a set rate per contract).
+# Per (pairs, tick rate) point, after a warm up:
+#   signal -> submit   ib_signal_time of the IB tick to the first order request of a gateway batch sent to MT5
+#   signal -> ack      ib_signal_time to the gateway batch completed (order_batch_report)
+#   loop lag           overshoot of a 10 ms asyncio.sleep
+#   queue depths       ready callbacks of the event loop, asyncio tasks, MT5 executor queue, gateway requests in flight
+#   cpu                event loop thread (busy share of one core) and whole process per pair, fakes included
+# A point is sustainable if loop lag and signal -> submit stay under the limits (p99). Each point runs in a fresh
+# process; for each tick rate the pairs sweep stops at the first point that is not sustainable (--keep-going runs all).
+# run from the project root:
+#   python -m benchmarks.load_harness                                         pairs 1,2,4,8,16,32 x tick rates 10,100
+#   python -m benchmarks.load_harness --pairs 4,24,48 --tick-rates 50 --duration 30 --output load.csv
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+LOOP_LAG_INTERVAL = 0.01 # seconds slept by the lag probe
+QUEUE_SAMPLE_INTERVAL = 0.1 # seconds between queue depth samples
+MAX_LOOP_LAG = 0.05 # p99 loop lag of a sustainable point, seconds
+MAX_SUBMIT_LATENCY = 0.1 # p99 signal -> submit of a sustainable point, seconds
+
+# synthetic pairs: NG-like MOEX symbol and IB contract with the same mid
+PAIR_MID = 2.6
+PAIR_DECIMALS = 3
+PAIR_LOTS = 117
+PAIR_MAX_LOTS = 117
+PAIR_NYMEX_MAX_LOTS = 3
+PAIR_TOLERANCE_TICKS = 1
+GRID = (0.002, 117, 11, 0.0, 0) # spread_step, pose_step, number_of_steps, mid_spread, mid_pose
+
+
+def pair_symbols(pairs):
+    return [f"load{i}" for i in range(pairs)], [f"NG-L{i}" for i in range(pairs)], [f"NGL{i}" for i in range(pairs)]
+
+
+# the per symbol config lists are replaced in place, so modules that imported them see the synthetic pairs.
+# Only in the worker process of a point
+def configure_pairs(pairs):
+    import config
+    from ib_insync import Future
+    symbols, moex_symbols, nymex_symbols = pair_symbols(pairs)
+    config.INTERFACE_SYMBOLS[:] = symbols
+    config.MOEX_SYMBOLS[:] = moex_symbols
+    config.SYMBOL_DECIMALS[:] = [PAIR_DECIMALS] * pairs
+    config.MOEX_LOTS[:] = [PAIR_LOTS] * pairs
+    config.MOEX_MAX_LOTS[:] = [PAIR_MAX_LOTS] * pairs
+    config.MOEX_PRICE_TOLERANCE_TICKS[:] = [PAIR_TOLERANCE_TICKS] * pairs
+    config.NYMEX_MAX_LOTS[:] = [PAIR_NYMEX_MAX_LOTS] * pairs
+    config.NYMEX_CONTRACTS[:] = [Future(symbol = "NG", lastTradeDateOrContractMonth = "20991231", exchange = "NYMEX", localSymbol = symbol, currency = "USD")
+                                 for symbol in nymex_symbols]
+    return config
+
+
+class SilentBot:
+    async def send_message(self, text):
+        pass
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else np.nan
+
+
+class LoadProbe:
+    def __init__(self, strategy, moex_conn, nymex_conn):
+        self.strategy = strategy
+        self.moex_conn = moex_conn
+        self.ib = nymex_conn.ib
+        self.recording = False
+        self.clock_offset = time.time() - time.monotonic() # OrderRequest.sent is monotonic, ib_signal_time is wall clock
+        self.submit, self.ack, self.pose_ack = [], [], []
+        self.lags = []
+        self.queues = {"ready": [], "tasks": [], "mt5_queue": [], "in_flight": []}
+        # order_batch_report runs right after each gateway batch of order_flow, with the signal time of the cycle
+        report = strategy.order_batch_report
+        def order_batch_report(symbol, requests, ib_signal_time, signal_produced_by):
+            if self.recording and requests:
+                signal = ib_signal_time.timestamp()
+                if signal_produced_by == "ib_update":
+                    sent = [request.sent for request in requests if request.sent is not None]
+                    if sent:
+                        self.submit.append(min(sent) + self.clock_offset - signal)
+                    self.ack.append(time.time() - signal)
+                else:
+                    self.pose_ack.append(time.time() - signal)
+            report(symbol, requests, ib_signal_time, signal_produced_by)
+        strategy.order_batch_report = order_batch_report
+
+# loop lag every LOOP_LAG_INTERVAL, queue depths every QUEUE_SAMPLE_INTERVAL
+    async def sample(self):
+        loop = asyncio.get_running_loop()
+        next_queue_sample = 0.0
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            if not self.recording:
+                continue
+            self.lags.append(now - start - LOOP_LAG_INTERVAL)
+            if now >= next_queue_sample:
+                next_queue_sample = now + QUEUE_SAMPLE_INTERVAL
+                self.queues["ready"].append(len(getattr(loop, "_ready", ()))) # callbacks due, the run queue of the loop
+                self.queues["tasks"].append(len(asyncio.all_tasks()))
+                self.queues["mt5_queue"].append(self.moex_conn.executor._queue.qsize())
+                self.queues["in_flight"].append(len(self.strategy.order_gateway.in_flight))
+
+# called on the loop thread: thread_time is the event loop's CPU
+    def start(self):
+        churn = self.strategy.order_churn
+        self.start_state = (time.monotonic(), time.process_time(), time.thread_time(), self.ib.ticks_sent, self.ib.batches_sent,
+                            sum(churn.cycles.values()), sum(churn.skipped.values()))
+        self.recording = True
+
+    def stop(self, pairs, tick_rate):
+        self.recording = False
+        churn = self.strategy.order_churn
+        start, process_cpu, loop_cpu, ticks, batches, cycles, skipped = self.start_state
+        wall = time.monotonic() - start
+        cycles = sum(churn.cycles.values()) - cycles
+        skipped = sum(churn.skipped.values()) - skipped
+        row = {
+            "pairs": pairs,
+            "tick_rate": tick_rate,
+            "ticks_per_s": (self.ib.ticks_sent - ticks) / wall,
+            "batches_per_s": (self.ib.batches_sent - batches) / wall,
+            "cycles_per_s": cycles / wall,
+            "skipped_share": skipped / cycles if cycles else np.nan,
+            "order_batches": len(self.ack),
+            "submit_p50_ms": percentile(self.submit, 50) * 1e3,
+            "submit_p99_ms": percentile(self.submit, 99) * 1e3,
+            "submit_p999_ms": percentile(self.submit, 99.9) * 1e3,
+            "ack_p50_ms": percentile(self.ack, 50) * 1e3,
+            "ack_p99_ms": percentile(self.ack, 99) * 1e3,
+            "pose_ack_p99_ms": percentile(self.pose_ack, 99) * 1e3,
+            "lag_p50_ms": percentile(self.lags, 50) * 1e3,
+            "lag_p99_ms": percentile(self.lags, 99) * 1e3,
+            "lag_max_ms": max(self.lags, default=np.nan) * 1e3,
+            "loop_cpu": (time.thread_time() - loop_cpu) / wall, # 1.0 - the loop thread is saturated
+            "cpu_ms_per_pair_s": (time.process_time() - process_cpu) / wall / pairs * 1e3,
+        }
+        for name, values in self.queues.items():
+            row[f"{name}_mean"] = float(np.mean(values)) if values else np.nan
+            row[f"{name}_max"] = max(values, default=0)
+        row["sustainable"] = bool(row["lag_p99_ms"] <= MAX_LOOP_LAG * 1e3 and not row["submit_p99_ms"] > MAX_SUBMIT_LATENCY * 1e3)
+        return row
+
+
+async def run_load(pairs, tick_rate, duration, warmup, volatility, seed):
+    config = configure_pairs(pairs)
+    _, moex_symbols, _ = pair_symbols(pairs)
+    # the fake MetaTrader5 module has to be in place before the connectors and the strategy are imported
+    from simulation import FakeMetaTrader5, SymbolSpec, FakeIB, install_fake_mt5
+    install_fake_mt5(FakeMetaTrader5([SymbolSpec(symbol, PAIR_MID, PAIR_DECIMALS) for symbol in moex_symbols], seed=seed))
+    from moex_connection.moex_async_wrapper import MoexAsyncWrapper
+    from nymex_connection.nymex_async_wrapper import NymexAsyncWrapper
+    from data_processing import MeanReversionStrategy
+
+    moex_conn = MoexAsyncWrapper(config.MOEX_LOGIN, config.MOEX_PASSWORD, config.MOEX_SERVER, config.MOEX_SYMBOLS, config.MOEX_LOTS)
+    await moex_conn.initialize()
+    ib = FakeIB(tick_rate=tick_rate, volatility=volatility, mids={"NG": PAIR_MID}, seed=seed)
+    nymex_conn = NymexAsyncWrapper(config.NYMEX_API_KEY, config.NYMEX_HOST, config.NYMEX_PORT, config.NYMEX_CONTRACTS, ib=ib)
+    await nymex_conn.initialize()
+
+    strategy = MeanReversionStrategy(moex_conn, nymex_conn, None, scheduler = False)
+    strategy.set_bot(SilentBot())
+    probe = LoadProbe(strategy, moex_conn, nymex_conn)
+    sampler = asyncio.create_task(probe.sample())
+    await strategy.run()
+    trading = [asyncio.create_task(strategy.start_limit_trading(symbol, *GRID)) for symbol in strategy.symbols]
+
+    await asyncio.sleep(warmup)
+    probe.start()
+    await asyncio.sleep(duration)
+    row = probe.stop(pairs, tick_rate)
+
+    for symbol in list(strategy.active_trades):
+        try:
+            await asyncio.wait_for(strategy.stop_trading(symbol), 10)
+        except asyncio.TimeoutError:
+            print(f"{datetime.now()}: {symbol} not stopped in 10 seconds")
+    for task in trading + [sampler]:
+        task.cancel()
+    ib.disconnect()
+    await moex_conn.close()
+    return row
+
+
+# worker process entry: strategy output goes to devnull unless verbose (the prints are still formatted and written)
+def run_point(pairs, tick_rate, duration, warmup, volatility, seed, verbose):
+    if verbose:
+        return asyncio.run(run_load(pairs, tick_rate, duration, warmup, volatility, seed))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return asyncio.run(run_load(pairs, tick_rate, duration, warmup, volatility, seed))
+
+
+# pairs x tick rates, one fresh process per point (the fakes and the patched config are per process)
+def sweep(pairs_values, tick_rates, duration, warmup, volatility = 20.0, seed = None, keep_going = False, verbose = False):
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for tick_rate in tick_rates:
+        for pairs in sorted(pairs_values):
+            with context.Pool(1) as pool:
+                row = pool.apply(run_point, (pairs, tick_rate, duration, warmup, volatility, seed, verbose))
+            rows.append(row)
+            print(f"{datetime.now()}: {pairs} pairs x {tick_rate} ticks/s: signal->submit p50 {row['submit_p50_ms']:.2f} ms, p99 {row['submit_p99_ms']:.2f} ms, "
+                  f"loop lag p99 {row['lag_p99_ms']:.2f} ms, loop cpu {row['loop_cpu']:.0%}, {'ok' if row['sustainable'] else 'NOT SUSTAINABLE'}")
+            if not row["sustainable"] and not keep_going:
+                break
+    return pd.DataFrame(rows)
+
+
+# largest sustainable number of pairs per tick rate (the scaling curve)
+def max_sustainable(results):
+    curve = {}
+    for tick_rate, points in results.groupby("tick_rate"):
+        ok = points.loc[points["sustainable"], "pairs"]
+        curve[tick_rate] = int(ok.max()) if len(ok) else 0
+    return curve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-pair load test of MeanReversionStrategy on the fake connectors")
+    parser.add_argument("--pairs", default="1,2,4,8,16,32", help="numbers of symbol pairs, a,b,c")
+    parser.add_argument("--tick-rates", default="10,100", help="IB ticks per second per contract, a,b,c")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds measured per point")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring (subscriptions, first ladders)")
+    parser.add_argument("--volatility", type=float, default=20.0, help="IB mid price moves, ticks per second")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--keep-going", action="store_true", help="run all pairs even after a point is not sustainable")
+    parser.add_argument("--verbose", action="store_true", help="keep the strategy output")
+    parser.add_argument("--output", help="CSV file for the results")
+    args = parser.parse_args()
+
+    results = sweep([int(value) for value in args.pairs.split(",")], [float(value) for value in args.tick_rates.split(",")],
+                    args.duration, args.warmup, args.volatility, args.seed, args.keep_going, args.verbose)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    columns = ["pairs", "tick_rate", "ticks_per_s", "cycles_per_s", "submit_p50_ms", "submit_p99_ms", "ack_p99_ms", "lag_p99_ms",
+               "loop_cpu", "cpu_ms_per_pair_s", "ready_max", "mt5_queue_max", "in_flight_max", "sustainable"]
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(results[columns].to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+    for tick_rate, pairs in max_sustainable(results).items():
+        print(f"{tick_rate:g} ticks/s per contract: up to {pairs} pairs per process (lag p99 <= {MAX_LOOP_LAG * 1e3:g} ms, "
+              f"signal->submit p99 <= {MAX_SUBMIT_LATENCY * 1e3:g} ms)")
+
+
+if __name__ == "__main__":
+    main()
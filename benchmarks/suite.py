@@ -0,0 +1,278 @@
+# suite.py
+# microbenchmarks of the tick-to-order path on synthetic inputs of realistic and stressed sizes. Per case: time per
+# call (median and best of several runs) and memory per call from tracemalloc (peak of one call, blocks left
+# allocated per call), compared with a stored baseline so regressions show up before deploy.
+# run from the project root:
+#   python -m benchmarks.suite                  compare with benchmarks/baseline.json, exit code 1 on regressions
+#   python -m benchmarks.suite --save           store the results as the new baseline
+#   python -m benchmarks.suite -k order_flow    only cases with the text in their name
+# the baseline is machine specific: save it on the trading machine (or the same hardware) and commit it from there
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+TIME_TOLERANCE = 0.25 # median time above baseline x (1 + tolerance) is a regression
+MEMORY_TOLERANCE = 0.25 # same for the peak memory of a call, plus MEMORY_SLACK bytes
+MEMORY_SLACK = 1024
+BLOCKS_SLACK = 0.5 # blocks left allocated per call above the baseline
+
+SYMBOL = "NG-7.23"
+NYMEX_SYMBOL = "NGN3"
+LOTS = 117
+DECIMALS = 3
+
+# setup(size) returns the function timed, one call is one operation of the hot path
+Case = namedtuple("Case", ["name", "sizes", "setup"])
+CASES = []
+
+
+def case(name, sizes):
+    def register(setup):
+        CASES.append(Case(name, sizes, setup))
+        return setup
+    return register
+
+
+# alternates between the values, so caches keyed on unchanged input don't short circuit the calls
+def cycle(values):
+    state = {"i": 0}
+    def next_value():
+        state["i"] = (state["i"] + 1) % len(values)
+        return values[state["i"]]
+    return next_value
+
+
+# symbol_deep_quotes: book snapshot to best / deep quotes for 1x..3x lots (BookCache.update after market_book_get)
+@case("deep_quotes", (20, 200))
+def setup_deep_quotes(levels):
+    from moex_connection.book_cache import BookCache
+    from benchmarks.bench_depth_engine import synthetic_book
+    cache = BookCache(SYMBOL, np.array([1, 2, 3]) * LOTS, 0.01, 0.5)
+    books = cycle([synthetic_book(levels, seed=1), synthetic_book(levels, mid=2.501, seed=2)])
+    return lambda: cache.update(books())
+
+
+# order_flow: target ladder from the compiled grid, fingerprint and reconcile against live orders
+@case("order_flow", (11, 101))
+def setup_order_flow(number_of_steps):
+    from data_processing.compiled_grid import CompiledGrid
+    from benchmarks.bench_order_ladder import scenario, MAX_LOTS
+    _, _, ladder, live, _, _ = scenario(number_of_steps)
+    grid = CompiledGrid(0.002, 117, number_of_steps, 0.0, 0)
+    quotes = cycle([(2.503, 2.505), (2.504, 2.506)])
+    def order_flow():
+        ib_bid, ib_ask = quotes()
+        ladder.update(*grid.ladder(ib_bid, ib_ask, 234.0, MAX_LOTS, DECIMALS))
+        ladder.fingerprint()
+        return ladder.reconcile(live, 0.001, 1)
+    return order_flow
+
+
+# hedger: open risk to IB lots
+@case("hedger", (1,))
+def setup_hedger(_):
+    from data_processing.grid_rules import hedge_lots
+    poses = cycle([(100.0, 0.0), (-250.0, 1.0), (30.0, 0.0)])
+    def hedger():
+        moex_pose, nymex_pose = poses()
+        return hedge_lots(moex_pose, nymex_pose, LOTS, LOTS * 0.66, 2)
+    return hedger
+
+
+# grid: market grid entry / exit decision
+@case("grid_signal", (11, 101))
+def setup_grid_signal(number_of_steps):
+    from data_processing.compiled_grid import CompiledGrid
+    from data_processing.grid_rules import grid_signal
+    grid = CompiledGrid(0.002, 117, number_of_steps, 0.0, 0)
+    quotes = cycle([(2.512, 2.514, 2.503, 2.505), (2.49, 2.492, 2.503, 2.505)])
+    def signal():
+        moex_bid, moex_ask, ib_bid, ib_ask = quotes()
+        return grid_signal(grid, moex_bid, moex_ask, ib_bid, ib_ask, 117.0)
+    return signal
+
+
+# market bus (replaced LatestQueue): publish an IB quote and read it from every subscription of the symbol
+@case("market_bus", (1, 16))
+def setup_market_bus(subscribers):
+    from data_processing.market_bus import MarketBus, NymexQuote, KIND_NYMEX_QUOTE, KIND_POSITION
+    bus = MarketBus()
+    subscriptions = [bus.subscribe(SYMBOL, (KIND_NYMEX_QUOTE, KIND_POSITION)) for _ in range(subscribers)]
+    quote = NymexQuote(datetime.now(), 2.503, 2.505)
+    def publish_get():
+        bus.publish(KIND_NYMEX_QUOTE, SYMBOL, quote)
+        for subscription in subscriptions:
+            subscription.poll()
+    return publish_get
+
+
+TradeOrder = namedtuple("TradeOrder", ["ticket", "symbol", "type", "volume_initial", "volume_current", "price_open"])
+TradeDeal = namedtuple("TradeDeal", ["ticket", "order", "time", "symbol", "type", "volume", "price"])
+
+
+# load_orders: orders_get result into the local open orders, then the DataFrame of them
+@case("load_orders", (11, 201))
+def setup_load_orders(orders):
+    from moex_connection.open_orders import OpenOrders
+    open_orders = OpenOrders([SYMBOL], {SYMBOL: DECIMALS}, 5.0)
+    results = cycle([[TradeOrder(1000 + i, SYMBOL, 2 + i % 2, LOTS, LOTS - shift * (i % 3), 2.5 + 0.002 * i) for i in range(orders)] for shift in (0, 1)])
+    def load_orders():
+        open_orders.reconcile(SYMBOL, results())
+        return open_orders.frame(SYMBOL)
+    return load_orders
+
+
+# load_positions: history_deals_get result into positions
+@case("load_positions", (10, 1000))
+def setup_load_positions(deals):
+    from moex_connection.position_tracker import PositionTracker
+    tracker = PositionTracker([SYMBOL], {SYMBOL: 0})
+    now = int(datetime.now().timestamp())
+    result = [TradeDeal(5000 + i, 7000 + i, now + i // 10, SYMBOL, i % 2, 1.0, 2.5) for i in range(deals)]
+    def load_positions():
+        tracker.seen.clear() # same deals are new again
+        return tracker.apply_deals(result)
+    return load_positions
+
+
+# DatabaseHandler writes: trades DataFrame appended to the SQLite file (the executor side of store_*_trade)
+@case("db_write", (1, 1000))
+def setup_db_write(rows):
+    from database import DatabaseHandler
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    async def open_handler():
+        handler = DatabaseHandler(path)
+        await handler.wait_until_ready()
+        return handler
+    handler = asyncio.run(open_handler())
+    trades = pd.DataFrame({"timestamp": [datetime.now()] * rows, "moex_symbol": SYMBOL, "nymex_symbol": NYMEX_SYMBOL,
+                           "trade_type": "Buy", "trade_size": LOTS, "moex_price": 2.5, "nymex_price": 2.49,
+                           "execution_time": 0.05, "fees": 0.0})
+    return lambda: handler._store_market_grid_trade_blocking(trades)
+
+
+# tick recorder: one IB tick, one MOEX book of 20 levels per side
+@case("tick_recorder", ("ib", "book"))
+def setup_tick_recorder(kind):
+    from database.tick_recorder import TickRecorder
+    from moex_connection.depth_engine import book_to_arrays
+    from benchmarks.bench_depth_engine import synthetic_book
+    recorder = TickRecorder(tempfile.mkdtemp(), 20)
+    if kind == "ib":
+        Ticker = namedtuple("Ticker", ["bid", "ask", "bidSize", "askSize"])
+        ticker = Ticker(2.503, 2.505, 10.0, 12.0)
+        return lambda: recorder.record_ib(NYMEX_SYMBOL, ticker)
+    levels = book_to_arrays(synthetic_book(20))
+    return lambda: recorder.record_moex_book(SYMBOL, 2.5, 2.501, 2.499, 2.502, levels)
+
+
+def measure(function, repeat = 7, min_time = 0.05):
+    function() # warm up caches and lazy imports
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    runs = [run / number for run in timer.repeat(repeat, number)]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function() # cached allocations (first call after tracing starts) are not counted
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] - before
+        calls = 100
+        snapshot = tracemalloc.take_snapshot()
+        results = [function() for _ in range(calls)] # results kept: blocks of returned objects count too
+        blocks = sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename")) / calls
+        del results
+    finally:
+        tracemalloc.stop()
+    return {"median_us": statistics.median(runs) * 1e6, "best_us": min(runs) * 1e6, "peak_bytes": peak, "blocks": blocks}
+
+
+def run_cases(keyword = None):
+    results = {}
+    for bench in CASES:
+        for size in bench.sizes:
+            key = f"{bench.name}[{size}]"
+            if keyword and keyword not in key:
+                continue
+            try:
+                results[key] = measure(bench.setup(size))
+            except ImportError as e: # a connector package not installed here
+                print(f"{key}: skipped, {e}")
+    return results
+
+
+def regressions(result, baseline):
+    found = []
+    if result["median_us"] > baseline["median_us"] * (1 + TIME_TOLERANCE):
+        found.append(f"time x{result['median_us'] / baseline['median_us']:.2f}")
+    if result["peak_bytes"] > baseline["peak_bytes"] * (1 + MEMORY_TOLERANCE) + MEMORY_SLACK:
+        found.append(f"peak memory {baseline['peak_bytes']} -> {result['peak_bytes']} bytes")
+    if result["blocks"] > baseline["blocks"] + BLOCKS_SLACK:
+        found.append(f"blocks per call {baseline['blocks']:.1f} -> {result['blocks']:.1f}")
+    return found
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "system": platform.system(), "processor": platform.processor()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hot path microbenchmarks")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("-k", dest="keyword", help="only cases with this text in the name")
+    args = parser.parse_args()
+
+    results = run_cases(args.keyword)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        baseline = stored["results"]
+        if stored["environment"] != environment():
+            print(f"baseline recorded on {stored['environment']}, timings may not be comparable")
+
+    failed = 0
+    print(f"{'case':<24}{'median us':>12}{'best us':>12}{'peak bytes':>12}{'blocks':>8}  vs baseline")
+    for key, result in results.items():
+        line = f"{key:<24}{result['median_us']:>12.2f}{result['best_us']:>12.2f}{result['peak_bytes']:>12}{result['blocks']:>8.1f}  "
+        if key in baseline:
+            found = regressions(result, baseline[key])
+            failed += bool(found)
+            line += ("REGRESSION: " + ", ".join(found)) if found else f"ok (x{result['median_us'] / baseline[key]['median_us']:.2f})"
+        else:
+            line += "no baseline"
+        print(line)
+
+    if args.save:
+        # only the cases run are replaced (-k keeps the rest of the baseline)
+        with open(args.baseline, "w") as file:
+            json.dump({"saved": datetime.now().isoformat(timespec="seconds"), "environment": environment(),
+                       "results": {**baseline, **results}}, file, indent=1, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+    elif failed:
+        print(f"{failed} case(s) regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,15 @@ MOEX_SERVER = "your_moex_server"
 MOEX_SYMBOLS = ["NG-7.23", "NG-8.23","GOLD-9.23","BR-7.23"]
 MOEX_LOTS = [117,117,11,117]
 MOEX_MAX_LOTS = [117,117,33,117] # max lots for limit orders
+MOEX_ORDER_CONCURRENCY = 8 # max order requests sent to the terminal at once
+MOEX_ORDERS_RECONCILE_INTERVAL = 5.0 # seconds between checks of the local open orders against the terminal
+MOEX_POSITIONS_CHECK_INTERVAL = 30.0 # seconds between checks of deal based positions against positions_get
+MOEX_POLL_MIN_INTERVAL = 0.02 # seconds between order book polls while the book or the paired IB contract is active
+MOEX_POLL_MAX_INTERVAL = 1.0 # seconds between order book polls in quiet periods
+MOEX_DEPTH_MULTIPLES = [1,2,3] # deep bid/ask ladder sizes as multiples of MOEX_LOTS. First one is used by the strategies
+MOEX_PRICE_TOLERANCE_TICKS = [2,2,1,2] # limit order is re-priced only if it is more ticks behind the target (ahead of it - always)
+MOEX_MODIFY_VOLUME = False # change volume of a pending order by modify. MT5 doesn't allow it: cancel + new order
+TICK_STORE_CAPACITY = 50000 # quotes kept in memory per symbol (IB ticks and MOEX book changes)
 
 # friendly names to call strategies from Telegram:
 INTERFACE_SYMBOLS = ["gas1", "gas2","gold1","brent1"]
@@ -23,9 +32,32 @@ NYMEX_CONTRACTS = [Future(symbol = "NG",lastTradeDateOrContractMonth = "20230727
                  Future(symbol = "MGC",lastTradeDateOrContractMonth = "20230829",exchange = "COMEX",localSymbol = "MGCQ3",currency = "USD"),
                  Future(symbol = "BZ",lastTradeDateOrContractMonth = "20230630",exchange = "NYMEX",localSymbol = "BZQ3",currency = "USD")]
 NYMEX_MAX_LOTS = [3,3,15,1]
+NYMEX_SUBSCRIBE_TIMEOUT = 10 # seconds to wait for the first bid / ask after subscribing
+
+# Sharded runtime: each group of INTERFACE_SYMBOLS runs its connectors and strategy in a separate process,
+# the main process only hosts the Telegram bot and the scheduler. None - all symbols in the main process
+SHARDS = None # e.g. [["gas1","gas2"],["gold1"],["brent1"]]
+SHARD_IB_CLIENT_ID_BASE = 10 # IB clientId of shard i is base + i (each shard has its own IB connection)
+SHARD_START_TIMEOUT = 120 # seconds to wait for all shards to connect to MOEX and IB
+SHARD_COMMAND_TIMEOUT = 30 # seconds to wait for a shard to answer a command
+
+# latest quotes of all MOEX symbols and NYMEX contracts in shared memory for other processes (quote_board.QuoteBoardReader). None - off
+QUOTE_BOARD_NAME = None # e.g. "comarb_quotes"
+
+# Symbol metadata and margin checks (both venues)
+METADATA_TTL = 600 # seconds to keep tick size / contract size / margin per lot
+ACCOUNT_MARGIN_TTL = 5 # seconds to keep account free margin
+MARGIN_SAFETY_BUFFER = 0.2 # share of free margin: estimates above (1 - buffer) * free margin are confirmed by the venue
 
 # Database settings
 DATABASE_FILE_PATH = "local_db.sqlite3"
+# every IB tick and MOEX book snapshot to binary files (database.TickRecorder), directory/YYYYMMDD/symbol.kind.bin. None - off
+TICK_RECORDER_DIRECTORY = None # e.g. "ticks"
+TICK_RECORDER_BOOK_DEPTH = 20 # MOEX book levels kept per side
+TICK_RECORDER_CHUNK_RECORDS = 65536 # records added to a file's preallocation when it is full
+SWEEP_DATABASE_FILE_PATH = "sweep_results.sqlite3" # parameter sweep results (backtesting.sweep)
+SWEEP_DATA_DIRECTORY = "sweep_data" # market data of sweeps as .npy files, memory mapped by the workers
+SWEEP_WORKERS = None # processes of a sweep, None - one per CPU
 
 # Telegram bot settings
 TELEGRAM_API_TOKEN = ""
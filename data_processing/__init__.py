@@ -1 +1,4 @@
-from .mean_reversion import MeanReversionStrategy, LatestQueue
\ No newline at end of file
+from .mean_reversion import MeanReversionStrategy
+from .tick_store import TickStore
+from .market_bus import MarketBus
+from .compiled_grid import CompiledGrid
\ No newline at end of file
@@ -0,0 +1,82 @@
+# compiled_grid.py
+# spread / position grid of the grid strategies, built once per start (or re-centre) instead of on every event.
+# Buckets (np.searchsorted on the grid) come from the uniform step with integer arithmetic, checked against the
+# rounded grid values, and the order ladder per position (types and volumes) is cached: a tick only adds IB bid / ask
+import math
+import numpy as np
+from data_processing.order_ladder import target_ladder
+
+SPREAD_DECIMALS = 3
+TEMPLATE_CACHE_SIZE = 64 # ladder templates kept (positions visited since the last re-centre)
+
+
+class CompiledGrid:
+    def __init__(self, spread_step, pose_step, number_of_steps, mid_spread, mid_pose):
+        self.spread_step = spread_step
+        self.pose_step = pose_step
+        self.number_of_steps = number_of_steps
+        self.offsets = np.arange(number_of_steps) - (number_of_steps - 1) / 2
+        self.mid_spread, self.mid_pose = mid_spread, mid_pose
+        self.recentre()
+
+# move the grid to new mids (in place, the strategy loops keep using the same object)
+    def recentre(self, mid_spread = None, mid_pose = None):
+        if mid_spread is not None:
+            self.mid_spread = mid_spread
+        if mid_pose is not None:
+            self.mid_pose = mid_pose
+        self.spread_grid = np.around(self.spread_step * self.offsets + self.mid_spread, SPREAD_DECIMALS)
+        self.pose_grid = np.around(self.pose_step * self.offsets + self.mid_pose, 0)
+        self.spread_values = self.spread_grid.tolist()
+        self.pose_values = self.pose_grid.tolist()
+        self.templates = {} # (moex_pose, max_lots) : (types, volumes, first sell level)
+
+# same as np.searchsorted(spread_grid, spread, side)
+    def spread_bucket(self, spread, side = "left"):
+        return self._bucket(self.spread_values, self.spread_step, spread, side == "right")
+
+# same as np.searchsorted(pose_grid, pose, side)
+    def pose_bucket(self, pose, side = "left"):
+        return self._bucket(self.pose_values, self.pose_step, pose, side == "right")
+
+    def _bucket(self, values, step, x, right):
+        n = len(values)
+        if x != x: # nan sorts last
+            return n
+        if step > 0 and math.isfinite(x):
+            position = (x - values[0]) / step
+            k = math.floor(position) + 1 if right else math.ceil(position)
+            k = min(max(k, 0), n)
+        else:
+            k = 0
+        # the grid is rounded: move by a level at most (except degenerate grids) to match the stored values
+        if right:
+            while k > 0 and values[k - 1] > x:
+                k -= 1
+            while k < n and values[k] <= x:
+                k += 1
+        else:
+            while k > 0 and values[k - 1] >= x:
+                k -= 1
+            while k < n and values[k] < x:
+                k += 1
+        return k
+
+# same as target_ladder(spread_grid, pose_grid, ...). Types and volumes depend only on the position: cached
+    def ladder(self, ib_bid, ib_ask, moex_pose, max_lots, decimals):
+        key = (moex_pose, max_lots)
+        template = self.templates.get(key)
+        if template is None:
+            types, _, volumes = target_ladder(self.spread_grid, self.pose_grid, 0.0, 0.0, moex_pose, max_lots, decimals)
+            types.flags.writeable = False # shared by all ladders built from the template
+            volumes.flags.writeable = False
+            # levels below the position bucket (reversed) sell at IB ask, the rest buy at IB bid
+            template = (types, volumes, self.number_of_steps - self.pose_bucket(moex_pose))
+            if len(self.templates) >= TEMPLATE_CACHE_SIZE:
+                self.templates.clear()
+            self.templates[key] = template
+        types, volumes, first_sell = template
+        prices = np.empty(self.number_of_steps)
+        np.add(self.spread_grid[:first_sell], ib_bid, out=prices[:first_sell])
+        np.add(self.spread_grid[first_sell:], ib_ask, out=prices[first_sell:])
+        return types, np.around(prices, decimals, out=prices), volumes
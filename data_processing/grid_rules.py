@@ -0,0 +1,27 @@
+# grid_rules.py
+# trade decisions of the grid strategies as plain functions of prices and positions, shared by
+# MeanReversionStrategy (grid, hedger) and the backtester (backtesting.engine)
+import numpy as np
+
+SIGNAL_NONE = 0
+SIGNAL_SHORT = -1 # sell MOEX, buy IB
+SIGNAL_LONG = 1 # buy MOEX, sell IB
+
+
+# market grid: entry / exit signal on the spread of MOEX deep prices to IB prices against the position in the grid
+def grid_signal(grid, moex_bid, moex_ask, ib_bid, ib_ask, moex_pose):
+    number_of_steps = grid.number_of_steps
+    spread_to_short_index = grid.spread_bucket(moex_bid - ib_ask, side='left')
+    spread_to_long_index = grid.spread_bucket(moex_ask - ib_bid, side='left')
+    if ((number_of_steps - spread_to_short_index) < grid.pose_bucket(moex_pose, side='left')) and (spread_to_short_index > 1):
+        return SIGNAL_SHORT
+    if (number_of_steps - spread_to_long_index > grid.pose_bucket(moex_pose, side='right')) and ((number_of_steps - spread_to_long_index) > 1):
+        return SIGNAL_LONG
+    return SIGNAL_NONE
+
+
+# hedger: IB lots to trade (positive: buy) to bring the open risk (MOEX lots) within max_risk, capped at nymex_max_lots
+def hedge_lots(moex_pose, nymex_pose, lots, max_risk, nymex_max_lots):
+    open_risk = moex_pose + nymex_pose * lots
+    abs_open_risk_adjusted = np.trunc((abs(open_risk) + (lots - max_risk)) / lots)
+    return -np.sign(open_risk) * min(nymex_max_lots, abs_open_risk_adjusted)
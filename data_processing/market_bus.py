@@ -0,0 +1,111 @@
+# market_bus.py
+# in-process publish / subscribe of market data between the connectors and the strategy loops.
+# A topic is (kind, symbol) and keeps only its latest value with a sequence number: publishing is O(1) plus
+# waking the subscribers that wait, there is no backlog. Each subscription remembers the last sequence it saw
+# per topic, so any number of loops can read the same feed, each getting the latest value of what changed.
+# Closing a symbol wakes its subscribers with CLOSED.
+import asyncio
+from collections import namedtuple
+
+KIND_NYMEX_QUOTE = "nymex_quote"
+KIND_MOEX_BOOK = "moex_book"
+KIND_POSITION = "position"
+KIND_ORDER_STATE = "order_state"
+
+# values published per kind. time is the local datetime of the update
+NymexQuote = namedtuple("NymexQuote", ["time", "bid", "ask"])
+MoexBook = namedtuple("MoexBook", ["time", "bid", "ask", "deep_bid", "deep_ask"])
+PositionUpdate = namedtuple("PositionUpdate", ["time", "moex", "nymex"])
+OrderState = namedtuple("OrderState", ["time", "version", "open_orders"]) # open orders version and count after a gateway batch
+
+CLOSED = object() # returned by Subscription.get once the subscription or its symbol is closed
+
+
+class Topic:
+    __slots__ = ("kind", "symbol", "value", "seq", "subscriptions")
+
+    def __init__(self, kind, symbol):
+        self.kind = kind
+        self.symbol = symbol
+        self.value = None
+        self.seq = 0
+        self.subscriptions = set()
+
+
+class Subscription:
+    def __init__(self, bus, topics, latest = False):
+        self.bus = bus
+        self.topics = topics
+        # latest: the current values count as not seen yet, the first get returns them at once
+        self.seen = {topic.kind: (0 if latest else topic.seq) for topic in topics}
+        self.closed = False
+        self.waiter = None
+        for topic in topics:
+            topic.subscriptions.add(self)
+
+# {kind : latest value} of the topics published since the previous get. Waits for a publish if there is none;
+# {} after timeout seconds without one, CLOSED if closed
+    async def get(self, timeout = None):
+        updates = self.poll()
+        if updates or self.closed:
+            return CLOSED if self.closed else updates
+        self.waiter = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self.waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.waiter = None
+        return CLOSED if self.closed else self.poll()
+
+# same without waiting
+    def poll(self):
+        updates = {}
+        for topic in self.topics:
+            if topic.seq != self.seen[topic.kind]:
+                self.seen[topic.kind] = topic.seq
+                updates[topic.kind] = topic.value
+        return updates
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            for topic in self.topics:
+                topic.subscriptions.discard(self)
+            self.wake()
+
+
+class MarketBus:
+    def __init__(self):
+        self.topics = {} # (kind, symbol) : Topic
+
+    def topic(self, kind, symbol):
+        topic = self.topics.get((kind, symbol))
+        if topic is None:
+            topic = self.topics[(kind, symbol)] = Topic(kind, symbol)
+        return topic
+
+    def publish(self, kind, symbol, value):
+        topic = self.topic(kind, symbol)
+        topic.value = value
+        topic.seq += 1
+        for subscription in topic.subscriptions:
+            subscription.wake()
+
+    def latest(self, kind, symbol):
+        topic = self.topics.get((kind, symbol))
+        return topic.value if topic is not None else None
+
+    def subscribe(self, symbol, kinds, latest = False):
+        return Subscription(self, [self.topic(kind, symbol) for kind in kinds], latest)
+
+# close all subscriptions of the symbol (or of all symbols). Topics keep their values for new subscriptions
+    def close(self, symbol = None):
+        for (_, topic_symbol), topic in self.topics.items():
+            if symbol is None or topic_symbol == symbol:
+                for subscription in list(topic.subscriptions):
+                    subscription.close()
@@ -5,19 +5,31 @@ import numpy as np
 import MetaTrader5 as mt5
 from ib_insync import Contract
 from datetime import datetime, timedelta
-from config import INTERFACE_SYMBOLS, SYMBOL_DECIMALS, MOEX_MAX_LOTS, NYMEX_MAX_LOTS
+from config import INTERFACE_SYMBOLS, SYMBOL_DECIMALS, MOEX_MAX_LOTS, NYMEX_MAX_LOTS, MOEX_ORDER_CONCURRENCY, TICK_STORE_CAPACITY, \
+    MOEX_PRICE_TOLERANCE_TICKS, MOEX_MODIFY_VOLUME
+from moex_connection.order_gateway import OrderGateway, new_order, modify_order, cancel_order, ACTION_NEW, STATE_DONE
+from data_processing.tick_store import TickStore
+from data_processing.order_ladder import OrderLadder, ChurnStats
+from data_processing.compiled_grid import CompiledGrid
+from data_processing.grid_rules import grid_signal, hedge_lots, SIGNAL_SHORT, SIGNAL_LONG
+from data_processing.market_bus import MarketBus, NymexQuote, MoexBook, PositionUpdate, OrderState, CLOSED, \
+    KIND_NYMEX_QUOTE, KIND_MOEX_BOOK, KIND_POSITION, KIND_ORDER_STATE
 
 
 
 class MeanReversionStrategy:
-    def __init__(self, moex_connector, nymex_connector, db_handler):
+    # symbols: INTERFACE_SYMBOLS traded here, in the order of the connectors' symbols (a shard runs only its group)
+    # scheduler: stop trading outside working hours. Off in shards, the coordinator runs it
+    # quote_board: quote_board.QuoteBoard to publish quotes to other processes (None - off)
+    # recorder: database.TickRecorder writing every IB tick and MOEX book snapshot to disk (None - off)
+    def __init__(self, moex_connector, nymex_connector, db_handler, symbols = None, scheduler = True, quote_board = None, recorder = None):
         self.moex_connector = moex_connector
         self.nymex_connector = nymex_connector
         self.db = db_handler # store executed trades
 
-        self.symbols = INTERFACE_SYMBOLS
+        self.symbols = INTERFACE_SYMBOLS if symbols is None else symbols
 
-        self.decimals = dict(zip(self.symbols, SYMBOL_DECIMALS))
+        self.decimals = {symbol: SYMBOL_DECIMALS[INTERFACE_SYMBOLS.index(symbol)] for symbol in self.symbols}
         
         self.logger = logging.getLogger(__name__)
         self.moex_bid_latest, self.moex_ask_latest = None, None
@@ -27,15 +39,15 @@ class MeanReversionStrategy:
 
         self.active_trades = {} # (compare_prices + grid) or (check_pose + limit_grid) tasks - to check if need to stop before starting new one
         self.target_orders = {} # to use in limit_grid trading, and compare with actual moex_connector.open_orders
+        self.grids = {} # symbol : CompiledGrid of the running grid / limit_grid strategy (re-centred in place)
+        self.sent_fingerprints = {} # symbol : (target ladder, open orders version) after the last fully completed order_flow cycle
+        self.order_churn = ChurnStats() # order requests per order_flow cycle
 
         # timer between moex updates
         self.timeout = 0.5 # number of seconds between cycles
 
-        # queues and events
-        self.nymex_to_moex_queue = LatestQueue() # call get_data from MOEX once there's a callback in NYMEX. TBD if replace to asyncio.Event
-        self.grid_events = {symbol: asyncio.Event() for symbol in self.symbols} # trade grid strat
-        self.limit_orders_events = {symbol: LatestQueue() for symbol in self.symbols} # update limit_orders
-        self.limit_pose_events = {symbol: asyncio.Event() for symbol in self.symbols} # update poses and check if hedging is needed
+        # NYMEX quotes, MOEX books, positions and order states per symbol, read by all strategy loops (latest value only)
+        self.market_bus = MarketBus()
         self.should_stop = {symbol: asyncio.Event() for symbol in self.symbols} # stop all strats for specified (or all) symbol(s)
 
         self.risk_coef = 0.66 # maximum amount of unhedged risk allowed as % of minimal moex lots required to be fully hedged on nymex
@@ -48,19 +60,36 @@ class MeanReversionStrategy:
         # max lots in limit orders on MOEX
         self.moex_max_lots = {}
         for symbol in self.symbols:
-            self.moex_max_lots[symbol] = MOEX_MAX_LOTS[self.symbols.index(symbol)]
+            self.moex_max_lots[symbol] = MOEX_MAX_LOTS[INTERFACE_SYMBOLS.index(symbol)]
+
+        # limit order price tolerance band, in ticks (tick size from the MOEX instrument metadata)
+        self.price_tolerance_ticks = {}
+        for symbol in self.symbols:
+            self.price_tolerance_ticks[symbol] = MOEX_PRICE_TOLERANCE_TICKS[INTERFACE_SYMBOLS.index(symbol)]
 
         # max lots in orders on NYMEX (for hedger)
         self.nymex_max_lots = {}
         for symbol in self.symbols:
-            self.nymex_max_lots[symbol] = NYMEX_MAX_LOTS[self.symbols.index(symbol)]
+            self.nymex_max_lots[symbol] = NYMEX_MAX_LOTS[INTERFACE_SYMBOLS.index(symbol)]
 
+        self.run_scheduler = scheduler
         self.scheduler_on = False
         self.retcode_send = 0
+
+        # all MOEX limit order actions (new / modify / cancel) go through the gateway
+        self.order_gateway = OrderGateway(self.moex_connector, max_concurrency = MOEX_ORDER_CONCURRENCY, notify = self.notify)
         
         self.queue_in_time = {}
         self.queue_out_time = {}
 
+        # recent IB ticks and MOEX quotes per symbol (volatility, tick rate, cross-venue spread series)
+        self.tick_store = TickStore(TICK_STORE_CAPACITY)
+        self.quote_board = quote_board
+        self.recorder = recorder
+        self.moex_connector.quote_listeners.append(self.record_moex_quote)
+        if self.recorder is not None:
+            self.moex_connector.book_listeners.append(self.record_moex_book)
+
 # what happens when IB ticker gets updated - update current bid&ask, send queue for price updates, send events to orders and pose events
     def on_pending_tickers(self, tickers):
         ib_signal_time = datetime.now()
@@ -69,10 +98,33 @@ class MeanReversionStrategy:
             symbol = self.symbols[self.nymex_connector.symbols.index(nymex_symbol)]
             self.nymex_connector.current_bid[nymex_symbol] = ticker.bid
             self.nymex_connector.current_ask[nymex_symbol] = ticker.ask
+            self.tick_store.append_ib(nymex_symbol, ticker)
+            if self.recorder is not None:
+                self.recorder.record_ib(nymex_symbol, ticker)
+            if self.quote_board is not None:
+                self.quote_board.update(nymex_symbol, ticker.bid, ticker.ask)
             print(f"{datetime.now()}: Symbol {nymex_symbol}: Current bid: {self.nymex_connector.current_bid[nymex_symbol]}, Current ask: {self.nymex_connector.current_ask[nymex_symbol]}")
-            self.nymex_to_moex_queue.put_nowait(self.moex_connector.symbols[self.nymex_connector.symbols.index(nymex_symbol)]) # puting in queue MOEX contract corresponding to the NYMEX contract, which was called back
-            self.limit_orders_events[symbol].put_nowait(ib_signal_time) # send event/signal to update open orders
-            #self.limit_pose_events[symbol].set() # send event/signal to update open positions. Not needed here as it depends on pose checking loop
+            moex_symbol = self.moex_connector.symbols[self.nymex_connector.symbols.index(nymex_symbol)]
+            self.moex_connector.note_ib_tick(moex_symbol) # poll MOEX book of the pair densely while IB is ticking
+            self.market_bus.publish(KIND_NYMEX_QUOTE, symbol, NymexQuote(ib_signal_time, ticker.bid, ticker.ask)) # grid and order_flow
+
+# MOEX quotes changed (called by moex_connector after a book poll)
+    def record_moex_quote(self, moex_symbol):
+        connector = self.moex_connector
+        self.tick_store.append_moex(moex_symbol, connector.current_bid[moex_symbol], connector.current_ask[moex_symbol],
+                                    connector.deep_bid[moex_symbol], connector.deep_ask[moex_symbol])
+        if self.quote_board is not None:
+            self.quote_board.update(moex_symbol, connector.current_bid[moex_symbol], connector.current_ask[moex_symbol],
+                                    connector.deep_bid[moex_symbol], connector.deep_ask[moex_symbol])
+        symbol = self.symbols[connector.symbols.index(moex_symbol)]
+        self.market_bus.publish(KIND_MOEX_BOOK, symbol, MoexBook(datetime.now(), connector.current_bid[moex_symbol], connector.current_ask[moex_symbol],
+                                                                 connector.deep_bid[moex_symbol], connector.deep_ask[moex_symbol]))
+
+# new MOEX book snapshot (any level, not only the ones the quotes depend on) to the tick recorder
+    def record_moex_book(self, moex_symbol):
+        connector = self.moex_connector
+        self.recorder.record_moex_book(moex_symbol, connector.current_bid[moex_symbol], connector.current_ask[moex_symbol],
+                                       connector.deep_bid[moex_symbol], connector.deep_ask[moex_symbol], connector.book_cache[moex_symbol].levels)
 
 # MOEX bid & ask update process. Only for market grid trading strategy:
     async def compare_prices(self, symbol):
@@ -81,18 +133,23 @@ class MeanReversionStrategy:
         moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol
+        self.moex_connector.watch_book(moex_symbol) # book is polled and cached by moex_connector.run(), published by record_moex_quote
+        quotes = self.market_bus.subscribe(symbol, (KIND_MOEX_BOOK, KIND_NYMEX_QUOTE))
         while not self.should_stop[symbol].is_set():
+            updates = await quotes.get()
+            if updates is CLOSED:
+                break
             print(f"{datetime.now()}: Comparing prices - Start")
-            await self.moex_connector.get_data({moex_symbol: self.moex_connector.lots_dict[moex_symbol]}) # TODO: review
-            self.grid_events[symbol].set() # signal that data from MOEX is updated
-    
-            nymex_symbol = self.nymex_connector.contracts[self.moex_connector.symbols.index(moex_symbol)]
-            print(f"{datetime.now()}: Received data for {moex_symbol}: bid: {self.moex_connector.current_bid[moex_symbol]}, ask: {self.moex_connector.current_ask[moex_symbol]}")
-            print(f"{datetime.now()}: Received data for {moex_symbol}: deep_bid: {self.moex_connector.deep_bid[moex_symbol]}, deep_ask: {self.moex_connector.deep_ask[moex_symbol]}")
-            print(f"{datetime.now()}: Received data for {nymex_symbol.localSymbol}: bid: {self.nymex_connector.current_bid[nymex_symbol.localSymbol]}, ask: {self.nymex_connector.current_ask[nymex_symbol.localSymbol]}")
-            
+            if KIND_MOEX_BOOK in updates:
+                book = updates[KIND_MOEX_BOOK]
+                print(f"{datetime.now()}: Received data for {moex_symbol}: bid: {book.bid}, ask: {book.ask}")
+                print(f"{datetime.now()}: Received data for {moex_symbol}: deep_bid: {book.deep_bid}, deep_ask: {book.deep_ask}")
+            if KIND_NYMEX_QUOTE in updates:
+                quote = updates[KIND_NYMEX_QUOTE]
+                print(f"{datetime.now()}: Received data for {nymex_symbol}: bid: {quote.bid}, ask: {quote.ask}")
             print(f"{datetime.now()}: Comparing prices - End")
-            await asyncio.sleep(self.timeout) # TBD what should be here. THe trading logic should be done on periodic basis + on each callback from IB
+        quotes.close()
+        self.moex_connector.unwatch_book(moex_symbol)
         print(f"{datetime.now()}: {symbol} compare prices stopped")
         asyncio.create_task(self.bot.send_message(f"{symbol} compare prices stopped"))
 
@@ -103,9 +160,10 @@ class MeanReversionStrategy:
         moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol
-        self.moex_connector.load_positions([moex_symbol])
+        await self.moex_connector.load_positions([moex_symbol])
         self.nymex_connector.load_positions([nymex_symbol])
         moex_pose = self.moex_connector.positions[moex_symbol]
+        moex_pose_version = self.moex_connector.position_versions[moex_symbol]
         #nymex_pose = self.nymex_connector.positions[nymex_symbol]
         #lots = self.moex_connector.lots_dict[moex_symbol]
         #loop = asyncio.get_running_loop()
@@ -113,20 +171,18 @@ class MeanReversionStrategy:
         #nymex_symbol = nymex_contract.localSymbol 
         while not self.should_stop[symbol].is_set():
             timer = datetime.now()
-            await asyncio.gather(asyncio.to_thread(self.moex_connector.load_positions, [moex_symbol]))
+            await self.moex_connector.load_positions([moex_symbol]) # only new deals are fetched
             # await loop.run_in_executor(None, self.nymex_connector.load_positions, [nymex_symbol]) # not needed. updated in hedger coroutine
             
             moex_pose_new = self.moex_connector.positions[moex_symbol]
-            if moex_pose_new != moex_pose:
-                for i in range(2):
-                    self.limit_orders_events[symbol].put_nowait(None) # signal that data orders need to be updated? TODO: only call if there are changes in positions
-                    self.limit_pose_events[symbol].set() # signal that data from MOEX is updated
-                    print(f"{datetime.now()}: {moex_symbol} moex position changed from {moex_pose} to {moex_pose_new}.")
-                    moex_pose = moex_pose_new
-                    asyncio.sleep(0.9)
+            if self.moex_connector.position_versions[moex_symbol] != moex_pose_version:
+                moex_pose_version = self.moex_connector.position_versions[moex_symbol]
+                # order_flow updates the orders, hedger checks the open risk
+                self.market_bus.publish(KIND_POSITION, symbol, PositionUpdate(datetime.now(), moex_pose_new, self.nymex_connector.positions[nymex_symbol]))
+                print(f"{datetime.now()}: {moex_symbol} moex position changed from {moex_pose} to {moex_pose_new}.")
+                moex_pose = moex_pose_new
             #nymex_pose = self.nymex_connector.positions[nymex_symbol]
             
-            # self.limit_orders_events[symbol].set() # TODO: need signal that symbol position changed compared to previous iterations..
             # open_risk = moex_pose + nymex_pose * lots
             #print(f"{datetime.now()}: check_pose: {symbol} open risk: {open_risk}.")
             print(f"{datetime.now()}: positions updated (MOEX: {moex_pose}). Time to update: {datetime.now() - timer}")
@@ -134,22 +190,6 @@ class MeanReversionStrategy:
         print(f"{datetime.now()}: {symbol} positions checking stopped")
         asyncio.create_task(self.bot.send_message(f"{datetime.now()}: {symbol} positions checking stopped"))
 
-# always working: getting queue from on_pending_tickers to update moex ask & bid. Not used directly in limit_grid trading?
-    async def nymex_to_moex_signal(self):
-        print(f"{datetime.now()}: start nymex_to_moex_signal")
-        while not self.should_stop[symbol].is_set():
-            moex_symbol = await self.nymex_to_moex_queue.get()
-            if moex_symbol is not None:
-                symbol = self.symbols[self.moex_connector.symbols.index(moex_symbol)]
-                print(f"{datetime.now()}: data from NYMEX updated. Recalculating MOEX data")
-                await self.moex_connector.get_data({moex_symbol: self.moex_connector.lots_dict[moex_symbol]})
-                self.grid_events[symbol].set() # signal that data from MOEX is updated after the nymex callback
-                print(f"{datetime.now()}: Received data for {moex_symbol}: bid: {self.moex_connector.current_bid[moex_symbol]}, ask: {self.moex_connector.current_ask[moex_symbol]}")
-                print(f"{datetime.now()}: Received data for {moex_symbol}: deep_bid: {self.moex_connector.deep_bid[moex_symbol]}, deep_ask: {self.moex_connector.deep_ask[moex_symbol]}")
-                # self.nymex_to_moex_queue.task_done() # not needed in a custom LatestQueue class
-        print(f"{datetime.now()}: stop nymex_to_moex_signal")
-
-
 # order flow - limit_grid strategy
     async def order_flow(self, symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose):
         print(f"{datetime.now()}: starting order flow for {symbol}")
@@ -158,95 +198,83 @@ class MeanReversionStrategy:
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol
         
-        grid = [(i-(number_of_steps - 1)/2) for i in range(number_of_steps)]
-        spread_grid = np.around([spread_step * i + mid_spread for i in grid],3)
-        pose_grid = np.around([pose_step * i + mid_pose for i in grid],0)
-        print(f"{datetime.now()}: {symbol} spread_grid = "+str(spread_grid)+f"\n{symbol} pose_grid = "+str(pose_grid))
-        asyncio.create_task(self.bot.send_message(f"{symbol} spread_grid = "+str(spread_grid)+f"\n{symbol} pose_grid = "+str(pose_grid)))
+        grid = self.grids[symbol] = CompiledGrid(spread_step, pose_step, number_of_steps, mid_spread, mid_pose)
+        print(f"{datetime.now()}: {symbol} spread_grid = "+str(grid.spread_grid)+f"\n{symbol} pose_grid = "+str(grid.pose_grid))
+        asyncio.create_task(self.bot.send_message(f"{symbol} spread_grid = "+str(grid.spread_grid)+f"\n{symbol} pose_grid = "+str(grid.pose_grid)))
+        tick_size = await self.moex_connector.tick_size(moex_symbol)
 
         # check # of orders
         print(f"{datetime.now()}: should_stop signal: {self.should_stop[symbol].is_set()}")
+        signals = self.market_bus.subscribe(symbol, (KIND_NYMEX_QUOTE, KIND_POSITION))
         while not self.should_stop[symbol].is_set():
-            if not self.should_stop[symbol].is_set():
-                print(f"{datetime.now()}: limit_orders_events - waiting for item in queue")
-                ib_signal_time = await self.limit_orders_events[symbol].get()
-                if ib_signal_time is None:
-                    ib_signal_time = datetime.now()
-                    signal_produced_by = "pose_checker"
-                else:
-                    signal_produced_by = "ib_update"
-                signal_received = datetime.now() - ib_signal_time
+            print(f"{datetime.now()}: order_flow - waiting for IB quote or position change")
+            updates = await signals.get()
+            if updates is CLOSED:
+                break
+            if KIND_POSITION in updates:
+                ib_signal_time = updates[KIND_POSITION].time
+                signal_produced_by = "pose_checker"
+            else:
+                ib_signal_time = updates[KIND_NYMEX_QUOTE].time
+                signal_produced_by = "ib_update"
+            signal_received = datetime.now() - ib_signal_time
             print(f"{datetime.now()}: start checking orders, {signal_produced_by}: {signal_received} reaction time")
-            self.moex_connector.load_orders(moex_symbol)
-            self.moex_connector.load_positions([moex_symbol])
-            # work with a dict of dataframes containing open orders:
-            moex_orders = self.moex_connector.open_orders[moex_symbol][["ticket","symbol","type","volume_current", "price_open"]]
+            # open orders are kept locally by moex_connector. Check them against the terminal only if the position
+            # changed (fills), a previous action failed or the reconcile interval passed. Positions in the same MT5 call
+            if signal_produced_by == "pose_checker":
+                self.moex_connector.open_orders.mark_dirty(moex_symbol)
+            await self.moex_connector.refresh([moex_symbol], orders = None)
+            live_orders = self.moex_connector.open_orders.get(moex_symbol) # ticket : OrderRecord
 
             ib_ask = self.nymex_connector.current_ask[nymex_symbol] # ask price on IB
             ib_bid = self.nymex_connector.current_bid[nymex_symbol] # bid price on IB
             moex_pose = self.moex_connector.positions[moex_symbol]
             print(f"{datetime.now()}: order_flow: moex_pose: {moex_pose}")
-            pose_index = await self.searchsortedAsync(pose_grid, moex_pose, side = "left") # TODO: side - TBC. Async version - TBC
-            # "id","symbol","type","volume","price
-
-            # calculate theoretical number to keep track on cancelled orders (if they filled or not)
-            #theor_pose = moex_pose + \
-            #    moex_orders.loc[moex_orders["type"] == mt5.ORDER_TYPE_BUY_LIMIT, "volume_current"].sum() - \
-            #        moex_orders.loc[moex_orders["type"] == mt5.ORDER_TYPE_SELL_LIMIT, "volume_current"].sum()
-
-
-            orders = self.target_orders[symbol].copy()
-            #cond = orders["id"]
-            for i in range(number_of_steps):
-                if i < pose_index:
-                    # calculate desired order parameters
-                    orders.loc[number_of_steps-i-1,"type"] = mt5.ORDER_TYPE_SELL_LIMIT
-                    orders.loc[number_of_steps-i-1,"price_open"] = np.around(ib_ask + spread_grid[number_of_steps-i-1],self.decimals[symbol])
-                    orders.loc[number_of_steps-i-1,"volume_current"] = np.around((np.min([(pose_grid[i+1] if i < (number_of_steps - 1) else moex_pose), moex_pose]) - (pose_grid[i]) ),0)
-                else:
-                    # calculate desired order parameters
-                    orders.loc[number_of_steps-i-1,"type"] = mt5.ORDER_TYPE_BUY_LIMIT
-                    orders.loc[number_of_steps-i-1,"price_open"] = np.around(ib_bid + spread_grid[number_of_steps-i-1], self.decimals[symbol])
-                    orders.loc[number_of_steps-i-1,"volume_current"] = np.around(( (pose_grid[i]) - np.max([(pose_grid[i-1] if i > 0 else moex_pose), moex_pose]) ),0)
-            orders = orders.sort_values(by=['price_open'], ascending=True)
-            orders = orders[orders["volume_current"] != 0]
-            orders["symbol"] = moex_symbol
-
-            orders_capped = orders.copy()
-            orders_capped["volume_current"] = np.minimum(orders_capped["volume_current"], self.moex_max_lots[symbol])
-            self.target_orders[symbol] = orders_capped.copy()
-            orders_reset = orders_capped.reset_index(names="target_index")
-
-            # find orders to modify and cancel and resend
-            
-            # pandas merge() method creates new DataFrame, original ones remain unchanged
-            merged = pd.merge(moex_orders, orders_reset, how = "outer", on = ['ticket', 'symbol', 'type', 'volume_current'], indicator = True)
-
-            cancel_df = merged[merged['_merge'] == 'left_only']
-
-            modify_df = merged[(merged['_merge'] == 'both') & (merged['price_open_x'] != merged['price_open_y'])]
-
-            orders_to_cancel = cancel_df['ticket'].tolist()
-            orders_to_modify = modify_df[['ticket', 'price_open_y']].to_dict('records')
-            # time to redo.
-            # place new orders only in case all orders are cancelled?
-            
-            print(moex_orders)
+            if np.isnan(ib_bid) or np.isnan(ib_ask):
+                print(f"{datetime.now()}: {symbol} no IB bid / ask, orders not updated")
+                continue
+
+            # target ladder as arrays (one order per grid level), reconciled with live orders by ticket
+            ladder = self.target_orders[symbol]
+            ladder.update(*grid.ladder(ib_bid, ib_ask, moex_pose, self.moex_max_lots[symbol], self.decimals[symbol]))
+            # nothing to do if the rounded target and the live orders are the same as after the last completed cycle
+            fingerprint = (ladder.fingerprint(), self.moex_connector.open_orders.versions[moex_symbol])
+            if fingerprint == self.sent_fingerprints.get(symbol):
+                self.order_churn.record(symbol, skipped = True)
+                continue
+            self.sent_fingerprints.pop(symbol, None)
+            orders_to_cancel, orders_to_modify, orders_to_place = ladder.reconcile(live_orders, tick_size, self.price_tolerance_ticks[symbol], MOEX_MODIFY_VOLUME)
+            cancelled_moex_orders = [live_orders[ticket] for ticket in orders_to_cancel]
+
+            print(self.moex_connector.open_orders.records(moex_symbol))
             print(f"{datetime.now()}: review orders:")
             print(orders_to_cancel)
             print(orders_to_modify)
-            print(orders)
+            print(ladder.orders())
             
-            cancel_tasks = [asyncio.create_task(self.cancel_task(ticket, moex_symbol, ib_signal_time, signal_produced_by)) for ticket in orders_to_cancel]
-            modify_tasks = [asyncio.create_task(self.modify_task(item["ticket"], item["price_open_y"], moex_symbol, ib_signal_time, signal_produced_by)) for item in orders_to_modify]
-            await asyncio.gather(*(cancel_tasks + modify_tasks))
+            # cancels and modifies go to the order gateway as one batch, completed together
+            requests = [cancel_order(moex_symbol, ticket) for ticket in orders_to_cancel] + \
+                [modify_order(moex_symbol, ticket, price, volume) for ticket, price, volume in orders_to_modify]
+            print(f"{datetime.now()}: sending {len(requests)} cancel / modify requests. {signal_produced_by}: Time since signal = {datetime.now() - ib_signal_time}")
+            await self.order_gateway.execute(requests)
+            self.order_batch_report(symbol, requests, ib_signal_time, signal_produced_by)
+            sent_requests = requests
             
             if not orders_to_cancel:
-                place_df = merged[merged['_merge'] == 'right_only']
-                orders_to_place = place_df["target_index"].to_list()
                 print(orders_to_place)
-                new_tasks = [asyncio.create_task(self.new_task(i, moex_symbol, ib_signal_time, signal_produced_by)) for i in orders_to_place]
-                await asyncio.gather(*new_tasks)
+                requests = [new_order(moex_symbol, order_type, volume, price, tag = level) for level, _, order_type, volume, price in ladder.orders(orders_to_place)]
+                # margin for the whole batch is estimated locally, the terminal is asked only close to the limit
+                margin_orders = [(moex_symbol, request.volume if request.order_type == mt5.ORDER_TYPE_BUY_LIMIT else -request.volume) for request in requests]
+                if await self.moex_connector.check_margin_batch(margin_orders):
+                    await self.order_gateway.execute(requests)
+                    self.order_batch_report(symbol, requests, ib_signal_time, signal_produced_by)
+                    sent_requests = sent_requests + requests
+                    # the ladder is fully placed only if every request went through
+                    if all(request.state == STATE_DONE for request in sent_requests):
+                        self.sent_fingerprints[symbol] = (fingerprint[0], self.moex_connector.open_orders.versions[moex_symbol])
+                else:
+                    print(f"{datetime.now()}: {symbol} not enough margin for {len(requests)} new orders, skipping them")
+                    asyncio.create_task(self.bot.send_message(f"{symbol} not enough margin for {len(requests)} new orders, skipping them"))
                 print(f"{datetime.now()}: all orders completed, time since signal = {datetime.now() - ib_signal_time}")
 
             else:
@@ -254,44 +282,30 @@ class MeanReversionStrategy:
                 print(f"{datetime.now()}: check cancel orders results:")
                 # need to check cancel order results
                 
-                cancelled_moex_orders = moex_orders.loc[moex_orders["ticket"].isin(orders_to_cancel)][["ticket","type","volume_current"]]
                 print(f"{datetime.now()}: cancelled orders:")
                 print(cancelled_moex_orders)
 
-                hist_order_checker = True # to check that all cancelled orders are in the historical orders list
-                hist_counter = datetime.now()
-                while hist_order_checker:
-                    hist_orders = self.moex_connector.load_hist_orders(moex_symbol)
-                    hist_order_selected = hist_orders.loc[hist_orders["ticket"].isin(orders_to_cancel)][["ticket","type","volume_current"]]
-                    selected_tickets_set = set(hist_order_selected["ticket"].unique())
-                    orders_set = set(orders_to_cancel)
-                    if orders_set.issubset(selected_tickets_set):
-                        hist_order_checker = False
-                    else:
-                        print(f"{datetime.now()}: start waiting for updated historical orders results")
-                        asyncio.sleep(0.05)
-                        if (datetime.now() - hist_counter) > timedelta(seconds = 5):
-                            print(f"{datetime.now()}: {symbol} historical orders not loaded in 5 seconds! continuing as it is")
-                            asyncio.create_task(self.bot.send_message(f"{symbol} historical orders not loaded in 5 seconds! continuing as it is"))
-                            #await self.stop_trading(symbol)
-                            hist_order_checker = False
-                            # break the loop
-                        # TODO: TBA COUNTER TO BREAK THE LOOP
+                # to check that all cancelled orders are in the historical orders list. Resolved by the history cache, no polling here
+                if not await self.moex_connector.wait_hist_orders(moex_symbol, orders_to_cancel, timeout = 5):
+                    print(f"{datetime.now()}: {symbol} historical orders not loaded in 5 seconds! continuing as it is")
+                    asyncio.create_task(self.bot.send_message(f"{symbol} historical orders not loaded in 5 seconds! continuing as it is"))
+                    #await self.stop_trading(symbol)
+                hist_order_selected = self.moex_connector.hist_orders.frame(moex_symbol, orders_to_cancel)[["ticket","type","volume_current"]]
 
-                
                 print(f"{datetime.now()}: historical orders loaded:")
                 print(hist_order_selected)
 
+                cancelled_buy_volume = sum(record.volume_current for record in cancelled_moex_orders if record.type == mt5.ORDER_TYPE_BUY_LIMIT)
+                cancelled_sell_volume = sum(record.volume_current for record in cancelled_moex_orders if record.type == mt5.ORDER_TYPE_SELL_LIMIT)
                 print(f"{datetime.now()}: volumes summary for filled calcs:")
-                print(f"{datetime.now()}: cancelled buy volumes {cancelled_moex_orders.loc[cancelled_moex_orders['type'] == mt5.ORDER_TYPE_BUY_LIMIT, 'volume_current'].sum()}")
-                print(f"{datetime.now()}: cancelled sell volumes {cancelled_moex_orders.loc[cancelled_moex_orders['type'] == mt5.ORDER_TYPE_SELL_LIMIT, 'volume_current'].sum()}")
+                print(f"{datetime.now()}: cancelled buy volumes {cancelled_buy_volume}")
+                print(f"{datetime.now()}: cancelled sell volumes {cancelled_sell_volume}")
                 print(f"{datetime.now()}: historical buy volumes {hist_order_selected.loc[hist_order_selected['type'] == mt5.ORDER_TYPE_BUY_LIMIT, 'volume_current'].sum()}")
                 print(f"{datetime.now()}: historical sell volumes {hist_order_selected.loc[hist_order_selected['type'] == mt5.ORDER_TYPE_SELL_LIMIT, 'volume_current'].sum()}")
                 
 
                 filled_before_cancel = \
-                    (cancelled_moex_orders.loc[cancelled_moex_orders["type"] == mt5.ORDER_TYPE_BUY_LIMIT, "volume_current"].sum() - \
-                    cancelled_moex_orders.loc[cancelled_moex_orders["type"] == mt5.ORDER_TYPE_SELL_LIMIT, "volume_current"].sum()) - \
+                    (cancelled_buy_volume - cancelled_sell_volume) - \
                     (hist_order_selected.loc[hist_order_selected["type"] == mt5.ORDER_TYPE_BUY_LIMIT, "volume_current"].sum() - \
                     hist_order_selected.loc[hist_order_selected["type"] == mt5.ORDER_TYPE_SELL_LIMIT, "volume_current"].sum())
                 print(f"{datetime.now()}: {symbol} filled_before_cancel = {filled_before_cancel}")
@@ -301,7 +315,7 @@ class MeanReversionStrategy:
                     positions_counter = datetime.now()
                     while positions_checker:
                         # loop to check that positions properly loaded after some orders filled before cancel
-                        self.moex_connector.load_positions([moex_symbol])
+                        await self.moex_connector.load_positions([moex_symbol])
                         moex_pose_new = self.moex_connector.positions[moex_symbol]
                         print(f"{datetime.now()}: {symbol} moex_pose_new = {moex_pose_new}, moex_pose (old) = {moex_pose}, ")
                 
@@ -349,102 +363,37 @@ class MeanReversionStrategy:
                 # need to also check if need to update / load positions on MOEX???? TODO: CONTINUE HERE
 
                 await asyncio.sleep(0.3)
-                self.limit_orders_events[symbol].clear() # duplication? TBC TODO:
                 await self.stop_symbol_trading(symbol) # closing all loops as well
                 break # TBC if necessary
             '''
-            print(f"{datetime.now()}: orders_flow completed, time since signal = {datetime.now() - ib_signal_time}")
-            # self.limit_orders_events[symbol].clear()
+            self.order_churn.record(symbol, sent_requests)
+            print(f"{datetime.now()}: orders_flow completed, time since signal = {datetime.now() - ib_signal_time}. {self.order_churn.report(symbol)}")
             # await asyncio.sleep(0.01)
         # cleaning:
+        signals.close()
         if symbol in self.target_orders:
             del self.target_orders[symbol]
-        # self.limit_orders_events[symbol].clear()
+        self.sent_fingerprints.pop(symbol, None)
+        self.grids.pop(symbol, None)
+        asyncio.create_task(self.bot.send_message(self.order_churn.report(symbol)))
         print(f"{datetime.now()}: {symbol} order_flow failed")
         asyncio.create_task(self.bot.send_message(f"{symbol} order_flow failed"))
 
 
-    async def cancel_task(self, ticket, moex_symbol, ib_signal_time, signal_produced_by):
-        symbol = self.symbols[self.moex_connector.symbols.index(moex_symbol)]
-        print(f"{datetime.now()}: trying to cancel order # {ticket}")
-        
-        Keep_trying = True
-        print(f"{datetime.now()}: cancelling loop:{(not self.should_stop[symbol].is_set())}")
-        while (Keep_trying):
-            
-            order_sent_time = datetime.now() - ib_signal_time
-            print(f"{datetime.now()}: cancel task starting loop to execute. {signal_produced_by}: Time since signal = {order_sent_time}")
-            cancel_trade = await asyncio.to_thread(self.moex_connector.cancel_order, int(ticket))
-
-            
-            if cancel_trade.retcode == mt5.TRADE_RETCODE_DONE:
-                print(f"{datetime.now()}: moex order cancelled: {ticket}, time since signal = {datetime.now() - ib_signal_time}")
-                Keep_trying = False
-            elif cancel_trade.retcode == mt5.TRADE_RETCODE_MARKET_CLOSED:
-                print(f"{datetime.now()}: {moex_symbol} {ticket} cancel order failure. MARKET CLOSED")
-                asyncio.create_task(self.bot.send_message(f"{datetime.now()}: {moex_symbol} {ticket} cancel order failure. MARKET CLOSED"))
-                await asyncio.sleep(300) # sleep [300] seconds before trying to send orders again
-                if (self.should_stop[symbol].is_set()):
-                    Keep_trying = False
-            else:
-                print(f"{datetime.now()}: {moex_symbol} {ticket} cancel order failure! retcode: {cancel_trade.retcode}, MT5 Error code: {mt5.last_error()}")
-                asyncio.create_task(self.bot.send_message(f"{moex_symbol} cancel order failure! retcode: {cancel_trade.retcode}, Error code: {mt5.last_error()}"))
-                Keep_trying = False
-
-
-
-    async def modify_task(self, ticket, price, moex_symbol, ib_signal_time, signal_produced_by):
-        symbol = self.symbols[self.moex_connector.symbols.index(moex_symbol)]
-        Keep_trying = True
-        print(f"{datetime.now()}: modifying loop:{(not self.should_stop[symbol].is_set())}")
-        while (Keep_trying):
-            order_sent_time = datetime.now() - ib_signal_time
-            print(f"{datetime.now()}: modifying task starting loop to execute. {signal_produced_by}: Time since signal = {order_sent_time}")
-            modify_trade = await asyncio.to_thread(self.moex_connector.modify_order, int(ticket), price)
-            if modify_trade.retcode == mt5.TRADE_RETCODE_DONE:
-                print(f"{datetime.now()}: moex order modified: {ticket}, time since signal = {datetime.now() - ib_signal_time}")
-                Keep_trying = False
-            elif modify_trade.retcode == mt5.TRADE_RETCODE_MARKET_CLOSED:
-                print(f"{datetime.now()}: {moex_symbol} {ticket} modify order failure. MARKET CLOSED")
-                asyncio.create_task(self.bot.send_message(f"{datetime.now()}: {moex_symbol} {ticket} modify order failure. MARKET CLOSED"))
-                await asyncio.sleep(300) # sleep [300] seconds before trying to send orders again
-                if (self.should_stop[symbol].is_set()):
-                    Keep_trying = False
-            else:
-                print(f"{moex_symbol} modify order failure! retcode: {modify_trade.retcode}, MT5 Error code: {mt5.last_error()}")
-                asyncio.create_task(self.bot.send_message(f"{moex_symbol} modify order failure! retcode: {modify_trade.retcode}, MT5 Error code: {mt5.last_error()}"))
-                Keep_trying = False
-
-
-
-    async def new_task(self, index, moex_symbol, ib_signal_time, signal_produced_by):
-        symbol = self.symbols[self.moex_connector.symbols.index(moex_symbol)]
-        order_type = int(self.target_orders[symbol].loc[index, "type"])
-        volume = self.target_orders[symbol].loc[index, "volume_current"]
-        price = self.target_orders[symbol].loc[index, "price_open"]
-        Keep_trying = True
-        print(f"{datetime.now()}: new orders loop:{(not self.should_stop[symbol].is_set())}")
-        while (Keep_trying):
-            order_sent_time = datetime.now() - ib_signal_time
-            print(f"{datetime.now()}: new task starting loop to execute. {signal_produced_by}: Time since signal = {order_sent_time}")
-            moex_trade = await asyncio.to_thread(self.moex_connector.limit_order, moex_symbol, order_type, volume, price)
-            if moex_trade.retcode == mt5.TRADE_RETCODE_DONE:
-                print(f"{datetime.now()}: target ticket before new order: {(self.target_orders[symbol].loc[index, 'ticket'])}")
-                self.target_orders[symbol].loc[index, "ticket"] = moex_trade.order
-                print(f"{datetime.now()}: target ticket after new order: {(self.target_orders[symbol].loc[index, 'ticket'])}")
-                print(f"{datetime.now()}: moex order placed: {moex_trade.order}, time since signal = {datetime.now() - ib_signal_time}")
-                Keep_trying = False
-            elif moex_trade.retcode == mt5.TRADE_RETCODE_MARKET_CLOSED:
-                print(f"{datetime.now()}: {moex_symbol} new order failure. MARKET CLOSED")
-                asyncio.create_task(self.bot.send_message(f"{datetime.now()}: {moex_symbol} new order failure. MARKET CLOSED"))
-                await asyncio.sleep(300) # sleep [300] seconds before trying to send orders again
-                if (self.should_stop[symbol].is_set()):
-                    Keep_trying = False
+# report results of a gateway batch and assign tickets of placed orders to the target orders
+    def order_batch_report(self, symbol, requests, ib_signal_time, signal_produced_by):
+        for request in requests:
+            if request.state == STATE_DONE:
+                if request.kind == ACTION_NEW:
+                    self.target_orders[symbol].set_ticket(request.tag, request.ticket)
+                print(f"{datetime.now()}: moex order {request.kind}: {request.ticket}, attempts: {request.attempts}, {signal_produced_by}: time since signal = {datetime.now() - ib_signal_time}")
             else:
-                print(f"{moex_symbol} new order failure! retcode: {moex_trade.retcode}, Error code: {mt5.last_error()}")
-                asyncio.create_task(self.bot.send_message(f"{moex_symbol} new order failure! retcode: {moex_trade.retcode}, Error code: {mt5.last_error()}"))
-                await asyncio.sleep(30) # sleep [30] seconds before trying to send orders again
-            
+                print(f"{datetime.now()}: moex order {request.kind} not completed: {request}")
+        if requests:
+            moex_symbol = requests[0].symbol
+            self.market_bus.publish(KIND_ORDER_STATE, symbol, OrderState(datetime.now(), self.moex_connector.open_orders.versions[moex_symbol],
+                                                                         len(self.moex_connector.open_orders.get(moex_symbol))))
+
 
 
 # hedging loop
@@ -454,14 +403,14 @@ class MeanReversionStrategy:
         moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol 
-        self.limit_pose_events[symbol].set
+        positions = self.market_bus.subscribe(symbol, (KIND_POSITION,))
+        risk_open = False # checked again without waiting until open risk is below max_risk
         while not self.should_stop[symbol].is_set():
-            if not self.should_stop[symbol].is_set():
-                await self.limit_pose_events[symbol].wait()
+            if not risk_open and await positions.get() is CLOSED:
+                break
             # print(f"{datetime.now()}: start checking positions")
             timer = datetime.now()
-            self.moex_connector.load_positions([moex_symbol])
-            self.nymex_connector.load_positions([nymex_symbol])
+            await self.moex_connector.load_positions([moex_symbol]) # IB positions are pushed, see NymexAsyncWrapper.position_book
             
             moex_pose = self.moex_connector.positions[moex_symbol]
             nymex_pose = self.nymex_connector.positions[nymex_symbol]
@@ -469,43 +418,28 @@ class MeanReversionStrategy:
             open_risk = moex_pose + nymex_pose * lots
             print(f"{datetime.now()}: hedger: {symbol} open_risk before trade: {open_risk}")
             # apply max risk and max lots to the target nymex order lot size
-            sign_open_risk = np.sign(open_risk)
-            abs_open_risk_adjusted = np.trunc((abs(open_risk)+(lots-self.max_risk[symbol]))/lots)
-            nymex_lots_to_trade = min(self.nymex_max_lots[symbol], abs_open_risk_adjusted)
+            nymex_lots_signed = hedge_lots(moex_pose, nymex_pose, lots, self.max_risk[symbol], self.nymex_max_lots[symbol])
+            nymex_lots_to_trade = abs(nymex_lots_signed)
 
+            risk_open = nymex_lots_to_trade != 0
             if nymex_lots_to_trade != 0:
                 
-                if sign_open_risk == 1:
-                    trade_type = "Sell"
-                elif sign_open_risk == -1:
-                    trade_type = "Buy"
+                trade_type = "Buy" if nymex_lots_signed > 0 else "Sell"
                 print(f"{datetime.now()}: {symbol} starting NYMEX order execution: {trade_type} {nymex_lots_to_trade}. calcs time: {datetime.now() - timer}")
                 # market order to on nymex
                 nymex_trade_id = await self.nymex_connector.send_order(nymex_contract,trade_type,nymex_lots_to_trade)
-                # Wait for the order to be filled
-                await self.nymex_connector.order_filled_events[nymex_trade_id].wait()
-                # Once the order has been filled, remove the Event
-                del self.nymex_connector.order_filled_events[nymex_trade_id]
-                self.moex_connector.load_positions([moex_symbol])
-                self.nymex_connector.load_positions([nymex_symbol])
+                # wait until IB reports the position after the fill (execution / position pushes)
+                target_nymex_pose = nymex_pose + nymex_lots_signed
+                print(f"{datetime.now()}: {symbol} nymex_pose before trade: {nymex_pose}, waiting for {target_nymex_pose}")
+                position_reached = await self.nymex_connector.wait_position(nymex_symbol, target_nymex_pose, timeout=30)
+                self.nymex_connector.order_filled_events.pop(nymex_trade_id, None)
+                if not position_reached:
+                    print(f"{datetime.now()}: {symbol} IB order not executed in 30 seconds! Stopping trading {symbol}")
+                    asyncio.create_task(self.bot.send_message(f"{symbol} IB order not executed in 30 seconds! Stopping trading {symbol}"))
+                    asyncio.create_task(self.stop_trading(symbol)) # stop_trading waits for this task, can't be awaited here
+                    break
+                await self.moex_connector.load_positions([moex_symbol])
                 moex_pose = self.moex_connector.positions[moex_symbol]
-                
-                #waint until IB position reflect the market order
-                counter = datetime.now()
-                print(f"{datetime.now()}: {symbol} nymex_pose before trade: {nymex_pose}")
-                print(f"{datetime.now()}: {symbol} nymex_lots_to_trade: {nymex_lots_to_trade}")
-                print(f"{datetime.now()}: {symbol} nymex loaded positions: {self.nymex_connector.positions[nymex_symbol]}")
-                print((nymex_pose - sign_open_risk*nymex_lots_to_trade) - self.nymex_connector.positions[nymex_symbol])
-                while np.around(((nymex_pose - sign_open_risk*nymex_lots_to_trade) - self.nymex_connector.positions[nymex_symbol]),0) != 0:
-                    # wait until position is updated
-                    print((nymex_pose - sign_open_risk*nymex_lots_to_trade) - self.nymex_connector.positions[nymex_symbol])
-                    await asyncio.sleep(0.1)
-                    self.nymex_connector.load_positions([nymex_symbol])
-                    print(f"{datetime.now()}: waiting for {symbol} IB order execution: {(datetime.now() - counter).total_seconds()} seconds")
-                    if (datetime.now() - counter) > timedelta(seconds=30):
-                        print(f"{datetime.now()}: {symbol} IB order not executed in 30 seconds! Stopping trading {symbol}")
-                        asyncio.create_task(self.bot.send_message(f"{symbol} IB order not executed in 30 seconds! Stopping trading {symbol}"))
-                        await self.stop_trading(symbol)
 
                 nymex_pose = self.nymex_connector.positions[nymex_symbol]
                 open_risk_after_trade = moex_pose + nymex_pose * lots
@@ -515,12 +449,10 @@ class MeanReversionStrategy:
                     open risk after trade: {open_risk_after_trade} lots. MOEX lots: {moex_pose}, NYMEX lots: {nymex_pose}"))
 
             else:
-                # clear signal from check_pose loop only in case open risk is below the max_risk limit
-                self.limit_pose_events[symbol].clear()
+                # wait for the next position change only in case open risk is below the max_risk limit
                 print(f"{datetime.now()}: hedger: {symbol} open risk: {open_risk}. Function run time: {datetime.now() - timer}")
-            # don't clear limit_pose_events until open_risk below max_risk.
             await asyncio.sleep(1) # To be reduced
-        self.limit_pose_events[symbol].clear()
+        positions.close()
         print(f"{datetime.now()}: {symbol} hedger failed")
         asyncio.create_task(self.bot.send_message(f"{symbol} hedger failed"))
 
@@ -536,7 +468,10 @@ class MeanReversionStrategy:
         #moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol         
-        await self.nymex_connector.subscribe_bid_ask(nymex_contract)
+        if not await self.nymex_connector.subscribe_bid_ask(nymex_contract): # returns at once if already subscribed
+            print(f"{datetime.now()}: no NYMEX {nymex_symbol} quotes, {symbol} trading not started")
+            self.notify(f"no NYMEX {nymex_symbol} quotes, {symbol} trading not started")
+            return
         print(f"{datetime.now()}: Symbol {nymex_symbol}: Current bid: {self.nymex_connector.current_bid[nymex_symbol]}, Current ask: {self.nymex_connector.current_ask[nymex_symbol]}")
         print(f"{datetime.now()}: subscription to NYMEX {nymex_symbol} completed")
 
@@ -545,15 +480,14 @@ class MeanReversionStrategy:
             # There is already an active task for this symbol, so we stop it before starting a new one
             print(f"{datetime.now()}: Stopping the active trading task for {symbol} before starting a new one.")
             self.should_stop[symbol].set()
-            await asyncio.sleep(self.timeout+self.timeout) # not sure if needed
-            self.grid_events[symbol].set()
+            self.market_bus.close(symbol) # wakes up the loops
             await asyncio.gather(*self.active_trades[symbol])
-            self.grid_events[symbol].clear()
 
         self.should_stop[symbol].clear()
-        coroutines = [self.compare_prices(symbol), self.grid(symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose), self.nymex_to_moex_signal]
+        self.order_gateway.resume(self.moex_connector.symbols[self.symbols.index(symbol)])
+        coroutines = [self.compare_prices(symbol), self.grid(symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose)]
         self.active_trades[symbol] = [asyncio.create_task(coro) for coro in coroutines]
-        if not self.scheduler_on:
+        if self.run_scheduler and not self.scheduler_on:
             asyncio.create_task(self.scheduler())
         await asyncio.gather(*self.active_trades[symbol])
 
@@ -563,7 +497,10 @@ class MeanReversionStrategy:
         moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol
-        await self.nymex_connector.subscribe_bid_ask(nymex_contract)
+        if not await self.nymex_connector.subscribe_bid_ask(nymex_contract): # returns at once if already subscribed
+            print(f"{datetime.now()}: no NYMEX {nymex_symbol} quotes, {symbol} trading not started")
+            self.notify(f"no NYMEX {nymex_symbol} quotes, {symbol} trading not started")
+            return
         print(f"{datetime.now()}: Symbol {nymex_symbol}: Current bid: {self.nymex_connector.current_bid[nymex_symbol]}, Current ask: {self.nymex_connector.current_ask[nymex_symbol]}")
         print(f"{datetime.now()}: subscription to NYMEX {nymex_symbol} completed")
         
@@ -571,11 +508,7 @@ class MeanReversionStrategy:
             # There is already an active task for this symbol, so we stop it before starting a new one
             print(f"{datetime.now()}: Stopping the active trading task for {symbol} before starting a new one.")
             self.should_stop[symbol].set()
-            await asyncio.sleep(self.timeout+self.timeout) # not sure if needed
-            self.limit_pose_events[symbol].set()
-            self.limit_orders_events[symbol].put_nowait(None)
-
-            self.limit_pose_events[symbol].clear()
+            self.market_bus.close(symbol) # wakes up the loops
             await asyncio.gather(*self.active_trades[symbol])
 
             for task in self.active_trades[symbol]:
@@ -583,16 +516,17 @@ class MeanReversionStrategy:
                 task.cancel()
         print(f"{datetime.now()}: clearing stop signal:")
         self.should_stop[symbol].clear()
+        self.order_gateway.resume(moex_symbol)
         print(f"{datetime.now()}: stop signal cleared.")
         
-        self.target_orders[symbol] = pd.DataFrame(columns = ["ticket","symbol","type","volume_current", "price_open"], ).astype({"ticket" : int, "symbol" : str, "type" : int, "volume_current" : float, "price_open" : float})
+        self.target_orders[symbol] = OrderLadder(number_of_steps)
         
         self.active_trades[symbol] = [
             asyncio.create_task(self.check_pose(symbol)), 
             asyncio.create_task(self.order_flow(symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose)),
             asyncio.create_task(self.hedger(symbol))
         ]
-        if not self.scheduler_on:
+        if self.run_scheduler and not self.scheduler_on:
             asyncio.create_task(self.scheduler())
         await asyncio.gather(*self.active_trades[symbol])
 
@@ -601,71 +535,47 @@ class MeanReversionStrategy:
         if symbol is None:
             # Stop all running tasks for each symbol
             print(f"{datetime.now()}: stop_trading:")
-            for symbol_to_cancel in self.active_trades:
+            for symbol_to_cancel in list(self.active_trades): # entries are deleted below
                 print(f"{datetime.now()}: stop_trading: {symbol_to_cancel}")
                 await self.stop_symbol_trading(symbol_to_cancel)
-                self.grid_events[symbol_to_cancel].set()
-                self.limit_orders_events[symbol_to_cancel].put_nowait(None)
-                
-                try:
-                    self.nymex_to_moex_queue[symbol_to_cancel].put_nowait(None)
-                except:
-                    pass
-                self.limit_pose_events[symbol_to_cancel].set()
-                
-                self.grid_events[symbol_to_cancel].clear()
-                self.limit_pose_events[symbol_to_cancel].clear()
-
                 await asyncio.gather(*self.active_trades[symbol_to_cancel])
 
                 moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol_to_cancel)]
-                print(self.moex_connector.open_orders[moex_symbol])
-                if moex_symbol in self.moex_connector.open_orders:
-                    print(self.moex_connector.open_orders[moex_symbol])
-                    for ticket in self.moex_connector.open_orders[moex_symbol]["ticket"]:
-                        cancel_trade = await asyncio.to_thread(self.moex_connector.cancel_order, int(ticket))
-                        if cancel_trade.retcode == mt5.TRADE_RETCODE_DONE:
-                            print(f"{datetime.now()}: moex order cancelled: {ticket}")
-                        else:
-                            print(f"{datetime.now()}: {moex_symbol} cancel order failure! Error code: {mt5.last_error()}")
-                            asyncio.create_task(self.bot.send_message(f"{moex_symbol} cancel order failure! retcode: {cancel_trade.retcode}.Error code: {mt5.last_error()}"))
-                    del self.moex_connector.open_orders[moex_symbol]
+                await self.cancel_open_orders(moex_symbol)
                 del self.active_trades[symbol_to_cancel] # TODO: check if working properly
         else:
             if symbol in self.active_trades:
                 # Stop the task for the specified symbol
                 await self.stop_symbol_trading(symbol)
-                self.grid_events[symbol].set()
-                self.limit_orders_events[symbol].put_nowait(None)
-                try:
-                    self.nymex_to_moex_queue[symbol_to_cancel].put_nowait(None)
-                except:
-                    pass
-                self.limit_pose_events[symbol].set()
-                
-                self.grid_events[symbol].clear()
-                self.limit_pose_events[symbol].clear()
-
                 await asyncio.gather(*self.active_trades[symbol])
 
                 moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
-                if moex_symbol in self.moex_connector.open_orders:
-                    for ticket in self.moex_connector.open_orders[moex_symbol]["ticket"]:
-                        cancel_trade = await asyncio.to_thread(self.moex_connector.cancel_order, int(ticket))
-                        if cancel_trade.retcode == mt5.TRADE_RETCODE_DONE:
-                            print(f"{datetime.now()}: moex order cancelled: {ticket}")
-                        else:
-                            print(f"{datetime.now()}: {moex_symbol} cancel order failure! Error code: {mt5.last_error()}")
-                            asyncio.create_task(self.bot.send_message(f"{moex_symbol} cancel order failure! retcode: {cancel_trade.retcode}. Error code: {mt5.last_error()}"))
-                    del self.moex_connector.open_orders[moex_symbol]
+                await self.cancel_open_orders(moex_symbol)
                 del self.active_trades[symbol]
             else:
                 print(f"{datetime.now()}: {symbol} is not in active_trades")
                 asyncio.create_task(self.bot.send_message(f"{symbol} is not in active_trades"))
 
 
+# cancel all open limit orders of the symbol in one gateway batch
+    async def cancel_open_orders(self, moex_symbol):
+        await self.moex_connector.load_orders(moex_symbol) # make sure nothing placed meanwhile is left behind
+        if self.moex_connector.open_orders.get(moex_symbol):
+            print(self.moex_connector.open_orders.records(moex_symbol))
+            requests = [cancel_order(moex_symbol, ticket) for ticket in self.moex_connector.open_orders.tickets(moex_symbol)]
+            await self.order_gateway.execute(requests)
+            for request in requests:
+                if request.state == STATE_DONE:
+                    print(f"{datetime.now()}: moex order cancelled: {request.ticket}")
+                else:
+                    print(f"{datetime.now()}: {moex_symbol} {request.ticket} cancel order failure! Error code: {request.error}")
+
+
     async def stop_symbol_trading(self,symbol):
         self.should_stop[symbol].set()
+        self.market_bus.close(symbol) # strategy loops waiting for data return
+        moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
+        self.order_gateway.stop(moex_symbol) # drop requests waiting for the market to open
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         await self.nymex_connector.unsubscribe_bid_ask(nymex_contract)
 
@@ -677,7 +587,7 @@ class MeanReversionStrategy:
         nymex_contract = self.nymex_connector.contracts[self.symbols.index(symbol)]
         nymex_symbol = nymex_contract.localSymbol
 
-        self.moex_connector.load_positions([moex_symbol])
+        await self.moex_connector.load_positions([moex_symbol])
         self.nymex_connector.load_positions([nymex_symbol])
         
         moex_pose = self.moex_connector.positions[moex_symbol]
@@ -685,15 +595,13 @@ class MeanReversionStrategy:
         
         lots = self.moex_connector.lots_dict[moex_symbol]
 
-        grid = [(i-(number_of_steps - 1)/2) for i in range(number_of_steps)]
-        spread_grid = np.around([spread_step * i + mid_spread for i in grid],3)
-        pose_grid = np.around([pose_step * i + mid_pose for i in grid],0)
-        asyncio.create_task(self.bot.send_message(f"{symbol} spread_grid = "+str(spread_grid)+f"\n{symbol} pose_grid = "+str(pose_grid)))
-        self.grid_events[symbol].set
+        grid = self.grids[symbol] = CompiledGrid(spread_step, pose_step, number_of_steps, mid_spread, mid_pose)
+        asyncio.create_task(self.bot.send_message(f"{symbol} spread_grid = "+str(grid.spread_grid)+f"\n{symbol} pose_grid = "+str(grid.pose_grid)))
+        quotes = self.market_bus.subscribe(symbol, (KIND_MOEX_BOOK, KIND_NYMEX_QUOTE))
         while not self.should_stop[symbol].is_set():
-            # Wait for the trade event to be set
-            if not self.should_stop[symbol].is_set():
-                await self.grid_events[symbol].wait()
+            # Wait for MOEX book or IB quote update, or run every timeout
+            if await quotes.get(timeout = self.timeout) is CLOSED:
+                break
             # await self.bot.send_message(f"{symbol} spread_grid iteration started - TEST")
             # check if real positions equals to calculated positions
 
@@ -715,15 +623,12 @@ class MeanReversionStrategy:
                 # calculate positive (moex price > NYMEX price) spread before slippage to exit: buy moex & sell nymex
                 Spread_to_long = moex_ask - ib_bid
                 print(f"{datetime.now()}: {symbol}: ",Spread_to_long,Spread_to_short)
-                spread_to_long_index = await self.searchsortedAsync(spread_grid,Spread_to_long,side='left')
-                spread_to_short_index = await self.searchsortedAsync(spread_grid,Spread_to_short,side='left')
-                pose_to_short_index = await self.searchsortedAsync(pose_grid,moex_pose,side='left')
-                pose_to_long_index = await self.searchsortedAsync(pose_grid,moex_pose,side='right')
-                if ((number_of_steps - spread_to_short_index) < pose_to_short_index) and ((spread_to_short_index)>1):
+                signal = grid_signal(grid, moex_bid, moex_ask, ib_bid, ib_ask, moex_pose)
+                if signal == SIGNAL_SHORT:
                     print(f"{datetime.now()}: {symbol}: trying to short moex and long IB")
                     #  trade short
                     # market order to sell 25 lots on moex
-                    moex_trade = self.moex_connector.send_order(moex_symbol,"Sell",lots)
+                    moex_trade, moex_error = await self.moex_connector.send_order(moex_symbol,"Sell",lots)
                     if moex_trade.retcode == mt5.TRADE_RETCODE_DONE:
                         # market order to buy 1 lot on nymex
                         nymex_trade_id = await self.nymex_connector.send_order(nymex_contract,"Buy",1)
@@ -739,20 +644,19 @@ class MeanReversionStrategy:
                         print(f"{datetime.now()}: {symbol}: sell moex buy IB with target value"+str(Spread_to_short))
                         nymex_pose = nymex_pose + 1 # TODO: this should check the real pose?
                         moex_pose = moex_pose - lots # TODO: this should check the real pose?
-                        self.moex_connector.load_positions([moex_symbol])
-                        self.nymex_connector.load_positions([nymex_symbol])
+                        await self.moex_connector.load_positions([moex_symbol])
                         asyncio.create_task(self.bot.send_message(f"{symbol}: sell moex buy IB with target value "+str(np.around(Spread_to_short,3))+f"\n\
                             {symbol} pose on MOEX: " + str(moex_pose)+f"\n{symbol} pose on NYMEX: " + str(nymex_pose)))
                     else:
-                        print(f"{datetime.now()}: {symbol} order_send failed, retcode={moex_trade.retcode}")
+                        print(f"{datetime.now()}: {symbol} order_send failed, retcode={moex_trade.retcode}, error code: {moex_error}")
                         if self.retcode_send == 1:
                             asyncio.create_task(self.bot.send_message(f"{symbol}1: order_send failed, retcode={moex_trade.retcode}"))
 
-                elif (number_of_steps - spread_to_long_index > pose_to_long_index) and ((number_of_steps - spread_to_long_index) > 1):
+                elif signal == SIGNAL_LONG:
                     print(f"{datetime.now()}: {symbol}: trying to long moex and short IB")
                     # trade long
                     # market order to buy # lots on moex
-                    moex_trade = self.moex_connector.send_order(moex_symbol,"Buy",lots)
+                    moex_trade, moex_error = await self.moex_connector.send_order(moex_symbol,"Buy",lots)
                     if moex_trade.retcode == mt5.TRADE_RETCODE_DONE:
                         # market order to sell 1 lot on nymex
                         nymex_trade_id = await self.nymex_connector.send_order(nymex_contract,"Sell",1)
@@ -765,27 +669,24 @@ class MeanReversionStrategy:
                         print(f"{datetime.now()}: {symbol}: buy moex sell IB with target value"+str(Spread_to_long))
                         nymex_pose = nymex_pose - 1 # TODO: this should check the real pose?
                         moex_pose = moex_pose + lots # TODO: this should check the real pose?
-                        self.moex_connector.load_positions([moex_symbol])
-                        self.nymex_connector.load_positions([nymex_symbol])
+                        await self.moex_connector.load_positions([moex_symbol])
                         asyncio.create_task(self.bot.send_message(f"{symbol}: buy moex sell IB with target value "+str(np.around(Spread_to_long,3))+f"\n\
                             {symbol} pose on MOEX: " + str(moex_pose)+f"\n{symbol} pose on NYMEX: " + str(nymex_pose)))
                     else:
-                        print(f"{datetime.now()}: {symbol}: order_send failed, retcode={moex_trade.retcode}")
+                        print(f"{datetime.now()}: {symbol}: order_send failed, retcode={moex_trade.retcode}, error code: {moex_error}")
                         if self.retcode_send == 1:
                             asyncio.create_task(self.bot.send_message(f"{symbol}: order_send failed, retcode={moex_trade.retcode}"))
 
                 else:
                     print(f"{datetime.now()}: {symbol}: no trades this iteration")
-                # Reset the event so we can wait for it again
-                self.grid_events[symbol].clear()
                  
             else:
-                self.grid_events[symbol].clear()
                 print(f"{datetime.now()}: no access to bid and ask data")
                 asyncio.create_task(self.bot.send_message("no access to bid and ask data"))
                 await asyncio.sleep(30)
             
-        self.grid_events[symbol].clear()
+        quotes.close()
+        self.grids.pop(symbol, None)
         print(f"{datetime.now()}: {symbol} grid loop failed")
         asyncio.create_task(self.bot.send_message(f"{symbol} grid loop failed"))
 
@@ -819,32 +720,49 @@ class MeanReversionStrategy:
 
 
 
-# TODO: TBD if need to rewrite for asynchonous execution
-    async def searchsortedAsync(self, list_grid,float_number,side:str):
-        return np.searchsorted(list_grid,float_number,side)
-
 # connections with user_interface telegram bot
 
     def set_bot(self, bot):
         self.bot = bot
 
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+# move the running grid of the symbol to new mids. Orders follow on the next order_flow cycle
+    async def recentre(self, symbol, mid_spread, mid_pose):
+        if symbol not in self.grids:
+            return f"{symbol} has no running grid"
+        grid = self.grids[symbol]
+        grid.recentre(mid_spread, mid_pose)
+        return f"{symbol} spread_grid = "+str(grid.spread_grid)+f"\n{symbol} pose_grid = "+str(grid.pose_grid)
+
+    def set_risk_coef(self, risk_coef):
+        self.risk_coef = risk_coef
+        for symbol in self.symbols:
+            moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
+            self.max_risk[symbol] = self.moex_connector.lots_dict[moex_symbol] * self.risk_coef
+
+# one line per symbol for the status command
+    async def status(self):
+        lines = []
+        for symbol in self.symbols:
+            moex_symbol = self.moex_connector.symbols[self.symbols.index(symbol)]
+            nymex_symbol = self.nymex_connector.symbols[self.symbols.index(symbol)]
+            lines.append(f"{symbol}: {'trading' if symbol in self.active_trades else 'stopped'}, MOEX {moex_symbol}: {self.moex_connector.positions[moex_symbol]}, "
+                         f"NYMEX {nymex_symbol}: {self.nymex_connector.positions[nymex_symbol]}, {self.order_churn.round_trips_per_tick(symbol):.2f} round trips per tick")
+        return "\n".join(lines)
+
+    def notify(self, message):
+        asyncio.create_task(self.bot.send_message(message))
+
 # RUN function:
     async def run(self):
         self.nymex_connector.ib.pendingTickersEvent  += self.on_pending_tickers
-        #tasks = [asyncio.create_task(self.nymex_to_moex_signal())]
-        #await asyncio.gather(*tasks)
-
-
-class LatestQueue(asyncio.Queue):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    async def get(self):
-        # This will get the latest item and clear all older items
-        while True:
-            item = await super().get()
-            try:
-                if self.empty():
-                    return item
-            finally:
-                self.task_done()
+        # all contracts at once, so start_*_trading finds them subscribed
+        subscribed = await self.nymex_connector.subscribe_many()
+        print(f"{datetime.now()}: NYMEX subscriptions: {subscribed}")
+        # recorder and quote board cover every configured book, not only the ones a running strategy watches
+        if self.recorder is not None or self.quote_board is not None:
+            for moex_symbol in self.moex_connector.symbols:
+                self.moex_connector.watch_book(moex_symbol)
+        asyncio.create_task(self.moex_connector.run()) # adaptive MOEX order book polling
@@ -0,0 +1,105 @@
+# order_ladder.py
+# target limit order ladder of the limit grid strategy, computed with array operations, and its reconciliation
+# against live MOEX orders by ticket (dict lookups) into cancel / modify / new lists
+import numpy as np
+
+ORDER_TYPE_BUY_LIMIT = 2 # mt5.ORDER_TYPE_BUY_LIMIT
+ORDER_TYPE_SELL_LIMIT = 3 # mt5.ORDER_TYPE_SELL_LIMIT
+
+
+# order type, price and volume per grid level (level j uses spread_grid[j]). Volume 0 means no order at the level.
+# Levels below the position in pose_grid sell down to it, levels above buy up to it; volumes capped at max_lots
+def target_ladder(spread_grid, pose_grid, ib_bid, ib_ask, moex_pose, max_lots, decimals):
+    spread_grid = np.asarray(spread_grid, dtype=np.float64)
+    pose_grid = np.asarray(pose_grid, dtype=np.float64)
+    pose_index = np.searchsorted(pose_grid, moex_pose, side="left")
+    sell = np.arange(len(pose_grid)) < pose_index # by pose level i
+    next_pose = np.minimum(np.append(pose_grid[1:], moex_pose), moex_pose)
+    previous_pose = np.maximum(np.insert(pose_grid[:-1], 0, moex_pose), moex_pose)
+    volumes = np.around(np.where(sell, next_pose - pose_grid, pose_grid - previous_pose), 0)
+    # pose level i is placed at spread level n - i - 1
+    sell, volumes = sell[::-1], volumes[::-1]
+    types = np.where(sell, ORDER_TYPE_SELL_LIMIT, ORDER_TYPE_BUY_LIMIT)
+    prices = np.around(np.where(sell, ib_ask, ib_bid) + spread_grid, decimals)
+    return types, prices, np.minimum(volumes, max_lots)
+
+
+class OrderLadder:
+    def __init__(self, number_of_steps):
+        self.types = np.zeros(number_of_steps, dtype=np.int64)
+        self.prices = np.full(number_of_steps, np.nan)
+        self.volumes = np.zeros(number_of_steps)
+        self.tickets = [None] * number_of_steps # live order placed for the level
+
+# new targets. A level that drops out (volume 0) forgets its ticket, the order is cancelled by reconcile
+    def update(self, types, prices, volumes):
+        self.types, self.prices, self.volumes = types, prices, volumes
+        for level in np.flatnonzero(volumes == 0):
+            self.tickets[level] = None
+
+    def set_ticket(self, level, ticket):
+        self.tickets[level] = ticket
+
+# same target as another update: rounded types, prices and volumes of all levels
+    def fingerprint(self):
+        return self.types.tobytes() + self.prices.tobytes() + self.volumes.tobytes()
+
+# live: {ticket : OrderRecord} of the symbol. Returns (cancel tickets, [(ticket, price, volume)] to modify, levels to place).
+# A live order is kept if it is the level's ticket with the same type and volume; only its price may need a modify.
+# tolerance_ticks: a kept order is re-priced only if it is more than tolerance_ticks behind the target, or ahead of it at all.
+# Distances are counted in whole ticks of tick_size (None - raw price difference), so an order exactly at the band edge
+# is kept whatever the float rounding of the prices. A re-price goes to the exact target, so small moves around it
+# don't trigger modifies back and forth.
+# modify_volume: a different volume is changed by the modify (volume is None otherwise) instead of cancel + new
+    def reconcile(self, live, tick_size = None, tolerance_ticks = 0, modify_volume = False):
+        kept = set()
+        to_modify = []
+        to_place = []
+        types, prices, volumes = self.types.tolist(), self.prices.tolist(), self.volumes.tolist()
+        for level in sorted(np.flatnonzero(self.volumes != 0).tolist(), key=prices.__getitem__):
+            record = live.get(self.tickets[level])
+            if record is None or record.type != types[level] or (record.volume_current != volumes[level] and not modify_volume):
+                to_place.append(level)
+                continue
+            kept.add(record.ticket)
+            volume = volumes[level] if record.volume_current != volumes[level] else None
+            # distance of the live price behind the target: lower for buy orders, higher for sell orders
+            behind = prices[level] - record.price_open if types[level] == ORDER_TYPE_BUY_LIMIT else record.price_open - prices[level]
+            if tick_size:
+                behind = round(behind / tick_size)
+            if volume is not None or behind < 0 or behind > tolerance_ticks:
+                to_modify.append((record.ticket, prices[level], volume))
+        to_cancel = [ticket for ticket in live if ticket not in kept]
+        return to_cancel, to_modify, to_place
+
+    def orders(self, levels = None):
+        levels = np.flatnonzero(self.volumes != 0) if levels is None else levels
+        return [(int(level), self.tickets[level], int(self.types[level]), float(self.volumes[level]), float(self.prices[level])) for level in levels]
+
+
+# order requests sent per order_flow cycle (one cycle per IB tick or position signal), per symbol
+class ChurnStats:
+    def __init__(self):
+        self.cycles = {} # symbol : cycles run
+        self.skipped = {} # symbol : cycles skipped as the target ladder and live orders didn't change
+        self.requests = {} # symbol : {kind : requests sent}
+
+    def record(self, symbol, requests = (), skipped = False):
+        self.cycles[symbol] = self.cycles.get(symbol, 0) + 1
+        if skipped:
+            self.skipped[symbol] = self.skipped.get(symbol, 0) + 1
+        kinds = self.requests.setdefault(symbol, {})
+        for request in requests:
+            kinds[request.kind] = kinds.get(request.kind, 0) + 1
+
+    def round_trips_per_tick(self, symbol):
+        cycles = self.cycles.get(symbol, 0)
+        return sum(self.requests.get(symbol, {}).values()) / cycles if cycles else 0.0
+
+    def report(self, symbol = None):
+        lines = []
+        for name in ([symbol] if symbol is not None else sorted(self.cycles)):
+            cycles = self.cycles.get(name, 0)
+            kinds = ", ".join(f"{kind} {count}" for kind, count in sorted(self.requests.get(name, {}).items()))
+            lines.append(f"{name}: {self.round_trips_per_tick(name):.2f} round trips per tick, cycles {cycles}, skipped {self.skipped.get(name, 0)}" + (f" ({kinds})" if kinds else ""))
+        return "\n".join(lines)
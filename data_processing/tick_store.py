@@ -0,0 +1,86 @@
+# tick_store.py
+# fixed capacity in-memory history of quotes per symbol (IB bid / ask ticks, MOEX best and deep quotes).
+# Each symbol has a ring of NumPy structured records written twice (at i and i + capacity), so the latest
+# records are always one contiguous slice and "last N" / "since T" queries return views without copying.
+# Views are only valid until the ring wraps over them: copy what has to be kept.
+import time
+import numpy as np
+
+IB_TICK_DTYPE = np.dtype([("time", "f8"), ("bid", "f8"), ("ask", "f8"), ("bid_size", "f8"), ("ask_size", "f8")])
+MOEX_QUOTE_DTYPE = np.dtype([("time", "f8"), ("bid", "f8"), ("ask", "f8"), ("deep_bid", "f8"), ("deep_ask", "f8")])
+
+
+class TickRing:
+    def __init__(self, capacity, dtype):
+        self.capacity = capacity
+        self.buffer = np.zeros(2 * capacity, dtype=dtype)
+        self.position = 0 # next write index in [0, capacity)
+        self.count = 0
+
+    def append(self, record):
+        self.buffer[self.position] = record
+        self.buffer[self.position + self.capacity] = record
+        self.position = (self.position + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+# all stored records, oldest first
+    def view(self):
+        end = self.position + self.capacity
+        return self.buffer[end - self.count:end]
+
+    def last(self, n):
+        end = self.position + self.capacity
+        return self.buffer[end - min(n, self.count):end]
+
+# records with time >= since (times are appended in non-decreasing order)
+    def since(self, since):
+        records = self.view()
+        return records[np.searchsorted(records["time"], since, side="left"):]
+
+
+class TickStore:
+    def __init__(self, capacity):
+        self.capacity = capacity # records per symbol
+        self.rings = {} # symbol : TickRing
+
+    def ring(self, symbol, dtype):
+        ring = self.rings.get(symbol)
+        if ring is None:
+            ring = self.rings[symbol] = TickRing(self.capacity, dtype)
+        return ring
+
+# from the pendingTickersEvent callback. Time is the local receive time (epoch seconds), same clock as MOEX quotes
+    def append_ib(self, symbol, ticker, now = None):
+        now = time.time() if now is None else now
+        self.ring(symbol, IB_TICK_DTYPE).append((now, ticker.bid, ticker.ask, ticker.bidSize, ticker.askSize))
+
+    def append_moex(self, symbol, bid, ask, deep_bid, deep_ask, now = None):
+        now = time.time() if now is None else now
+        self.ring(symbol, MOEX_QUOTE_DTYPE).append((now, bid, ask, deep_bid, deep_ask))
+
+    def last(self, symbol, n):
+        ring = self.rings.get(symbol)
+        return ring.last(n) if ring is not None else None
+
+    def since(self, symbol, since):
+        ring = self.rings.get(symbol)
+        return ring.since(since) if ring is not None else None
+
+# records of symbol as of each of times (latest record at or before it), and a mask of times with a record before them
+    def asof(self, symbol, times):
+        records = self.rings[symbol].view()
+        index = np.searchsorted(records["time"], times, side="right") - 1
+        valid = index >= 0
+        return records[np.where(valid, index, 0)], valid
+
+# spread series on the times of left: left[left_field] - right[right_field] as of each left record
+    def spread(self, left, right, left_field, right_field, since = None):
+        left_records = self.rings[left].view() if since is None else self.rings[left].since(since)
+        right_records, valid = self.asof(right, left_records["time"])
+        spread = left_records[left_field] - right_records[right_field]
+        spread[~valid] = np.nan
+        return left_records["time"], spread
@@ -1 +1,2 @@
-from .database_handler import DatabaseHandler
\ No newline at end of file
+from .database_handler import DatabaseHandler
+from .tick_recorder import TickRecorder, read_records
\ No newline at end of file
@@ -1,5 +1,7 @@
 import aiosqlite
 import asyncio
+import sqlite3
+from contextlib import closing
 import pandas as pd
 from typing import List, Dict, Optional
 from config import DATABASE_FILE_PATH
@@ -78,28 +80,28 @@ class DatabaseHandler:
 # market grid strategy:
     async def store_market_grid_trade(self, trade_data: pd.DataFrame):
         loop = asyncio.get_running_loop() # use the loop, that is created by asyncio.run
-        await loop.run_in_executor(None, self._store_executed_trade_blocking, trade_data)
+        await loop.run_in_executor(None, self._store_market_grid_trade_blocking, trade_data)
 
     def _store_market_grid_trade_blocking(self, trade_data: pd.DataFrame):
-        with aiosqlite.connect(self.db_path) as conn:
+        with closing(sqlite3.connect(self.db_path)) as conn: # blocking writer thread: plain sqlite3
             trade_data.to_sql('market_grid_trades', conn, if_exists='append', index=False)
 
 # limit grid strategy, moex trades:
     async def store_limit_grid_moex_trade(self, trade_data: pd.DataFrame):
         loop = asyncio.get_running_loop() # use the loop, that is created by asyncio.run
-        await loop.run_in_executor(None, self._store_executed_trade_blocking, trade_data)
+        await loop.run_in_executor(None, self._store_limit_grid_moex_trade_blocking, trade_data)
 
     def _store_limit_grid_moex_trade_blocking(self, trade_data: pd.DataFrame):
-        with aiosqlite.connect(self.db_path) as conn:
+        with closing(sqlite3.connect(self.db_path)) as conn: # blocking writer thread: plain sqlite3
             trade_data.to_sql('limit_grid_moex_trades', conn, if_exists='append', index=False)
 
 # limit grid strategy, NYMEX trades:
     async def store_limit_grid_nymex_trade(self, trade_data: pd.DataFrame):
         loop = asyncio.get_running_loop() # use the loop, that is created by asyncio.run
-        await loop.run_in_executor(None, self._store_executed_trade_blocking, trade_data)
+        await loop.run_in_executor(None, self._store_limit_grid_nymex_trade_blocking, trade_data)
 
     def _store_limit_grid_nymex_trade_blocking(self, trade_data: pd.DataFrame):
-        with aiosqlite.connect(self.db_path) as conn:
+        with closing(sqlite3.connect(self.db_path)) as conn: # blocking writer thread: plain sqlite3
             trade_data.to_sql('limit_grid_nymex_trades', conn, if_exists='append', index=False)
 
 # not used:
@@ -0,0 +1,194 @@
+# tick_recorder.py
+# binary recording of every IB tick and MOEX book snapshot: one append-only file of fixed size records per symbol,
+# kind and UTC day (directory/YYYYMMDD/symbol.kind.bin). Files are memory mapped and grown by chunks, so an append is
+# a NumPy record write into the map plus the record count in the header, no syscall. The count is written after the
+# record: readers and a restarted writer see only complete records.
+# Read back with read_records (a np.memmap of the complete records, no copy)
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+MAGIC = b"TICKREC1"
+HEADER_SIZE = 64 # magic 8s, kind 16s, record size u4, book depth u4, record count u8 (offset 32), reserved
+HEADER_FORMAT = "<8s16sII"
+COUNT_OFFSET = 32
+NS_PER_DAY = 86400 * 10**9
+
+KIND_IB = "ib"
+KIND_MOEX_BOOK = "book"
+
+# time: epoch nanoseconds of the local receive time
+IB_RECORD_DTYPE = np.dtype([("time", "i8"), ("bid", "f8"), ("ask", "f8"), ("bid_size", "f8"), ("ask_size", "f8")])
+
+
+# MOEX snapshot: best and deep quotes as used by the strategies plus depth levels per side, best first (nan padded)
+def book_record_dtype(depth):
+    return np.dtype([("time", "i8"), ("bid", "f8"), ("ask", "f8"), ("deep_bid", "f8"), ("deep_ask", "f8"),
+                     ("bid_prices", "f8", (depth,)), ("bid_volumes", "f8", (depth,)),
+                     ("ask_prices", "f8", (depth,)), ("ask_volumes", "f8", (depth,))])
+
+
+def record_dtype(kind, depth = 0):
+    if kind == KIND_IB:
+        return IB_RECORD_DTYPE
+    if kind == KIND_MOEX_BOOK:
+        return book_record_dtype(depth)
+    raise ValueError(f"unknown record kind {kind}")
+
+
+def day_directory(directory, day):
+    return os.path.join(directory, datetime.fromtimestamp(day * 86400, timezone.utc).strftime("%Y%m%d"))
+
+
+def record_path(directory, symbol, kind, day):
+    return os.path.join(day_directory(directory, day), f"{symbol}.{kind}.bin")
+
+
+def read_header(path):
+    with open(path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:8] != MAGIC:
+        raise ValueError(f"{path} is not a tick recorder file")
+    _, kind, record_size, depth = struct.unpack_from(HEADER_FORMAT, header)
+    count, = struct.unpack_from("<Q", header, COUNT_OFFSET)
+    kind = kind.rstrip(b"\0").decode()
+    dtype = record_dtype(kind, depth)
+    if dtype.itemsize != record_size:
+        raise ValueError(f"{path}: record size {record_size} does not match {kind} records of depth {depth}")
+    return kind, dtype, count
+
+
+# complete records of a file as a read-only memory map (records appended later are not seen)
+def read_records(path):
+    kind, dtype, count = read_header(path)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+class RecordFile:
+    def __init__(self, path, kind, depth, chunk_records):
+        self.path = path
+        self.dtype = record_dtype(kind, depth)
+        self.chunk_records = chunk_records
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            _, dtype, self.count = read_header(path) # continue an existing file (restart during the day)
+            if dtype != self.dtype:
+                raise ValueError(f"{path} has records of another layout")
+            self.file = open(path, "r+b")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, "w+b")
+            self.file.write(struct.pack(HEADER_FORMAT, MAGIC, kind.encode(), self.dtype.itemsize, depth).ljust(HEADER_SIZE, b"\0"))
+            self.count = 0
+        self.map = None
+        self._map(self.count + chunk_records)
+
+    def _map(self, capacity):
+        self._unmap()
+        size = HEADER_SIZE + capacity * self.dtype.itemsize
+        if os.fstat(self.file.fileno()).st_size < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.capacity = capacity
+        self.records = np.frombuffer(self.map, dtype=self.dtype, count=capacity, offset=HEADER_SIZE)
+        self.header_count = np.frombuffer(self.map, dtype="<u8", count=1, offset=COUNT_OFFSET)
+        self.fields = {name: self.records[name] for name in self.dtype.names} # column views, for writes field by field
+
+# NumPy views keep the map's buffer exported: dropped before the map is closed
+    def _unmap(self):
+        if self.map is not None:
+            self.records = self.header_count = self.fields = None
+            self.map.close()
+            self.map = None
+
+# index of the next record, to be filled in place through fields; commit() makes it visible
+    def reserve(self):
+        if self.count == self.capacity:
+            self.map.flush()
+            self._map(self.capacity + self.chunk_records)
+        return self.count
+
+    def commit(self):
+        self.count += 1
+        self.header_count[0] = self.count
+
+    def append(self, values):
+        if self.count == self.capacity:
+            self.map.flush()
+            self._map(self.capacity + self.chunk_records)
+        self.records[self.count] = values
+        self.count += 1
+        self.header_count[0] = self.count
+
+    def flush(self):
+        if self.map is not None:
+            self.map.flush()
+
+# the file is cut to the complete records (no preallocated tail left on disk)
+    def close(self):
+        if self.map is None:
+            return
+        self.map.flush()
+        self._unmap()
+        self.file.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+        self.file.close()
+
+
+class TickRecorder:
+    def __init__(self, directory, book_depth, chunk_records = 65536):
+        self.directory = directory
+        self.book_depth = book_depth
+        self.chunk_records = chunk_records
+        self.files = {} # (symbol, kind) : (day, RecordFile)
+
+    def file(self, symbol, kind, now):
+        day = now // NS_PER_DAY
+        entry = self.files.get((symbol, kind))
+        if entry is not None and entry[0] == day:
+            return entry[1]
+        if entry is not None:
+            entry[1].close() # next UTC day
+        record_file = RecordFile(record_path(self.directory, symbol, kind, day), kind, self.book_depth if kind == KIND_MOEX_BOOK else 0, self.chunk_records)
+        self.files[(symbol, kind)] = (day, record_file)
+        return record_file
+
+# from the pendingTickersEvent callback
+    def record_ib(self, symbol, ticker, now = None):
+        now = time.time_ns() if now is None else now
+        self.file(symbol, KIND_IB, now).append((now, ticker.bid, ticker.ask, ticker.bidSize, ticker.askSize))
+
+# levels: (ask_prices, ask_volumes, bid_prices, bid_volumes) best first, as depth_engine.book_to_arrays. None - no book
+    def record_moex_book(self, symbol, bid, ask, deep_bid, deep_ask, levels, now = None):
+        now = time.time_ns() if now is None else now
+        record_file = self.file(symbol, KIND_MOEX_BOOK, now)
+        index = record_file.reserve()
+        fields = record_file.fields
+        fields["time"][index] = now
+        fields["bid"][index], fields["ask"][index], fields["deep_bid"][index], fields["deep_ask"][index] = bid, ask, deep_bid, deep_ask
+        depth = self.book_depth
+        for name, values in zip(("ask_prices", "ask_volumes", "bid_prices", "bid_volumes"), levels or ((),) * 4):
+            row = fields[name][index]
+            n = min(len(values), depth)
+            row[:n] = values[:n]
+            if n < depth:
+                row[n:] = np.nan
+        record_file.commit()
+
+    def flush(self):
+        for _, record_file in self.files.values():
+            record_file.flush()
+
+    def close(self):
+        for _, record_file in self.files.values():
+            record_file.close()
+        self.files.clear()
+
+# records of a symbol for a day (datetime.date or "YYYYMMDD"), None if nothing was recorded
+    def read(self, symbol, kind, day):
+        day = day if isinstance(day, str) else day.strftime("%Y%m%d")
+        path = os.path.join(self.directory, day, f"{symbol}.{kind}.bin")
+        return read_records(path) if os.path.exists(path) else None
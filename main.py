@@ -5,8 +5,10 @@ from moex_connection import MoexAsyncWrapper
 from nymex_connection import NymexAsyncWrapper
 from data_processing import MeanReversionStrategy
 from user_interface import TelegramBot, WebInterface
-from database import DatabaseHandler
+from database import DatabaseHandler, TickRecorder
 from logging_and_notification import Logger
+from sharding import ShardCoordinator
+from quote_board import QuoteBoard
 from config import *
 from datetime import datetime
 
@@ -21,19 +23,30 @@ async def main():
     # storage_queue = asyncio.Queue() # Queue for storage tasks?
     # Alternatively just start tasks and don't care about queue as it's already built int into aiosqlite <- this
 
-    # Initialize database
-    db_handler = DatabaseHandler()
-    # await until the databes fully initialize
-    await db_handler.wait_until_ready()
-
-    # Initialize MOEX and NYMEX connections
-    moex_conn = MoexAsyncWrapper(MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS)
-    await moex_conn.initialize()
-    nymex_conn = NymexAsyncWrapper(NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS)
-    await nymex_conn.initialize()
-
-    trading = MeanReversionStrategy(moex_conn, nymex_conn, db_handler)
-    #await trading.initialize()
+    # shared memory quotes for other processes, written by the strategy (or by the shards)
+    quote_board = QuoteBoard(QUOTE_BOARD_NAME, MOEX_SYMBOLS + [contract.localSymbol for contract in NYMEX_CONTRACTS]) if QUOTE_BOARD_NAME else None
+
+    if SHARDS:
+        # each group of symbol pairs runs its connectors and strategy in its own process (see sharding.shard),
+        # this process only hosts the bot, the web interface and the scheduler
+        trading = ShardCoordinator(SHARDS)
+        await trading.start()
+    else:
+        # Initialize database
+        db_handler = DatabaseHandler()
+        # await until the databes fully initialize
+        await db_handler.wait_until_ready()
+
+        # Initialize MOEX and NYMEX connections
+        moex_conn = MoexAsyncWrapper(MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS)
+        await moex_conn.initialize()
+        nymex_conn = NymexAsyncWrapper(NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS)
+        await nymex_conn.initialize()
+
+        # every IB tick and MOEX book snapshot to disk (shards record their own symbols)
+        recorder = TickRecorder(TICK_RECORDER_DIRECTORY, TICK_RECORDER_BOOK_DEPTH, TICK_RECORDER_CHUNK_RECORDS) if TICK_RECORDER_DIRECTORY else None
+        trading = MeanReversionStrategy(moex_conn, nymex_conn, db_handler, quote_board = quote_board, recorder = recorder)
+        #await trading.initialize()
 
     # Initialize user interfaces (Telegram bot and/or web interface)
     telegram_bot = TelegramBot(trading, TELEGRAM_API_TOKEN, TELEGRAM_CHAT_IDS)
@@ -48,7 +61,17 @@ async def main():
         asyncio.create_task(web_interface.run())
     ]
 
-    await asyncio.gather(*tasks)
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        if SHARDS:
+            await trading.shutdown() # shards cancel their MOEX orders and exit before this process does
+        if quote_board is not None:
+            quote_board.close()
+        if not SHARDS and trading.recorder is not None:
+            trading.recorder.close()
+        if not SHARDS:
+            await moex_conn.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,109 @@
+# book_cache.py
+# per-symbol MOEX order book cache: detects changes between market_book_get snapshots,
+# recomputes best / deep quotes only if relevant levels moved and adapts poll interval to book activity
+import asyncio
+import time
+import numpy as np
+from moex_connection.depth_engine import book_to_arrays, depth_walk
+
+
+class BookCache:
+    def __init__(self, symbol, sizes, min_interval, max_interval, backoff = 1.5):
+        self.symbol = symbol
+        self.sizes = np.asarray(sizes, dtype=np.float64)
+        self.raw = None # last market_book_get tuple
+        self.levels = None # its (ask prices, ask volumes, bid prices, bid volumes), best first
+        self.relevant = None # best levels needed to fill the largest size, both sides
+        self.version = 0 # incremented on every relevant change
+        self.snapshots = 0 # incremented on every new snapshot (any level moved, or the book became unavailable)
+        self.unavailable = False # market_book_get failed on the last poll
+        self.last_change = 0.0
+
+        # results of the last recalculation
+        self.best_bid, self.best_ask = np.nan, np.nan
+        self.bid_vwap = np.full(self.sizes.shape, np.nan)
+        self.ask_vwap = np.full(self.sizes.shape, np.nan)
+        self.bid_filled = np.zeros(self.sizes.shape, dtype=bool)
+        self.ask_filled = np.zeros(self.sizes.shape, dtype=bool)
+
+        # adaptive polling
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.next_poll = 0.0
+
+        # replaced on each change, so every waiter of the previous version is woken up once
+        self._changed = asyncio.Event()
+
+    def set_sizes(self, sizes):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        if not np.array_equal(sizes, self.sizes):
+            self.sizes = sizes
+            self.raw, self.relevant = None, None # force full recalculation
+
+# levels of one side that take part in the deepest fill (plus the next one, which becomes relevant on any trade)
+    def _relevant_levels(self, prices, volumes):
+        if prices.size == 0:
+            return prices, volumes
+        depth = np.searchsorted(np.cumsum(volumes), self.sizes.max(), side="left") + 2
+        return prices[:depth], volumes[:depth]
+
+# returns True if best or deep quotes changed. Safe to call from a worker thread, does not touch asyncio objects
+    def update(self, quotes):
+        self.unavailable = False
+        if quotes == self.raw: # tuple comparison in C, cheapest path for an untouched book
+            return False
+        self.raw = quotes
+        self.snapshots += 1
+
+        ask_prices, ask_volumes, bid_prices, bid_volumes = self.levels = book_to_arrays(quotes)
+        relevant = self._relevant_levels(ask_prices, ask_volumes) + self._relevant_levels(bid_prices, bid_volumes)
+        if self.relevant is not None and all(np.array_equal(new, old) for new, old in zip(relevant, self.relevant)):
+            return False # only levels deeper than the largest size moved
+        self.relevant = relevant
+
+        self.best_ask = ask_prices[0] if ask_prices.size else np.nan
+        self.best_bid = bid_prices[0] if bid_prices.size else np.nan
+        self.ask_vwap, self.ask_filled = depth_walk(ask_prices, ask_volumes, self.sizes)
+        self.bid_vwap, self.bid_filled = depth_walk(bid_prices, bid_volumes, self.sizes)
+        self.version += 1
+        return True
+
+# market_book_get failed. Returns True only if the book was available before (quotes go to NaN once)
+    def fail(self):
+        if self.unavailable:
+            return False
+        self.unavailable = True
+        self.raw, self.relevant, self.levels = None, None, None # recalculate on the next valid snapshot
+        self.snapshots += 1
+        return True
+
+# called on the event loop after update(): notifies waiters and shortens / extends the poll interval
+    def after_poll(self, changed, now = None):
+        now = time.monotonic() if now is None else now
+        if changed:
+            self.last_change = now
+            self.interval = self.min_interval
+            event, self._changed = self._changed, asyncio.Event()
+            event.set()
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.next_poll = now + self.interval
+
+# IB tick for the paired contract: MOEX book is likely to move as well, poll it densely.
+# Not while the book is unavailable, the interval backs off until market_book_get works again
+    def note_activity(self, now = None):
+        if self.unavailable:
+            return
+        now = time.monotonic() if now is None else now
+        self.interval = self.min_interval
+        self.next_poll = min(self.next_poll, now)
+
+    async def wait_changed(self, timeout = None):
+        event = self._changed
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
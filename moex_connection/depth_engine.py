@@ -0,0 +1,62 @@
+# depth_engine.py
+# NumPy order book depth walk: volume weighted fill prices for several lot sizes in one pass
+import numpy as np
+
+# mt5 BookInfo.type values
+BOOK_TYPE_SELL = 1 # ask side
+BOOK_TYPE_BUY = 2 # bid side
+
+
+# split mt5.market_book_get result into sorted ask / bid arrays (best price first)
+def book_to_arrays(quotes):
+    # BookInfo is a namedtuple (type, price, volume, volume_dbl), numpy converts the tuple of them directly
+    book = np.array(quotes, dtype=np.float64).reshape(-1, 4)
+    types, prices, volumes = book[:, 0], book[:, 1], book[:, 3]
+
+    ask_mask = types == BOOK_TYPE_SELL
+    ask_prices, ask_volumes = prices[ask_mask], volumes[ask_mask]
+    order = np.argsort(ask_prices, kind="stable")
+    ask_prices, ask_volumes = ask_prices[order], ask_volumes[order]
+
+    bid_mask = types == BOOK_TYPE_BUY
+    bid_prices, bid_volumes = prices[bid_mask], volumes[bid_mask]
+    order = np.argsort(-bid_prices, kind="stable")
+    bid_prices, bid_volumes = bid_prices[order], bid_volumes[order]
+
+    return ask_prices, ask_volumes, bid_prices, bid_volumes
+
+
+# walk one side of the book (levels sorted best first) for a vector of sizes.
+# returns (vwap, filled): vwap of the fill for every size and a flag whether the side had enough volume.
+# for sizes without enough liquidity vwap is the average price of the whole available side.
+def depth_walk(prices, volumes, sizes):
+    sizes = np.asarray(sizes, dtype=np.float64)
+    vwap = np.full(sizes.shape, np.nan)
+    filled = np.zeros(sizes.shape, dtype=bool)
+    if prices.size == 0:
+        return vwap, filled
+
+    cum_volume = np.cumsum(volumes)
+    cum_notional = np.cumsum(prices * volumes)
+    total_volume = cum_volume[-1]
+
+    # index of the level where cumulative volume reaches each size
+    level = np.searchsorted(cum_volume, sizes, side="left")
+    filled = (level < prices.size) & (sizes > 0)
+    level = np.minimum(level, prices.size - 1)
+
+    # full notional up to the level minus the part of the level that is not needed
+    notional = cum_notional[level] - (cum_volume[level] - sizes) * prices[level]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = np.where(filled, notional / sizes, cum_notional[-1] / total_volume if total_volume > 0 else np.nan)
+    return vwap, filled
+
+
+# deep bid / ask ladder for the list of sizes (e.g. 1x, 2x, 3x of symbol lots)
+def deep_quotes_ladder(quotes, sizes):
+    ask_prices, ask_volumes, bid_prices, bid_volumes = book_to_arrays(quotes)
+    best_ask = ask_prices[0] if ask_prices.size else np.nan
+    best_bid = bid_prices[0] if bid_prices.size else np.nan
+    ask_vwap, ask_filled = depth_walk(ask_prices, ask_volumes, sizes)
+    bid_vwap, bid_filled = depth_walk(bid_prices, bid_volumes, sizes)
+    return best_bid, best_ask, bid_vwap, bid_filled, ask_vwap, ask_filled
@@ -0,0 +1,92 @@
+# history_cache.py
+# incremental cache of today's MOEX historical orders: keeps everything fetched so far, asks MT5 only for
+# orders done after the high-water mark and indexes them by ticket for O(k) "are these tickets in history" checks.
+# MT5 does not document whether history_orders_get selects by setup or done time, so awaited tickets the range misses
+# are fetched by ticket (missing_tickets)
+import asyncio
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+HIST_ORDER_COLUMNS = ["ticket","symbol","type","volume_initial", "volume_current","price_open"]
+
+
+class OrderHistoryCache:
+    def __init__(self, symbols, decimals, overlap = 60):
+        self.symbols = symbols
+        self.decimals = decimals
+        self.overlap = overlap # seconds re-requested before the high-water mark, time_done has seconds resolution
+        self.session_date = None
+        self.orders = {}
+        self.high_water = None # server time (seconds) of the latest time_done seen
+        self.waiters = [] # (symbol, set of tickets, future)
+        self.reset()
+
+    def reset(self):
+        self.session_date = datetime.now().date()
+        self.orders = {symbol: {} for symbol in self.symbols} # symbol : {ticket : mt5 TradeOrder}
+        self.high_water = None
+
+# date range for the next history_orders_get call
+    def next_range(self):
+        if datetime.now().date() != self.session_date: # new trading day, start over
+            self.reset()
+        # UTC aware bounds, as the server times of the cursor
+        to_date = datetime.now(timezone.utc) + timedelta(days=1) # account for timezone just setting tomorrow's datetime
+        if self.high_water is None:
+            # 6:00 is local time, converted to UTC here (2:00 based on server timezone)
+            from_date = datetime.now().replace(hour=6, minute=0, second=0, microsecond = 0).astimezone(timezone.utc)
+        else:
+            from_date = datetime.fromtimestamp(self.high_water - self.overlap, tz=timezone.utc)
+        return from_date, to_date
+
+# add newly fetched orders (duplicates from the overlap window are overwritten) and resolve waiters
+    def apply(self, orders):
+        for order in orders or ():
+            if order.symbol in self.orders:
+                self.orders[order.symbol][order.ticket] = order
+            if self.high_water is None or order.time_done > self.high_water:
+                self.high_water = order.time_done
+        if self.waiters:
+            self.waiters = [(symbol, tickets, future) for symbol, tickets, future in self.waiters
+                            if not future.done() and not self._resolve(symbol, tickets, future)]
+
+    def _resolve(self, symbol, tickets, future):
+        if self.has_all(symbol, tickets):
+            future.set_result(True)
+            return True
+        return False
+
+# awaited tickets not in the cache yet
+    def missing_tickets(self):
+        return {ticket for symbol, tickets, future in self.waiters if not future.done()
+                for ticket in tickets if ticket not in self.orders[symbol]}
+
+    def has_all(self, symbol, tickets):
+        index = self.orders[symbol]
+        return all(ticket in index for ticket in tickets)
+
+# future resolved once all tickets are in the cache
+    def add_waiter(self, symbol, tickets):
+        future = asyncio.get_running_loop().create_future()
+        tickets = set(tickets)
+        if not self._resolve(symbol, tickets, future):
+            self.waiters.append((symbol, tickets, future))
+        return future
+
+# same columns as the previous load_hist_orders DataFrame, optionally only for given tickets
+    def frame(self, symbol, tickets = None):
+        index = self.orders[symbol]
+        if tickets is None:
+            orders = list(index.values())
+        else:
+            orders = [index[ticket] for ticket in tickets if ticket in index]
+        orders.sort(key=lambda order: order.price_open)
+        return pd.DataFrame({
+            "ticket": np.array([order.ticket for order in orders], dtype=np.int64),
+            "symbol": [order.symbol for order in orders],
+            "type": np.array([order.type for order in orders], dtype=np.int64),
+            "volume_initial": np.array([order.volume_initial for order in orders], dtype=np.float64),
+            "volume_current": np.array([order.volume_current for order in orders], dtype=np.float64),
+            "price_open": np.around(np.array([order.price_open for order in orders], dtype=np.float64), self.decimals[symbol]),
+        }, columns=HIST_ORDER_COLUMNS)
@@ -1,11 +1,21 @@
 # moex_async_wrapper.py
 import asyncio
+import time
 import MetaTrader5 as mt5
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from typing import Tuple
-from config import MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, SYMBOL_DECIMALS
+from config import MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, SYMBOL_DECIMALS, MOEX_DEPTH_MULTIPLES
+from config import MOEX_POLL_MIN_INTERVAL, MOEX_POLL_MAX_INTERVAL, MOEX_ORDERS_RECONCILE_INTERVAL, MOEX_POSITIONS_CHECK_INTERVAL
+from config import METADATA_TTL, ACCOUNT_MARGIN_TTL, MARGIN_SAFETY_BUFFER
+from moex_connection.open_orders import OpenOrders
+from moex_connection.position_tracker import PositionTracker
+from moex_connection.history_cache import OrderHistoryCache
+from risk_management import MetadataCache, InstrumentMeta, AccountMeta, MarginEstimator
+from risk_management.margin_estimator import MARGIN_OK, MARGIN_INSUFFICIENT, worst_side
+from moex_connection.book_cache import BookCache
+from moex_connection.mt5_executor import MT5Executor, PRIORITY_ORDER, PRIORITY_READ, PRIORITY_DATA
 
 
 class MoexAsyncWrapper:
@@ -15,12 +25,22 @@ class MoexAsyncWrapper:
         self.password = password
         self.server = server
         self.symbols = symbols
+        self.lots_dict = dict(zip(self.symbols, lot_sizes))
+        self.decimals = {symbol: SYMBOL_DECIMALS[MOEX_SYMBOLS.index(symbol)] for symbol in self.symbols} # symbols may be a subset (shards)
         self.positions = {}
         for symbol in self.symbols:
             self.positions[symbol] = 0
+        # positions are updated from new deals only, positions_get is a periodic consistency check
+        self.position_tracker = PositionTracker(self.symbols, self.positions)
+        self.position_versions = self.position_tracker.versions # symbol : version, changes with the position
+        self.last_positions_check = 0.0
+        # today's historical orders, fetched incrementally
+        self.hist_orders = OrderHistoryCache(self.symbols, self.decimals)
+        self.hist_poller = None
+        # symbol metadata / account margin cache and local margin model
+        self.metadata = MetadataCache(METADATA_TTL, ACCOUNT_MARGIN_TTL)
+        self.margin_estimator = MarginEstimator(self.metadata, MARGIN_SAFETY_BUFFER)
         
-        self.lots_dict = dict(zip(self.symbols, lot_sizes))
-        self.decimals = dict(zip(self.symbols, SYMBOL_DECIMALS))
 
         self.current_bid = {}
         self.current_ask = {}
@@ -34,8 +54,37 @@ class MoexAsyncWrapper:
             self.deep_bid[symbol] = np.nan
             self.deep_ask[symbol] = np.nan
 
-        self.open_orders = {}
+        # deep bid / ask for MOEX_DEPTH_MULTIPLES x lots and flags if the book had enough volume for each size
+        self.depth_multiples = np.asarray(MOEX_DEPTH_MULTIPLES, dtype=np.float64)
+        self.deep_bid_ladder = {}
+        self.deep_ask_ladder = {}
+        self.deep_bid_filled = {}
+        self.deep_ask_filled = {}
+        for symbol in self.symbols:
+            self.deep_bid_ladder[symbol] = np.full(self.depth_multiples.shape, np.nan)
+            self.deep_ask_ladder[symbol] = np.full(self.depth_multiples.shape, np.nan)
+            self.deep_bid_filled[symbol] = np.zeros(self.depth_multiples.shape, dtype=bool)
+            self.deep_ask_filled[symbol] = np.zeros(self.depth_multiples.shape, dtype=bool)
 
+        # order book caches (change detection + adaptive polling). Books are polled by run() for watched symbols only
+        self.book_cache = {}
+        for symbol in self.symbols:
+            self.book_cache[symbol] = BookCache(symbol, self.depth_multiples * self.lots_dict[symbol], MOEX_POLL_MIN_INTERVAL, MOEX_POLL_MAX_INTERVAL)
+        self.watched_books = {} # symbol : number of strategies watching it
+        self.poll_wakeup = asyncio.Event()
+        self.quote_listeners = [] # callables(symbol), called on the loop for every symbol whose quotes changed
+        self.book_listeners = [] # callables(symbol), called on the loop for every new book snapshot (deep levels included)
+        self.book_snapshots = {symbol: 0 for symbol in self.symbols} # BookCache.snapshots passed to book_listeners
+
+        # local open orders book, reconciled with mt5.orders_get by load_orders / refresh
+        self.open_orders = OpenOrders(self.symbols, self.decimals, MOEX_ORDERS_RECONCILE_INTERVAL)
+
+        # every MetaTrader5 call goes through this thread. Public methods below are awaitable and never block the loop
+        self.executor = MT5Executor()
+        self.closed = False
+        self.executor.call(self._initialize_blocking)
+
+    def _initialize_blocking(self):
         if not mt5.initialize(): # login=self.login, password=self.password, server=self.server
             raise RuntimeError(f"Error initializing MetaTrader5: {mt5.last_error()}")
         print(mt5.terminal_info())
@@ -44,30 +93,31 @@ class MoexAsyncWrapper:
 
     async def initialize(self):
         await self.add_market_book(self.symbols)
-        self.load_positions(self.symbols)
+        await self.load_positions(self.symbols)
         print(self.positions) # TO BE DELETED
 
 # load access to market book
     async def add_market_book(self, symbols):
-        async def add_book(symbol):
-            def blocking():
-                if not mt5.market_book_add(symbol):
-                    print(f"{datetime.now()}: Failed to add market book for {symbol}, error code =", mt5.last_error())
-            await asyncio.to_thread(blocking)
-        await asyncio.gather(*(add_book(symbol) for symbol in symbols))
+        await self.executor.run_batch([(self._add_book_blocking, (symbol,)) for symbol in symbols], PRIORITY_READ)
+
+    def _add_book_blocking(self, symbol):
+        if not mt5.market_book_add(symbol):
+            print(f"{datetime.now()}: Failed to add market book for {symbol}, error code =", mt5.last_error())
 
 # close market book access
     async def release_market_book(self, symbols):
-        async def release_book(symbol):
-            def blocking():
-                if not mt5.market_book_release(symbol):
-                    print(f"{datetime.now()}: Failed to release market book for {symbol}, error code =", mt5.last_error())
-            await asyncio.to_thread(blocking)
-        await asyncio.gather(*(release_book(symbol) for symbol in symbols))
+        await self.executor.run_batch([(self._release_book_blocking, (symbol,)) for symbol in symbols], PRIORITY_READ)
+
+    def _release_book_blocking(self, symbol):
+        if not mt5.market_book_release(symbol):
+            print(f"{datetime.now()}: Failed to release market book for {symbol}, error code =", mt5.last_error())
 
 
-# send market order
-    def send_order(self, symbol, order_type, volume):
+# send market order. Order actions return (mt5 result, mt5.last_error() right after the order_send)
+    async def send_order(self, symbol, order_type, volume):
+        return await self.executor.run(self._send_order_blocking, symbol, order_type, volume, priority=PRIORITY_ORDER)
+
+    def _send_order_blocking(self, symbol, order_type, volume):
         
         if order_type == "Buy":
             type = mt5.ORDER_TYPE_BUY
@@ -75,7 +125,7 @@ class MoexAsyncWrapper:
             type = mt5.ORDER_TYPE_SELL
         else:
             print("{datetime.now()}: incorrect order type")
-            return None
+            return None, None
         request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": symbol,
@@ -90,16 +140,14 @@ class MoexAsyncWrapper:
             "type_filling": mt5.ORDER_FILLING_RETURN,
         }
 
-        #loop = asyncio.get_event_loop()
         trade = mt5.order_send(request)
         if trade.retcode == mt5.TRADE_RETCODE_DONE:
             print(f"{datetime.now()}: moex market order sent")
         else:
             print(f"{datetime.now()}: 2. order_send failed, retcode={trade.retcode}")
-        print(f"{datetime.now()}: {symbol} error code =", mt5.last_error())
-        return trade
-        #trade = await loop.run_in_executor(None, mt5.order_send, request) # TESTING
-        #return await asyncio.wait_for(trade, timeout=10)
+        error = mt5.last_error() # taken with the result: several order requests run concurrently
+        print(f"{datetime.now()}: {symbol} error code =", error)
+        return trade, error
 
     async def check_order_status(self, ticket):
         checking = True
@@ -108,7 +156,15 @@ class MoexAsyncWrapper:
             
 
 # send limit order
-    def limit_order(self, symbol, order_type, volume, price):
+    async def limit_order(self, symbol, order_type, volume, price):
+        trade, error = await self.executor.run(self._limit_order_blocking, symbol, order_type, volume, price, priority=PRIORITY_ORDER)
+        if trade is not None and trade.retcode == mt5.TRADE_RETCODE_DONE:
+            self.open_orders.on_placed(symbol, trade.order, order_type, float(volume), price)
+        else:
+            self.open_orders.mark_dirty(symbol)
+        return trade, error
+
+    def _limit_order_blocking(self, symbol, order_type, volume, price):
 
         request = {
             "action": mt5.TRADE_ACTION_PENDING,
@@ -124,18 +180,26 @@ class MoexAsyncWrapper:
             "type_filling": mt5.ORDER_FILLING_RETURN,
         }
 
-        #loop = asyncio.get_running_loop()
         trade = mt5.order_send(request)
         if trade.retcode == mt5.TRADE_RETCODE_DONE:
             print(f"{datetime.now()}: moex limit order sent")
         else:
             print(f"{datetime.now()}: 2. limit order_send failed, retcode={trade.retcode}")
-        print(f"{datetime.now()}: {symbol} error code =", mt5.last_error())
-        return trade
+        error = mt5.last_error() # taken with the result: several order requests run concurrently
+        print(f"{datetime.now()}: {symbol} error code =", error)
+        return trade, error
 
 # modify open / pending limit order based on order_ticket
-    def modify_order(self, order_ticket, price):
-        
+    async def modify_order(self, order_ticket, price, volume = None):
+        modify_trade, error = await self.executor.run(self._modify_order_blocking, order_ticket, price, volume, priority=PRIORITY_ORDER)
+        if modify_trade is not None and modify_trade.retcode == mt5.TRADE_RETCODE_DONE:
+            self.open_orders.on_modified(order_ticket, price, volume)
+        else:
+            self._mark_order_dirty(order_ticket)
+        return modify_trade, error
+
+    def _modify_order_blocking(self, order_ticket, price, volume = None):
+
         request = {
             "action": mt5.TRADE_ACTION_MODIFY,
             "order": order_ticket,
@@ -144,143 +208,374 @@ class MoexAsyncWrapper:
             "tp": 0.0,
             "type_time": mt5.ORDER_TIME_DAY,
         }
+        if volume is not None: # only where the venue allows changing volume of a pending order
+            request["volume"] = float(volume)
 
-        #loop = asyncio.get_running_loop()
         modify_trade = mt5.order_send(request)
         if modify_trade.retcode == mt5.TRADE_RETCODE_DONE:
             print(f"{datetime.now()}: moex modify trade done")
         else:
             print(f"{datetime.now()}: 2. modify order_send failed, retcode={modify_trade.retcode}")
-        print(f"{datetime.now()}: modify order error code =", mt5.last_error())
-        return modify_trade
+        error = mt5.last_error()
+        print(f"{datetime.now()}: modify order error code =", error)
+        return modify_trade, error
 
 
 # cancel open / pending limit order based on order_ticket
-    def cancel_order(self, order_ticket):
+    async def cancel_order(self, order_ticket):
+        cancel_trade, error = await self.executor.run(self._cancel_order_blocking, order_ticket, priority=PRIORITY_ORDER)
+        if cancel_trade is not None and cancel_trade.retcode == mt5.TRADE_RETCODE_DONE:
+            self.open_orders.on_cancelled(order_ticket)
+        else:
+            self._mark_order_dirty(order_ticket)
+        return cancel_trade, error
+
+# failed modify / cancel: the order is likely filled or gone, reconcile its symbol on the next read
+    def _mark_order_dirty(self, order_ticket):
+        for symbol in self.symbols:
+            if order_ticket in self.open_orders.get(symbol):
+                self.open_orders.mark_dirty(symbol)
+
+    def _cancel_order_blocking(self, order_ticket):
         request = {
             "action": mt5.TRADE_ACTION_REMOVE,
             "order": order_ticket,
         }
-        #loop = asyncio.get_running_loop()
         cancel_trade = mt5.order_send(request)
         if cancel_trade.retcode == mt5.TRADE_RETCODE_DONE:
             print(f"{datetime.now()}: cancel trade done")
         else:
             print(f"{datetime.now()}: 2. cancel order failed, retcode={cancel_trade.retcode}")
-        print(f"{datetime.now()}: error code =", mt5.last_error())
-        return cancel_trade
-        #loop = asyncio.get_event_loop()
-        #return await loop.run_in_executor(None, mt5.order_send, request)
-
-# load open orders in a form of pandas DataFrame
-    def load_orders(self, symbol):
-        orders = mt5.orders_get(symbol=symbol)
-        if len(orders) != 0: # check if tuple is not empty
-            df = pd.DataFrame(list(orders), columns=orders[0]._asdict().keys())[["ticket","symbol","type","volume_initial", "volume_current","price_open"]]
-            df = df.sort_values(by=['price_open'], ascending=True)
-            df = df.reset_index(drop = True)
-            df["price_open"] = np.around(df["price_open"].values, self.decimals[symbol]) # TODO
-        else:
-            df = pd.DataFrame(columns = ["ticket","symbol","type","volume_initial", "volume_current","price_open"])
-        self.open_orders[symbol] = df
-
-# load historical orders from today in a from of pandas DataFrame
-    def load_hist_orders(self, symbol):
-        from_date = datetime.now().replace(hour=6, minute=0, second=0, microsecond = 0) # 6:00 is local time, but this get converted to UTC, so it's 2:00 (based on server timezone)
-        to_date = datetime.now()+timedelta(days=1) # account for timezone just setting tomorrow's datetime
-        orders = mt5.history_orders_get(from_date, to_date, symbol=symbol)
-        if len(orders) != 0: # check if tuple is not empty
-            df = pd.DataFrame(list(orders), columns=orders[0]._asdict().keys())[["ticket","symbol","type","volume_initial", "volume_current","price_open"]] # timestamps?
-            df = df.sort_values(by=['price_open'], ascending=True)
-            df = df.reset_index(drop = True)
-            df["price_open"] = np.around(df["price_open"].values, self.decimals[symbol]) # TODO
-        else:
-            df = pd.DataFrame(columns = ["ticket","symbol","type","volume_initial", "volume_current","price_open"])
-        return df
+        error = mt5.last_error()
+        print(f"{datetime.now()}: error code =", error)
+        return cancel_trade, error
+
+# reconcile local open orders with the terminal. Local state is read with open_orders.records / frame
+    async def load_orders(self, symbol):
+        orders = await self.executor.run(self._load_orders_blocking, symbol, priority=PRIORITY_READ)
+        self._apply_orders(symbol, orders)
+
+    def _load_orders_blocking(self, symbol):
+        return mt5.orders_get(symbol=symbol)
+
+    def _apply_orders(self, symbol, orders):
+        if orders is None:
+            print(f"{datetime.now()}: mt5.orders_get('{symbol}') failed, keeping local orders")
+            return
+        drift = self.open_orders.reconcile(symbol, orders)
+        if drift:
+            print(f"{datetime.now()}: {symbol} local open orders corrected for tickets {drift}")
+
+# load historical orders from today in a from of pandas DataFrame. Only orders newer than the cache high-water mark are requested
+    async def load_hist_orders(self, symbol):
+        await self.refresh_hist_orders()
+        return self.hist_orders.frame(symbol)
+
+    async def refresh_hist_orders(self):
+        from_date, to_date = self.hist_orders.next_range()
+        orders = await self.executor.run(self._load_hist_orders_blocking, from_date, to_date, priority=PRIORITY_READ)
+        self.hist_orders.apply(orders)
+
+    def _load_hist_orders_blocking(self, from_date, to_date):
+        orders = mt5.history_orders_get(from_date, to_date) # all symbols at once, split by the cache
+        if orders is None:
+            print(f"{datetime.now()}: mt5.history_orders_get failed, error code =", mt5.last_error())
+        return orders
+
+# wait until all tickets appear in the historical orders. Returns False on timeout
+    async def wait_hist_orders(self, symbol, tickets, timeout = 5, poll_interval = 0.05):
+        future = self.hist_orders.add_waiter(symbol, tickets)
+        if not future.done() and (self.hist_poller is None or self.hist_poller.done()):
+            self.hist_poller = asyncio.create_task(self._poll_hist_orders(poll_interval))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
 
+# refreshes the history cache while somebody waits for tickets. Tickets the range request did not bring are asked by
+# ticket: an order placed long before the high-water mark and cancelled now may not be in the range
+    async def _poll_hist_orders(self, poll_interval):
+        while any(not future.done() for _, _, future in self.hist_orders.waiters):
+            await self.refresh_hist_orders()
+            missing = self.hist_orders.missing_tickets()
+            if missing:
+                results = await self.executor.run_batch([(self._load_hist_order_blocking, (ticket,)) for ticket in missing], PRIORITY_READ)
+                self.hist_orders.apply([order for orders in results if orders for order in orders])
+            if self.hist_orders.waiters:
+                await asyncio.sleep(poll_interval)
+
+    def _load_hist_order_blocking(self, ticket):
+        return mt5.history_orders_get(ticket=ticket)
+
+
+# symbol metadata (tick size, decimals, contract size, margins per lot) and account margin, from cache when fresh
+    async def load_metadata(self, symbols = None):
+        symbols = self.symbols if symbols is None else symbols
+        missing = [symbol for symbol in symbols if self.metadata.instrument(symbol) is None]
+        need_account = self.metadata.account_meta() is None
+        calls = [(self._symbol_meta_blocking, (symbol,)) for symbol in missing]
+        if need_account:
+            calls.append((self._account_meta_blocking, ()))
+        results = await self.executor.run_batch(calls, PRIORITY_READ)
+        for meta in results[:len(missing)]:
+            if meta is not None:
+                self.metadata.put_instrument(meta)
+        if need_account and results[-1] is not None:
+            self.metadata.put_account(results[-1])
+
+# price step of the symbol from the terminal's metadata (static, an expired entry still has it)
+    async def tick_size(self, symbol):
+        await self.load_metadata([symbol])
+        meta = self.metadata.instruments.get(symbol)
+        if meta is not None and meta.tick_size:
+            return meta.tick_size
+        print(f"{datetime.now()}: {symbol}: no tick size from the terminal, using {10 ** -self.decimals[symbol]} from the decimals")
+        return 10 ** -self.decimals[symbol]
+
+    def _symbol_meta_blocking(self, symbol):
+        info = mt5.symbol_info(symbol)
+        if info is None:
+            print(f"{datetime.now()}: mt5.symbol_info('{symbol}') failed, error code =", mt5.last_error())
+            return None
+        # exchange instruments often report margin_initial = 0, ask the terminal for one lot instead
+        initial_margin = info.margin_initial or mt5.order_calc_margin(mt5.ORDER_TYPE_BUY, symbol, 1.0, info.ask)
+        if initial_margin is None:
+            return None
+        maintenance_margin = info.margin_maintenance or initial_margin
+        return InstrumentMeta(symbol, info.trade_tick_size, info.digits, info.trade_contract_size, initial_margin, maintenance_margin)
 
-# TODO: need check and rewrite
+    def _account_meta_blocking(self):
+        account_info = mt5.account_info()
+        if account_info is None:
+            return None
+        return AccountMeta(account_info.margin_free, account_info.margin, account_info.equity)
+
+# pre-trade margin check for one order
     async def check_margin_requirements(self, symbol, order_type, volume):
-        margin = mt5.symbol_info(symbol).margin_initial
-        if margin is None:
+        return await self.check_margin_batch([(symbol, volume if order_type % 2 == 0 else -volume)]) # even mt5 order types are buys
+
+# pre-trade margin check for a batch of (symbol, signed volume). Estimated in memory, the terminal is asked only near the limit
+    async def check_margin_batch(self, orders):
+        orders = list(orders)
+        if not orders:
+            return True
+        await self.load_metadata({symbol for symbol, _ in orders})
+        status, required = self.margin_estimator.check_batch(orders, self.positions)
+        if status == MARGIN_OK:
+            return True
+        if status == MARGIN_INSUFFICIENT:
+            print(f"{datetime.now()}: margin check failed, estimated margin required {required}, free margin {self.metadata.account.free_margin}")
             return False
+        return await self.executor.run(self._check_margin_exact_blocking, worst_side(orders, self.positions), priority=PRIORITY_READ)
 
-        required_margin = margin * volume
+# lots: {symbol : signed lots} of the worst side per symbol (margin_estimator.worst_side), one order_calc_margin per symbol
+    def _check_margin_exact_blocking(self, lots):
         account_info = mt5.account_info()
-
-        if order_type == mt5.ORDER_TYPE_BUY:
-            available_margin = account_info.margin_free
-        else:
-            available_margin = account_info.margin_free + account_info.margin - account_info.margin_maintenance
-
-        return available_margin >= required_margin
-
-
-    def load_positions(self, symbols):
+        if account_info is None:
+            return False
+        required_margin = 0.0
+        for symbol, volume in lots.items():
+            if volume == 0:
+                continue
+            tick = mt5.symbol_info_tick(symbol)
+            if tick is None:
+                return False
+            order_type, price = (mt5.ORDER_TYPE_BUY, tick.ask) if volume > 0 else (mt5.ORDER_TYPE_SELL, tick.bid)
+            margin = mt5.order_calc_margin(order_type, symbol, float(abs(volume)), price)
+            if margin is None:
+                return False
+            required_margin += margin
+        print(f"{datetime.now()}: exact margin check: required {required_margin}, free margin {account_info.margin_free}")
+        return account_info.margin_free >= required_margin
+
+
+# refresh positions from deals since the cursor (all tracked symbols at once, symbols argument kept for callers)
+    async def load_positions(self, symbols = None, check = False):
+        check = self._positions_check_due(check)
+        deals, positions = await self.executor.run(self._load_positions_blocking, check, priority=PRIORITY_READ)
+        self._apply_positions(deals, positions)
+
+    def _positions_check_due(self, check):
+        return check or not self.position_tracker.baselined or time.monotonic() - self.last_positions_check >= MOEX_POSITIONS_CHECK_INTERVAL
+
+# for a check, positions_get is taken between two deal reads. A deal landing between positions_get and the deal read
+# would be applied on top of a snapshot that already has it (or reverted by one that misses it): if the second read
+# brings new deals, the snapshot is dropped and the check is done on the next call
+    def _load_positions_blocking(self, check):
+        from_date, to_date = self.position_tracker.next_range()
+        deals = mt5.history_deals_get(from_date, to_date)
+        if deals is None:
+            print(f"{datetime.now()}: mt5.history_deals_get failed, error code =", mt5.last_error())
+            return None, None
+        if not check:
+            return deals, None
         positions = mt5.positions_get()
-        if positions == None:
-            print(f"{datetime.now()}: No open positions")
-        elif len(positions) > 0:
-            # convert the tuple received to a dataframe
-            df = pd.DataFrame(list(positions), columns=positions[0]._asdict().keys())
-            # filter dataframe for the symbols of interest
-            df = df[df['symbol'].isin(symbols)]
-            # save open positions
-            for index, row in df.iterrows():
-                volume = row['volume'] if row['type'] == mt5.POSITION_TYPE_BUY else -row['volume']
-                self.positions[row['symbol']] = volume
-        else:
-            print(f"{datetime.now()}: No open positions for the loaded MOEX_SYMBOLS")
-
-
-# loads current bid and ask data
+        deals_after = mt5.history_deals_get(from_date, to_date)
+        if deals_after is None:
+            return deals, None
+        if {deal.ticket for deal in deals_after} - {deal.ticket for deal in deals}:
+            print(f"{datetime.now()}: new deals during positions_get, positions check postponed")
+            return deals_after, None
+        return deals_after, positions
+
+    def _apply_positions(self, deals, positions):
+        tracker = self.position_tracker
+        if not tracker.baselined:
+            if positions is None or deals is None:
+                return
+            tracker.baseline(positions, deals)
+            self.last_positions_check = time.monotonic()
+            return
+        for symbol, symbol_deals in tracker.apply_deals(deals).items():
+            for deal in symbol_deals:
+                self.open_orders.on_filled(deal.order, deal.volume)
+            self.open_orders.mark_dirty(symbol) # orders_get may already include the fill, verify on the next read
+            self.metadata.invalidate_account() # used / free margin changed
+        if positions is not None:
+            self.last_positions_check = time.monotonic()
+            for symbol, (tracked, terminal) in tracker.check(positions).items():
+                print(f"{datetime.now()}: {symbol} position drift: deals give {tracked}, positions_get gives {terminal}. Using positions_get")
+                self.open_orders.mark_dirty(symbol)
+
+# orders and positions of several symbols (and optionally their books) in one hop to the MT5 thread.
+# orders = None reconciles only the symbols whose local orders are due for a check (see OpenOrders.needs_reconcile)
+    async def refresh(self, symbols, orders = True, positions = True, books = False):
+        calls = []
+        order_symbols = []
+        if orders is None:
+            order_symbols = [symbol for symbol in symbols if self.open_orders.needs_reconcile(symbol)]
+        elif orders:
+            order_symbols = list(symbols)
+        calls += [(self._load_orders_blocking, (symbol,)) for symbol in order_symbols]
+        if positions:
+            calls.append((self._load_positions_blocking, (self._positions_check_due(False),)))
+        if books:
+            calls += [(self._symbol_deep_quotes_blocking, (symbol, self.lots_dict[symbol])) for symbol in symbols]
+        results = await self.executor.run_batch(calls, PRIORITY_READ)
+        for symbol, symbol_orders in zip(order_symbols, results):
+            self._apply_orders(symbol, symbol_orders)
+        if positions:
+            self._apply_positions(*results[len(order_symbols)])
+        if books:
+            self._after_book_poll(symbols, results[-len(symbols):])
+
+
+# loads current bid and ask data. Returns the list of symbols whose best or deep quotes changed
     async def get_data(self, lots_dict):
 
-        #loop = asyncio.get_running_loop() # use the loop, that is created by asyncio.run
-        tasks = [asyncio.to_thread(self.symbol_deep_quotes, symbol, lots) for symbol, lots in lots_dict.items()]
-        await asyncio.gather(*tasks)
-
-
-# method to calculate weighted average ask and bid price for given number of lots 
-    def symbol_deep_quotes(self, symbol, lots):
+        # all books in one hop to the MT5 thread
+        calls = [(self._symbol_deep_quotes_blocking, (symbol, lots)) for symbol, lots in lots_dict.items()]
+        results = await self.executor.run_batch(calls, PRIORITY_DATA)
+        return self._after_book_poll(list(lots_dict), results)
+
+# notifications are sent from the loop thread, asyncio events are not thread safe
+    def _after_book_poll(self, symbols, results):
+        now = time.monotonic()
+        changed_symbols = []
+        for symbol, changed in zip(symbols, results):
+            cache = self.book_cache[symbol]
+            cache.after_poll(changed, now)
+            if cache.snapshots != self.book_snapshots[symbol]:
+                self.book_snapshots[symbol] = cache.snapshots
+                for listener in self.book_listeners:
+                    listener(symbol)
+            if changed:
+                changed_symbols.append(symbol)
+                for listener in self.quote_listeners:
+                    listener(symbol)
+        return changed_symbols
+
+
+# method to calculate weighted average ask and bid price for given number of lots (and its multiples, see depth_engine)
+# recalculates only if the relevant levels of the book moved since the previous snapshot
+    async def symbol_deep_quotes(self, symbol, lots):
+        changed = await self.executor.run(self._symbol_deep_quotes_blocking, symbol, lots, priority=PRIORITY_DATA)
+        self._after_book_poll([symbol], [changed])
+        return changed
+
+    def _symbol_deep_quotes_blocking(self, symbol, lots):
         quotes = mt5.market_book_get(symbol)
+        cache = self.book_cache[symbol]
         if quotes is not None:
-            Order_book = pd.DataFrame(list(quotes), columns = ["type","price","volume","volume_dbl"])
-            Ask_book = Order_book.loc[Order_book["type"] == 1].sort_values(by = "price", ascending = True)
-            Bid_book = Order_book.loc[Order_book["type"] == 2].sort_values(by = "price", ascending = False)
-            self.current_ask[symbol] = Ask_book["price"].min()
-            self.current_bid[symbol] = Bid_book["price"].max()
-
-            if lots > Ask_book["volume_dbl"].sum() or lots > Bid_book["volume_dbl"].sum():
+            cache.set_sizes(self.depth_multiples * lots)
+            if not cache.update(quotes):
+                return False
+            self.current_bid[symbol] = cache.best_bid
+            self.current_ask[symbol] = cache.best_ask
+            self.deep_bid_ladder[symbol] = cache.bid_vwap
+            self.deep_ask_ladder[symbol] = cache.ask_vwap
+            self.deep_bid_filled[symbol] = cache.bid_filled
+            self.deep_ask_filled[symbol] = cache.ask_filled
+
+            # first ladder size is the one used by the strategies. Keep NaN there so grid skips thin books
+            if cache.bid_filled[0] and cache.ask_filled[0]:
+                self.deep_bid[symbol] = cache.bid_vwap[0]
+                self.deep_ask[symbol] = cache.ask_vwap[0]
+            else:
                 print(f"{datetime.now()}: Not enough bids or asks in order book for {lots} lots of {symbol}/")
                 self.deep_bid[symbol] = np.nan
                 self.deep_ask[symbol] = np.nan
-                
-            else:
-                Ask_book["technical"] = Ask_book["volume_dbl"] + lots - Ask_book["volume_dbl"].cumsum()
-                Ask_book = Ask_book[Ask_book["technical"]>0]
-                Deep_ask = ((Ask_book[["volume_dbl","technical"]].min(axis=1) * Ask_book["price"]).sum()/lots)
-                Bid_book["technical"] = Bid_book["volume_dbl"] + lots - Bid_book["volume_dbl"].cumsum()
-                Bid_book = Bid_book[Bid_book["technical"]>0]
-                Deep_bid = ((Bid_book[["volume_dbl","technical"]].min(axis=1) * Bid_book["price"]).sum()/lots)
-                
-                self.deep_bid[symbol] = Deep_bid
-                self.deep_ask[symbol] = Deep_ask
+            return True
         else:
+            # reported once: while the book stays unavailable nothing changes and the poll interval backs off
+            if not cache.fail():
+                return False
             print(f"{datetime.now()}: mt5.market_book_get('{symbol}') failed, error code =", mt5.last_error())
             self.deep_bid[symbol] = np.nan
             self.deep_ask[symbol] = np.nan
+            self.deep_bid_filled[symbol][:] = False
+            self.deep_ask_filled[symbol][:] = False
+            return True
 
 
+# book change notifications for strategies
+    async def wait_book_change(self, symbol, timeout = None):
+        return await self.book_cache[symbol].wait_changed(timeout)
 
+    def watch_book(self, symbol):
+        self.watched_books[symbol] = self.watched_books.get(symbol, 0) + 1
+        self.book_cache[symbol].note_activity()
+        self.poll_wakeup.set()
 
-# TODO: NOT USED NOW, DELETE OR AMEND
+    def unwatch_book(self, symbol):
+        if self.watched_books.get(symbol, 0) > 1:
+            self.watched_books[symbol] -= 1
+        else:
+            self.watched_books.pop(symbol, None)
+
+# IB tick on the paired contract - poll the MOEX book right away and keep polling densely
+    def note_ib_tick(self, symbol):
+        self.book_cache[symbol].note_activity()
+        self.poll_wakeup.set()
+
+
+# adaptive book polling: each watched symbol is polled when its interval expires or on an IB tick.
+# interval drops to MOEX_POLL_MIN_INTERVAL on any change and grows up to MOEX_POLL_MAX_INTERVAL while the book is quiet
     async def run(self):
         while True:
-            for symbol in self.symbols:
-                await self.get_data(self.lots_dict)
-                print(f"{datetime.now()}: Received data for {symbol}: bid: {self.current_bid[symbol]}, ask: {self.current_ask[symbol]}")
-                await asyncio.sleep(1)
-
+            self.poll_wakeup.clear()
+            now = time.monotonic()
+            due = {symbol: self.lots_dict[symbol] for symbol in self.watched_books if self.book_cache[symbol].next_poll <= now}
+            if due:
+                await self.get_data(due)
+                now = time.monotonic()
+            next_polls = [self.book_cache[symbol].next_poll for symbol in self.watched_books]
+            sleep_time = max(min(next_polls) - now, 0) if next_polls else MOEX_POLL_MAX_INTERVAL
+            try:
+                await asyncio.wait_for(self.poll_wakeup.wait(), sleep_time)
+            except asyncio.TimeoutError:
+                pass
+
+# terminal shutdown on the MT5 thread after the calls already queued, then the thread stops. Awaited on exit
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        await self.executor.run(mt5.shutdown, priority=PRIORITY_DATA)
+        self.executor.shutdown(wait=False)
+
+# without close(): only stops the MT5 thread, never blocks the thread running the garbage collector
     def __del__(self):
-        mt5.shutdown()
+        executor = getattr(self, "executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,68 @@
+# mt5_executor.py
+# single owned worker thread for all MetaTrader5 calls (the library is not thread safe).
+# calls are queued by priority: order actions go ahead of position / order reads, which go ahead of book refreshes
+import asyncio
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+PRIORITY_ORDER = 0 # order_send
+PRIORITY_READ = 1 # orders / positions / history / account reads
+PRIORITY_DATA = 2 # market book refreshes
+
+
+class MT5Executor:
+    def __init__(self, name = "mt5-executor"):
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count() # FIFO inside one priority, also keeps queue items comparable
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._running = True
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            _, _, calls, future = self._queue.get()
+            if calls is None: # shutdown
+                future.set_result(None)
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                # a batch is executed in one go, so several symbols cost one thread hop
+                future.set_result([fn(*args) for fn, args in calls])
+            except BaseException as e:
+                future.set_exception(e)
+
+# queue list of (function, args) to run in one hop. Returns concurrent.futures.Future with the list of results
+    def submit_batch(self, calls, priority = PRIORITY_READ):
+        if not self._running:
+            raise RuntimeError("MT5Executor is shut down")
+        future = Future()
+        self._queue.put((priority, next(self._sequence), list(calls), future))
+        return future
+
+# awaitable versions for the event loop
+    async def run(self, fn, *args, priority = PRIORITY_READ):
+        results = await asyncio.wrap_future(self.submit_batch([(fn, args)], priority))
+        return results[0]
+
+    async def run_batch(self, calls, priority = PRIORITY_READ):
+        calls = list(calls)
+        if not calls:
+            return []
+        return await asyncio.wrap_future(self.submit_batch(calls, priority))
+
+# blocking version for code outside of the event loop (constructor, shutdown)
+    def call(self, fn, *args):
+        return self.submit_batch([(fn, args)], PRIORITY_ORDER).result()[0]
+
+    def shutdown(self, wait = True):
+        if not self._running:
+            return
+        self._running = False
+        future = Future()
+        # lowest priority, so the calls already queued are finished first
+        self._queue.put((PRIORITY_DATA + 1, next(self._sequence), None, future))
+        if wait and threading.current_thread() is not self._thread:
+            future.result()
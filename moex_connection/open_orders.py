@@ -0,0 +1,113 @@
+# open_orders.py
+# local book of open MOEX limit orders. Updated from order_send results and corrected by periodic
+# reconciliation against mt5.orders_get, so strategies can read current orders without a terminal call
+import time
+import numpy as np
+import pandas as pd
+
+ORDER_COLUMNS = ["ticket","symbol","type","volume_initial", "volume_current","price_open"]
+
+
+class OrderRecord:
+    __slots__ = ("ticket", "symbol", "type", "volume_initial", "volume_current", "price_open")
+
+    def __init__(self, ticket, symbol, type, volume_initial, volume_current, price_open):
+        self.ticket = ticket
+        self.symbol = symbol
+        self.type = type
+        self.volume_initial = volume_initial
+        self.volume_current = volume_current
+        self.price_open = price_open
+
+    def key(self):
+        return (self.ticket, self.type, self.volume_current, self.price_open)
+
+    def __repr__(self):
+        return f"OrderRecord({self.ticket}, {self.symbol}, type={self.type}, volume={self.volume_current}, price={self.price_open})"
+
+
+class OpenOrders:
+    def __init__(self, symbols, decimals, reconcile_interval):
+        self.decimals = decimals # symbol : decimals to round prices to
+        self.reconcile_interval = reconcile_interval # seconds between checks against the terminal
+        self.orders = {symbol: {} for symbol in symbols} # symbol : {ticket : OrderRecord}
+        self.last_reconcile = {symbol: 0.0 for symbol in symbols}
+        self.dirty = {symbol: True for symbol in symbols} # local state may be wrong (failed action, fills), reconcile asap
+        self.versions = {symbol: 0 for symbol in symbols} # incremented on every change of the symbol's orders
+
+    def get(self, symbol):
+        return self.orders[symbol]
+
+    def tickets(self, symbol):
+        return list(self.orders[symbol])
+
+    def records(self, symbol):
+        return sorted(self.orders[symbol].values(), key=lambda record: record.price_open)
+
+# same columns and order as the previous load_orders DataFrame
+    def frame(self, symbol):
+        records = self.records(symbol)
+        return pd.DataFrame({
+            "ticket": np.array([record.ticket for record in records], dtype=np.int64),
+            "symbol": [record.symbol for record in records],
+            "type": np.array([record.type for record in records], dtype=np.int64),
+            "volume_initial": np.array([record.volume_initial for record in records], dtype=np.float64),
+            "volume_current": np.array([record.volume_current for record in records], dtype=np.float64),
+            "price_open": np.array([record.price_open for record in records], dtype=np.float64),
+        }, columns=ORDER_COLUMNS)
+
+    def needs_reconcile(self, symbol, now = None):
+        now = time.monotonic() if now is None else now
+        return self.dirty[symbol] or now - self.last_reconcile[symbol] >= self.reconcile_interval
+
+    def mark_dirty(self, symbol):
+        self.dirty[symbol] = True
+
+# updates from successful order_send results
+    def on_placed(self, symbol, ticket, order_type, volume, price):
+        price = round(price, self.decimals[symbol])
+        self.orders[symbol][ticket] = OrderRecord(ticket, symbol, order_type, volume, volume, price)
+        self.versions[symbol] += 1
+
+    def on_modified(self, ticket, price, volume = None):
+        for symbol, orders in self.orders.items():
+            if ticket in orders:
+                orders[ticket].price_open = round(price, self.decimals[symbol])
+                if volume is not None:
+                    orders[ticket].volume_current = float(volume)
+                self.versions[symbol] += 1
+                return
+
+    def on_cancelled(self, ticket):
+        for symbol, orders in self.orders.items():
+            if orders.pop(ticket, None) is not None:
+                self.versions[symbol] += 1
+                return
+
+# deal of the order: reduce remaining volume, fully filled orders leave the book
+    def on_filled(self, ticket, volume):
+        for symbol, orders in self.orders.items():
+            if ticket in orders:
+                record = orders[ticket]
+                record.volume_current -= volume
+                if record.volume_current <= 0:
+                    del orders[ticket]
+                self.versions[symbol] += 1
+                return
+
+# replace local state of the symbol by mt5.orders_get result. Returns tickets that differed (drift)
+    def reconcile(self, symbol, mt5_orders, now = None):
+        decimals = self.decimals[symbol]
+        fresh = {}
+        for order in mt5_orders or ():
+            fresh[order.ticket] = OrderRecord(order.ticket, order.symbol, order.type, order.volume_initial,
+                                              order.volume_current, round(order.price_open, decimals))
+        local = self.orders[symbol]
+        drift = [ticket for ticket in set(local) | set(fresh)
+                 if ticket not in local or ticket not in fresh or local[ticket].key() != fresh[ticket].key()]
+        self.orders[symbol] = fresh
+        if drift:
+            self.versions[symbol] += 1
+        self.last_reconcile[symbol] = time.monotonic() if now is None else now
+        self.dirty[symbol] = False
+        return drift
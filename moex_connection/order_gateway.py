@@ -0,0 +1,188 @@
+# order_gateway.py
+# single entry point for MOEX order actions: runs batches with bounded concurrency, tracks every request
+# in flight and keeps one market-closed back-off per symbol instead of one sleep per task
+import asyncio
+import itertools
+import time
+from collections import deque
+from datetime import datetime
+import MetaTrader5 as mt5
+
+ACTION_NEW = "new"
+ACTION_MODIFY = "modify"
+ACTION_CANCEL = "cancel"
+
+# request states
+STATE_QUEUED = "queued"
+STATE_SENT = "sent"
+STATE_BACKOFF = "backoff" # waiting for the market to open or for retry
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+STATE_ABANDONED = "abandoned" # symbol stopped while waiting
+
+
+class OrderRequest:
+    __slots__ = ("key", "kind", "symbol", "ticket", "order_type", "volume", "price", "tag",
+                 "state", "attempts", "created", "sent", "completed", "result", "error", "future")
+
+    def __init__(self, kind, symbol, ticket = None, order_type = None, volume = None, price = None, tag = None):
+        self.key = None # gateway id, unique per request: several requests may target the same ticket
+        self.kind = kind
+        self.symbol = symbol
+        self.ticket = ticket
+        self.order_type = order_type
+        self.volume = volume
+        self.price = price
+        self.tag = tag # caller's reference, e.g. target order index
+        self.state = STATE_QUEUED
+        self.attempts = 0
+        self.created = time.monotonic()
+        self.sent = None
+        self.completed = None
+        self.result = None
+        self.error = None # mt5.last_error() of the latest attempt
+        self.future = None
+
+    def __repr__(self):
+        return f"OrderRequest({self.kind}, {self.symbol}, ticket={self.ticket}, state={self.state}, attempts={self.attempts})"
+
+
+# short constructors for batches
+def new_order(symbol, order_type, volume, price, tag = None):
+    return OrderRequest(ACTION_NEW, symbol, order_type=order_type, volume=volume, price=price, tag=tag)
+
+# volume only if the venue supports changing it in place (MOEX_MODIFY_VOLUME)
+def modify_order(symbol, ticket, price, volume = None, tag = None):
+    return OrderRequest(ACTION_MODIFY, symbol, ticket=ticket, price=price, volume=volume, tag=tag)
+
+def cancel_order(symbol, ticket, tag = None):
+    return OrderRequest(ACTION_CANCEL, symbol, ticket=ticket, tag=tag)
+
+
+class OrderGateway:
+    def __init__(self, moex_connector, max_concurrency = 8, market_closed_backoff = 300, retry_backoff = 30, notify = None):
+        self.moex_connector = moex_connector
+        self.market_closed_backoff = market_closed_backoff # seconds
+        self.retry_backoff = retry_backoff # seconds before resending a failed new order
+        self.notify = notify # callable(text) for telegram messages
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._keys = itertools.count(1)
+
+        self.in_flight = {} # request id : OrderRequest, tickets in request.ticket
+        self.completed = deque(maxlen=1000) # recent finished requests for inspection
+        self.closed_until = {} # symbol : monotonic time until which the market is considered closed
+        self.stop_events = {} # symbol : asyncio.Event, set to abandon requests waiting in back-off
+
+# queue a batch of OrderRequest, returns futures resolved with the requests when they complete
+    def submit(self, requests):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for request in requests:
+            request.key = next(self._keys)
+            request.future = loop.create_future()
+            self.in_flight[request.key] = request
+            loop.create_task(self._execute(request))
+            futures.append(request.future)
+        return futures
+
+# submit and wait for the whole batch - single completion point for a reconciliation cycle
+    async def execute(self, requests):
+        requests = list(requests)
+        if requests:
+            await asyncio.gather(*self.submit(requests))
+        return requests
+
+    def stop(self, symbol):
+        self._stop_event(symbol).set()
+
+    def resume(self, symbol):
+        self._stop_event(symbol).clear()
+
+    def is_market_closed(self, symbol):
+        return self.closed_until.get(symbol, 0) > time.monotonic()
+
+# tickets with a request in flight, once each even if several requests target one ticket
+    def in_flight_tickets(self, symbol = None):
+        return list({request.ticket for request in self.in_flight.values()
+                if request.ticket is not None and (symbol is None or request.symbol == symbol)})
+
+    def _stop_event(self, symbol):
+        if symbol not in self.stop_events:
+            self.stop_events[symbol] = asyncio.Event()
+        return self.stop_events[symbol]
+
+# sleep until the deadline unless the symbol is stopped. Returns False if stopped
+    async def _wait(self, symbol, delay):
+        stop_event = self._stop_event(symbol)
+        if stop_event.is_set():
+            return False
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=max(delay, 0))
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _send(self, request):
+        if request.kind == ACTION_NEW:
+            return await self.moex_connector.limit_order(request.symbol, request.order_type, request.volume, request.price)
+        elif request.kind == ACTION_MODIFY:
+            return await self.moex_connector.modify_order(int(request.ticket), request.price, request.volume)
+        else:
+            return await self.moex_connector.cancel_order(int(request.ticket))
+
+    async def _execute(self, request):
+        try:
+            while True:
+                # shared market-closed back-off: every request of the symbol waits for the same deadline
+                closed_for = self.closed_until.get(request.symbol, 0) - time.monotonic()
+                if closed_for > 0:
+                    request.state = STATE_BACKOFF
+                    if not await self._wait(request.symbol, closed_for):
+                        request.state = STATE_ABANDONED
+                        break
+
+                async with self._semaphore:
+                    request.state = STATE_SENT
+                    request.attempts += 1
+                    request.sent = time.monotonic()
+                    trade, request.error = await self._send(request)
+                request.result = trade
+
+                if trade is not None and trade.retcode == mt5.TRADE_RETCODE_DONE:
+                    if request.kind == ACTION_NEW:
+                        request.ticket = trade.order
+                    request.state = STATE_DONE
+                    break
+                elif trade is not None and trade.retcode == mt5.TRADE_RETCODE_MARKET_CLOSED:
+                    if not self.is_market_closed(request.symbol):
+                        self.closed_until[request.symbol] = time.monotonic() + self.market_closed_backoff
+                        print(f"{datetime.now()}: {request.symbol} order gateway: MARKET CLOSED, pausing orders for {self.market_closed_backoff} seconds")
+                        self._notify(f"{datetime.now()}: {request.symbol} {request.kind} order failure. MARKET CLOSED")
+                elif request.kind == ACTION_NEW:
+                    retcode = trade.retcode if trade is not None else None
+                    print(f"{request.symbol} new order failure! retcode: {retcode}, Error code: {request.error}")
+                    self._notify(f"{request.symbol} new order failure! retcode: {retcode}, Error code: {request.error}")
+                    request.state = STATE_BACKOFF
+                    if not await self._wait(request.symbol, self.retry_backoff):
+                        request.state = STATE_ABANDONED
+                        break
+                else:
+                    # cancel / modify failures are not retried: the order is likely filled or gone, next cycle reconciles it
+                    retcode = trade.retcode if trade is not None else None
+                    print(f"{datetime.now()}: {request.symbol} {request.ticket} {request.kind} order failure! retcode: {retcode}, MT5 Error code: {request.error}")
+                    self._notify(f"{request.symbol} {request.kind} order failure! retcode: {retcode}, Error code: {request.error}")
+                    request.state = STATE_FAILED
+                    break
+        except Exception as e:
+            request.state = STATE_FAILED
+            print(f"{datetime.now()}: {request.symbol} order gateway error on {request}: {e}")
+        finally:
+            request.completed = time.monotonic()
+            self.in_flight.pop(request.key, None)
+            self.completed.append(request)
+            if not request.future.done():
+                request.future.set_result(request)
+
+    def _notify(self, text):
+        if self.notify is not None:
+            self.notify(text)
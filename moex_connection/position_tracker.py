@@ -0,0 +1,81 @@
+# position_tracker.py
+# MOEX net positions maintained from the deal stream (history_deals_get) with a moving time / ticket cursor.
+# positions_get is only used for the baseline and for periodic consistency checks
+from datetime import datetime, timedelta, timezone
+
+DEAL_TYPE_BUY = 0 # mt5.DEAL_TYPE_BUY
+DEAL_TYPE_SELL = 1 # mt5.DEAL_TYPE_SELL
+POSITION_TYPE_BUY = 0 # mt5.POSITION_TYPE_BUY
+
+
+class PositionTracker:
+    def __init__(self, symbols, positions, overlap = 60):
+        self.symbols = set(symbols)
+        self.positions = positions # symbol : net volume, shared with MoexAsyncWrapper.positions
+        self.versions = {symbol: 0 for symbol in symbols} # incremented on every change of the position
+        self.overlap = overlap # seconds re-requested before the cursor, deal time has seconds resolution
+        self.cursor = None # server time (seconds) of the latest deal seen
+        self.seen = {} # deal ticket : deal time, only for deals inside the overlap window
+        self.baselined = False
+
+# date range for the next history_deals_get call
+    def next_range(self):
+        # UTC aware bounds, as the server times of the cursor
+        to_date = datetime.now(timezone.utc) + timedelta(days=1) # account for timezone just setting tomorrow's datetime
+        if self.cursor is None:
+            from_date = datetime.now().replace(hour=6, minute=0, second=0, microsecond = 0).astimezone(timezone.utc) # 6:00 local time
+        else:
+            from_date = datetime.fromtimestamp(self.cursor - self.overlap, tz=timezone.utc)
+        return from_date, to_date
+
+    def _set(self, symbol, volume):
+        if self.positions.get(symbol) != volume:
+            self.positions[symbol] = volume
+            self.versions[symbol] += 1
+
+# positions_get snapshot + deals already included in it. Deals are only marked as seen
+    def baseline(self, mt5_positions, deals):
+        self.apply_snapshot(mt5_positions)
+        self._advance(deals, apply = False)
+        self.baselined = True
+
+    def apply_snapshot(self, mt5_positions):
+        volumes = {symbol: 0 for symbol in self.symbols}
+        for position in mt5_positions or ():
+            if position.symbol in volumes:
+                volumes[position.symbol] += position.volume if position.type == POSITION_TYPE_BUY else -position.volume
+        for symbol, volume in volumes.items():
+            self._set(symbol, volume)
+
+# apply new deals. Returns {symbol: [deals]} of the deals applied, used to update open orders
+    def apply_deals(self, deals):
+        return self._advance(deals, apply = True)
+
+    def _advance(self, deals, apply):
+        applied = {}
+        for deal in deals or ():
+            if deal.ticket in self.seen:
+                continue
+            self.seen[deal.ticket] = deal.time
+            if self.cursor is None or deal.time > self.cursor:
+                self.cursor = deal.time
+            if not apply or deal.symbol not in self.symbols:
+                continue
+            if deal.type == DEAL_TYPE_BUY:
+                self._set(deal.symbol, self.positions[deal.symbol] + deal.volume)
+            elif deal.type == DEAL_TYPE_SELL:
+                self._set(deal.symbol, self.positions[deal.symbol] - deal.volume)
+            else:
+                continue # balance, commission etc.
+            applied.setdefault(deal.symbol, []).append(deal)
+        # forget tickets which can not be returned by the next request any more
+        if self.cursor is not None and len(self.seen) > 1000:
+            horizon = self.cursor - self.overlap
+            self.seen = {ticket: time for ticket, time in self.seen.items() if time >= horizon}
+        return applied
+
+# compare with positions_get. Returns {symbol: (tracked, terminal)} for drifted symbols and takes terminal values
+    def check(self, mt5_positions):
+        tracked = {symbol: self.positions.get(symbol, 0) for symbol in self.symbols}
+        self.apply_snapshot(mt5_positions)
+        return {symbol: (volume, self.positions[symbol]) for symbol, volume in tracked.items() if volume != self.positions[symbol]}
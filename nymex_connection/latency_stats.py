@@ -0,0 +1,129 @@
+# latency_stats.py
+# fixed memory latency recording: log-bucketed histograms per (symbol, stage) kept in time slices for sliding
+# window percentiles, an all-session histogram and a bounded ring of the latest raw samples
+import math
+import time
+from collections import deque
+import numpy as np
+
+STAGE_SUBMIT = "placed-submitted"
+STAGE_FILL = "submitted-filled"
+STAGE_ROUND_TRIP = "placed-filled"
+
+
+class LatencyHistogram:
+    # bucket i covers [min_value * growth**i, min_value * growth**(i+1)), relative error of a percentile < growth - 1
+    def __init__(self, min_value = 1e-5, max_value = 100.0, growth = 1.05):
+        self.min_value = min_value
+        self.log_growth = np.log(growth)
+        self.size = int(np.ceil(np.log(max_value / min_value) / self.log_growth)) + 1
+        self.bounds = min_value * growth ** np.arange(1, self.size + 1) # upper bound of each bucket
+        self.counts = np.zeros(self.size, dtype=np.int64)
+        self.max = 0.0
+
+    def bucket(self, value):
+        if value <= self.min_value:
+            return 0
+        return min(int(math.log(value / self.min_value) / self.log_growth), self.size - 1)
+
+    def add(self, value):
+        self.counts[self.bucket(value)] += 1
+        if value > self.max:
+            self.max = value
+
+    def clear(self):
+        self.counts[:] = 0
+        self.max = 0.0
+
+
+# percentile (0-100) of summed bucket counts, reported as the bucket's upper bound (capped by the observed max)
+def histogram_percentile(bounds, counts, q, max_value):
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    index = int(np.searchsorted(np.cumsum(counts), q / 100 * total))
+    return min(bounds[min(index, len(bounds) - 1)], max_value)
+
+
+class LatencyStats:
+    def __init__(self, slice_seconds = 60, slices = 60, ring_size = 256, **histogram):
+        self.slice_seconds = slice_seconds # resolution of the sliding windows
+        self.slices = slices # windows up to slice_seconds * slices long
+        self.ring_size = ring_size
+        self.histogram = histogram # LatencyHistogram arguments
+        self.series = {} # (symbol, stage) : _Series
+
+# latency in seconds of a stage of one order
+    def record(self, symbol, stage, seconds, now = None):
+        now = time.monotonic() if now is None else now
+        series = self.series.get((symbol, stage))
+        if series is None:
+            series = self.series[(symbol, stage)] = _Series(self.slices, self.ring_size, self.histogram)
+        series.add(seconds, int(now // self.slice_seconds), now)
+
+# p50 / p99 / max / count over the last window seconds (None: whole session)
+    def summary(self, symbol, stage, window = None, now = None):
+        series = self.series.get((symbol, stage))
+        if series is None:
+            return {"count": 0, "p50": np.nan, "p99": np.nan, "max": np.nan}
+        counts, max_value = self._counts(series, window, now)
+        bounds = series.total.bounds
+        return {"count": int(counts.sum()),
+                "p50": histogram_percentile(bounds, counts, 50, max_value),
+                "p99": histogram_percentile(bounds, counts, 99, max_value),
+                "max": max_value if counts.sum() else np.nan}
+
+    def percentile(self, symbol, stage, q, window = None, now = None):
+        series = self.series.get((symbol, stage))
+        if series is None:
+            return np.nan
+        counts, max_value = self._counts(series, window, now)
+        return histogram_percentile(series.total.bounds, counts, q, max_value)
+
+    def _counts(self, series, window, now):
+        if window is None:
+            return series.total.counts, series.total.max
+        now = time.monotonic() if now is None else now
+        slices = min(max(int(np.ceil(window / self.slice_seconds)), 1), self.slices)
+        return series.window(int(now // self.slice_seconds), slices)
+
+# latest raw samples, oldest first: [(monotonic time, seconds), ...]
+    def recent(self, symbol, stage):
+        series = self.series.get((symbol, stage))
+        return list(series.ring) if series is not None else []
+
+# one line per (symbol, stage), for logs and bot messages
+    def report(self, window = None):
+        lines = []
+        for symbol, stage in sorted(self.series):
+            stats = self.summary(symbol, stage, window)
+            if stats["count"]:
+                lines.append(f"{symbol} {stage}: n={stats['count']} p50={stats['p50'] * 1000:.1f}ms p99={stats['p99'] * 1000:.1f}ms max={stats['max'] * 1000:.1f}ms")
+        return "\n".join(lines)
+
+
+class _Series:
+    def __init__(self, slices, ring_size, histogram):
+        self.total = LatencyHistogram(**histogram)
+        self.slice_histograms = [LatencyHistogram(**histogram) for _ in range(slices)] # ring indexed by slice number
+        self.slice_ids = [-1] * slices
+        self.ring = deque(maxlen=ring_size)
+
+    def add(self, seconds, slice_id, now):
+        position = slice_id % len(self.slice_ids)
+        if self.slice_ids[position] != slice_id: # slot reused by a newer slice
+            self.slice_histograms[position].clear()
+            self.slice_ids[position] = slice_id
+        self.slice_histograms[position].add(seconds)
+        self.total.add(seconds)
+        self.ring.append((now, seconds))
+
+    def window(self, slice_id, slices):
+        counts = np.zeros_like(self.total.counts)
+        max_value = 0.0
+        for previous in range(slice_id - slices + 1, slice_id + 1):
+            position = previous % len(self.slice_ids)
+            if self.slice_ids[position] == previous:
+                counts += self.slice_histograms[position].counts
+                max_value = max(max_value, self.slice_histograms[position].max)
+        return counts, max_value
@@ -1,13 +1,21 @@
 # nymex_async_wrapper.py
 import asyncio
+import time
 import numpy as np
 from ib_insync import IB, Contract, MarketOrder
 from typing import Tuple
-from config import NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS
+from config import NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS, NYMEX_SUBSCRIBE_TIMEOUT
+from config import METADATA_TTL, ACCOUNT_MARGIN_TTL, MARGIN_SAFETY_BUFFER
 from datetime import datetime
+from risk_management import MetadataCache, InstrumentMeta, AccountMeta, MarginEstimator
+from risk_management.margin_estimator import MARGIN_OK, MARGIN_INSUFFICIENT, worst_side
+from nymex_connection.position_book import PositionBook
+from nymex_connection.latency_stats import LatencyStats, STAGE_SUBMIT, STAGE_FILL, STAGE_ROUND_TRIP
+
+TERMINAL_ORDER_STATUSES = ('Filled', 'Cancelled', 'ApiCancelled', 'Inactive')
 
 class NymexAsyncWrapper:
-    def __init__(self, api_key, host, port, contracts):
+    def __init__(self, api_key, host, port, contracts, ib = None):
         self.api_key = api_key
         self.host = host
         self.port = port
@@ -22,22 +30,30 @@ class NymexAsyncWrapper:
         self.positions = {}
         for contract in self.contracts:
             self.positions[contract.localSymbol] = 0
+        # positions are pushed by IB (fills and position updates), load_positions only resyncs from ib.positions()
+        self.position_book = PositionBook(self.symbols, self.positions)
+        self.position_versions = self.position_book.versions # localSymbol : version, changes with the position
         self.current_bid = {}
         self.current_ask = {}
         for contract in self.contracts:
             self.current_bid[contract.localSymbol] = np.nan
             self.current_ask[contract.localSymbol] = np.nan
 
-        self.order_time = {}
-        self.submit_time = {}
-        self.fill_time = {}
+        # order lifecycle latencies. live_orders holds only orders not in a terminal state
+        self.live_orders = {} # orderId : [localSymbol, placed, submitted] (time.monotonic)
+        self.latency = LatencyStats()
 
+        # contract metadata / account margin cache and local margin model
+        self.metadata = MetadataCache(METADATA_TTL, ACCOUNT_MARGIN_TTL)
+        self.margin_estimator = MarginEstimator(self.metadata, MARGIN_SAFETY_BUFFER)
 
-        self.ib = IB()
+        self.ib = IB() if ib is None else ib # ib: IB compatible stand-in, e.g. simulation.FakeIB
 
     async def initialize(self):
         await self.ib.connectAsync(self.host, self.port, clientId=self.api_key)
         self.contracts = await self.ib.qualifyContractsAsync(*self.contracts)
+        self.ib.execDetailsEvent += self.position_book.on_execution
+        self.ib.positionEvent += self.position_book.on_position
         self.load_positions(self.symbols)
         print(self.positions)
         self.ib.orderStatusEvent += self.on_order_status # move from send_order definition..
@@ -47,48 +63,84 @@ class NymexAsyncWrapper:
             self.current_bid[ticker.contract.localSymbol] = ticker.bid
             self.current_ask[ticker.contract.localSymbol] = ticker.ask
 
-# TODO: check if contract definition logic is accurate
-    async def subscribe_bid_ask(self, contract):
-        # Request current market data
-        ticker_snapshot = self.ib.reqMktData(contract, '', snapshot = True, regulatorySnapshot = False)
-        # waiting until the data is there TODO: STOPPED HERE, LOOP NEVER ENDS
-        while np.isnan(ticker_snapshot.bid) and np.isnan(ticker_snapshot.ask):
-            print(ticker_snapshot.bid)
-            print(ticker_snapshot.ask)
-            print(f"{datetime.now()}: np.isnan loop")
-            await asyncio.sleep(0.1)  # sleep for 100 ms
-        self.current_bid[contract.localSymbol] = ticker_snapshot.bid
-        self.current_ask[contract.localSymbol] = ticker_snapshot.ask
-        # subscribe to tick data updates
-        ticker = self.ib.reqTickByTickData(contract, tickType='BidAsk',ignoreSize = True)
-        self.active_tickers[contract.localSymbol] = ticker
-
-
+# subscribe to tick-by-tick bid / ask. Returns True once the first valid quote is in (or False after timeout,
+# the subscription is kept and later ticks still update the prices through on_pending_tickers)
+    async def subscribe_bid_ask(self, contract, timeout = NYMEX_SUBSCRIBE_TIMEOUT):
+        symbol = contract.localSymbol
+        ticker = self.active_tickers.get(symbol)
+        if ticker is None:
+            # snapshot for the current quote and tick-by-tick updates go to the same Ticker, whichever comes first
+            self.ib.reqMktData(contract, '', snapshot = True, regulatorySnapshot = False)
+            ticker = self.ib.reqTickByTickData(contract, tickType='BidAsk',ignoreSize = True)
+            self.active_tickers[symbol] = ticker
+        if not self._has_quote(ticker):
+            first_tick = asyncio.get_running_loop().create_future()
+            def on_update(ticker):
+                if not first_tick.done() and self._has_quote(ticker):
+                    first_tick.set_result(True)
+            ticker.updateEvent += on_update
+            try:
+                await asyncio.wait_for(first_tick, timeout)
+            except asyncio.TimeoutError:
+                print(f"{datetime.now()}: {symbol}: no bid / ask received in {timeout} seconds")
+                return False
+            finally:
+                ticker.updateEvent -= on_update
+        self.current_bid[symbol] = ticker.bid
+        self.current_ask[symbol] = ticker.ask
+        return True
+
+    def _has_quote(self, ticker):
+        return ticker.bid > 0 or ticker.ask > 0 # NaN before the first tick, -1 if IB has no quote
+
+# subscribe several contracts (all by default) concurrently. Returns localSymbol : subscribed in time
+    async def subscribe_many(self, contracts = None, timeout = NYMEX_SUBSCRIBE_TIMEOUT):
+        contracts = self.contracts if contracts is None else contracts
+        results = await asyncio.gather(*(self.subscribe_bid_ask(contract, timeout) for contract in contracts))
+        return dict(zip([contract.localSymbol for contract in contracts], results))
+
+# ib_insync gives the same Ticker back on the next subscription: its last bid / ask are cleared, so subscribe_bid_ask
+# waits for a quote of the new subscription instead of taking the stale one
     async def unsubscribe_bid_ask(self, contract):
         if contract.localSymbol in self.active_tickers:
             ticker = self.active_tickers[contract.localSymbol]
             self.ib.cancelTickByTickData(ticker.contract, tickType='BidAsk')
+            ticker.bid = ticker.ask = np.nan
             del self.active_tickers[contract.localSymbol]
 
 
     async def send_order(self, contract, action, volume):
         order = MarketOrder(action, volume)
         trade = self.ib.placeOrder(contract, order)
-        self.order_time[trade.order.orderId] = datetime.now()
+        self.live_orders[trade.order.orderId] = [contract.localSymbol, time.monotonic(), None]
         self.order_filled_events[trade.order.orderId] = asyncio.Event()
         
         return trade.order.orderId
 
 # callback function that is called whenever the status of any order changes
     def on_order_status(self, trade):
-        if trade.orderStatus.status == 'Submitted':
-            self.submit_time[trade.order.orderId] = datetime.now()
-            print(f"{datetime.now()}: Order {trade.order.orderId}: submit latency = {self.submit_time[trade.order.orderId] - self.order_time[trade.order.orderId]}")
-        elif trade.orderStatus.status == 'Filled':
-            self.fill_time[trade.order.orderId] = datetime.now()
-            print(f"{datetime.now()}: Order {trade.order.orderId}: fill latency = {self.fill_time[trade.order.orderId] - self.order_time[trade.order.orderId]}")
-            if trade.order.orderId in self.order_filled_events:
-                self.order_filled_events[trade.order.orderId].set()
+        status = trade.orderStatus.status
+        order_id = trade.order.orderId
+        live_order = self.live_orders.get(order_id)
+        now = time.monotonic()
+        if status == 'Submitted':
+            if live_order is not None and live_order[2] is None:
+                symbol, placed, _ = live_order
+                live_order[2] = now
+                self.latency.record(symbol, STAGE_SUBMIT, now - placed, now)
+                print(f"{datetime.now()}: Order {order_id}: submit latency = {now - placed:.6f}s")
+        elif status == 'Filled':
+            self.metadata.invalidate_account() # used / free margin changed
+            if live_order is not None:
+                symbol, placed, submitted = live_order
+                if submitted is not None:
+                    self.latency.record(symbol, STAGE_FILL, now - submitted, now)
+                self.latency.record(symbol, STAGE_ROUND_TRIP, now - placed, now)
+                print(f"{datetime.now()}: Order {order_id}: fill latency = {now - placed:.6f}s")
+            if order_id in self.order_filled_events:
+                self.order_filled_events[order_id].set()
+        if status in TERMINAL_ORDER_STATUSES:
+            self.live_orders.pop(order_id, None)
 
 
 # To rewrite:
@@ -103,36 +155,96 @@ class NymexAsyncWrapper:
     async def cancel_order(self, order):
         await self.ib.cancelOrderAsync(order)
 
-# INCORRECT NEED TO REWRITE
+# contract metadata from cache, missing or expired ones are loaded concurrently
+    async def load_metadata(self, contracts = None):
+        contracts = self.contracts if contracts is None else contracts
+        missing = [contract for contract in contracts if self.metadata.instrument(contract.localSymbol) is None]
+        metas = await asyncio.gather(*(self._load_contract_meta(contract) for contract in missing))
+        for meta in metas:
+            if meta is not None:
+                self.metadata.put_instrument(meta)
+        if self.metadata.account_meta() is None:
+            account = self._account_meta()
+            if account is not None:
+                self.metadata.put_account(account)
+
+# tick size and multiplier from contract details, margins per lot from one what-if order
+    async def _load_contract_meta(self, contract):
+        details, order_state = await asyncio.gather(self.ib.reqContractDetailsAsync(contract), self.ib.whatIfOrderAsync(contract, MarketOrder("BUY", 1)))
+        if not details or order_state is None:
+            print(f"{datetime.now()}: {contract.localSymbol} metadata not loaded")
+            return None
+        min_tick = details[0].minTick
+        decimals = max(int(np.ceil(-np.log10(min_tick) - 1e-9)), 0) if min_tick > 0 else 0
+        initial_margin = self._margin_value(order_state.initMarginChange)
+        maintenance_margin = self._margin_value(order_state.maintMarginChange)
+        if initial_margin is None:
+            return None
+        return InstrumentMeta(contract.localSymbol, min_tick, decimals, float(contract.multiplier or 1), initial_margin,
+                              maintenance_margin if maintenance_margin is not None else initial_margin)
+
+# what-if returns strings, and 1.7976931348623157E308 if IB can not calculate the value
+    def _margin_value(self, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        return value if abs(value) < 1e300 else None
+
+# account values are pushed by IB and kept by ib_insync, no round trip needed
+    def _account_meta(self):
+        values = {value.tag: value.value for value in self.ib.accountValues() if value.currency in ("USD", "BASE", "")}
+        try:
+            return AccountMeta(float(values["AvailableFunds"]), float(values.get("FullInitMarginReq", 0)), float(values.get("NetLiquidation", 0)))
+        except (KeyError, ValueError):
+            return None
+
+# pre-trade margin check for one order. contract is a qualified contract or its localSymbol
     async def check_margin_requirements(self, contract, order_type, volume):
-        contract = Contract(symbol=contract, secType="FUT", exchange="NYMEX")
-        order = MarketOrder(order_type, volume)
-        margin = await self.ib.whatIfOrderAsync(contract, order)
-        return float(margin.initMarginChange), float(margin.maintMarginChange)
-
-
+        if isinstance(contract, str):
+            contract = self.contracts[self.symbols.index(contract)]
+        return await self.check_margin_batch([(contract, volume if order_type == "Buy" else -volume)])
+
+# pre-trade margin check for a batch of (contract, signed volume). A real what-if is sent only near the limit
+    async def check_margin_batch(self, orders):
+        orders = list(orders)
+        if not orders:
+            return True
+        await self.load_metadata({contract.localSymbol: contract for contract, _ in orders}.values())
+        status, required = self.margin_estimator.check_batch([(contract.localSymbol, volume) for contract, volume in orders], self.positions)
+        if status == MARGIN_OK:
+            return True
+        if status == MARGIN_INSUFFICIENT:
+            print(f"{datetime.now()}: IB margin check failed, estimated margin required {required}, available funds {self.metadata.account.free_margin}")
+            return False
+        contracts = {contract.localSymbol: contract for contract, _ in orders}
+        lots = {symbol: volume for symbol, volume in worst_side([(contract.localSymbol, volume) for contract, volume in orders], self.positions).items() if volume != 0}
+        order_states = await asyncio.gather(*(self.ib.whatIfOrderAsync(contracts[symbol], MarketOrder("BUY" if volume > 0 else "SELL", abs(volume)))
+                                              for symbol, volume in lots.items()))
+        account = self._account_meta()
+        changes = [self._margin_value(order_state.initMarginChange) if order_state is not None else None for order_state in order_states]
+        if account is None or any(change is None for change in changes):
+            return False
+        print(f"{datetime.now()}: IB what-if margin check: required {sum(changes)}, available funds {account.free_margin}")
+        return account.free_margin >= sum(changes)
+
+
+# resync positions with ib.positions() (kept by ib_insync from IB pushes, no round trip)
     def load_positions(self,symbols):
-        
-        # Initialize self.positions[symbol] to 0 for all symbols
-        for symbol in symbols:
-            self.positions[symbol] = 0
-
-        # Request all open positions
-        ib_positions = self.ib.positions()
+        self.position_book.apply_snapshot(self.ib.positions(), symbols)
 
-        # Filter the positions for the symbols of interest
-        for position in ib_positions:
-            symbol = position.contract.localSymbol
-            if symbol in symbols:
-                # Use localSymbol as a unique key
-                self.positions[symbol] = position.position
+# wait until the position of the contract equals target. Returns False on timeout
+    async def wait_position(self, symbol, target, timeout):
+        try:
+            await asyncio.wait_for(self.position_book.add_waiter(symbol, target), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
 
     async def run(self):
-        for contract in self.contracts:
-            await self.subscribe_bid_ask(contract)
-
         self.ib.pendingTickersEvent  += self.on_pending_tickers
+        await self.subscribe_many()
 
         while True:
             await asyncio.sleep(1)
@@ -0,0 +1,74 @@
+# position_book.py
+# IB positions kept live from ib_insync pushes. positionEvent (and the ib.positions() snapshot built from it) is the
+# only source of positions and of waiter results: IB does not order it against execDetailsEvent, so a fill may arrive
+# before or after the position that already includes it. Executions are kept apart as provisional deltas since the
+# last position update of the contract (dropped by it), for an early view of fills only.
+# Each contract has a version and waiters for "position reached X"
+import asyncio
+from collections import deque
+
+
+class PositionBook:
+    def __init__(self, symbols, positions, seen_executions = 1000):
+        self.symbols = set(symbols)
+        self.positions = positions # localSymbol : position, shared with NymexAsyncWrapper.positions
+        self.versions = {symbol: 0 for symbol in symbols} # incremented on every change of the position
+        self.provisional = {symbol: {} for symbol in symbols} # localSymbol : {execId : signed shares} since the last position update
+        self.waiters = [] # (symbol, target, future)
+        self.seen = set() # execIds already applied, bounded by the order below
+        self.seen_order = deque(maxlen=seen_executions)
+
+    def _set(self, symbol, position):
+        self.provisional.setdefault(symbol, {}).clear() # the position update includes the fills reported so far
+        if self.positions.get(symbol) != position:
+            self.positions[symbol] = position
+            self.versions[symbol] += 1
+            if self.waiters:
+                self.waiters = [(name, target, future) for name, target, future in self.waiters
+                                if not future.done() and not self._resolve(name, target, future)]
+
+# ib.positions() snapshot (or positionEvent items)
+    def apply_snapshot(self, ib_positions, symbols = None):
+        symbols = self.symbols if symbols is None else set(symbols)
+        volumes = {symbol: 0 for symbol in symbols}
+        for position in ib_positions:
+            if position.contract.localSymbol in volumes:
+                volumes[position.contract.localSymbol] = position.position
+        for symbol, volume in volumes.items():
+            self._set(symbol, volume)
+
+    def on_position(self, position):
+        symbol = position.contract.localSymbol
+        if symbol in self.symbols:
+            self._set(symbol, position.position)
+
+# execDetailsEvent(trade, fill). Corrections and repeated reports carry the same execId and are skipped
+    def on_execution(self, trade, fill):
+        symbol = fill.contract.localSymbol
+        exec_id = fill.execution.execId
+        if symbol not in self.symbols or exec_id in self.seen:
+            return
+        if len(self.seen_order) == self.seen_order.maxlen:
+            self.seen.discard(self.seen_order[0])
+        self.seen_order.append(exec_id)
+        self.seen.add(exec_id)
+        shares = fill.execution.shares
+        self.provisional[symbol][exec_id] = shares if fill.execution.side == "BOT" else -shares
+
+# position with the fills reported since the last position update. May count a fill twice until the next update,
+# if its execution came after a position that already included it: not for trading decisions
+    def provisional_position(self, symbol):
+        return self.positions.get(symbol, 0) + sum(self.provisional[symbol].values())
+
+    def _resolve(self, symbol, target, future):
+        if round(self.positions.get(symbol, 0) - target) == 0:
+            future.set_result(True)
+            return True
+        return False
+
+# future resolved once the position of symbol equals target
+    def add_waiter(self, symbol, target):
+        future = asyncio.get_running_loop().create_future()
+        if not self._resolve(symbol, target, future):
+            self.waiters.append((symbol, target, future))
+        return future
@@ -0,0 +1 @@
+from .board import QuoteBoard, QuoteBoardReader, Quote
\ No newline at end of file
@@ -0,0 +1,130 @@
+# board.py
+# latest quotes of all instruments in shared memory (multiprocessing.shared_memory), readable by other processes
+# (dashboards, recorders, analytics) without any IPC call to the trading process.
+# Layout: header | instrument names | one 64 byte slot per instrument (seq, time, bid, ask, deep_bid, deep_ask).
+# Each slot is a seqlock with a single writer: seq is odd while the slot is written, so a reader retries if seq was
+# odd or changed while it read the slot. Readers never block the writer. Each instrument must be written by one
+# process only (main process, or the shard trading it).
+# Only numpy and the standard library are imported here, so readers don't load the trading stack
+import sys
+import time
+from collections import namedtuple
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+MAGIC = 0x51424F44 # "QBOD"
+VERSION = 1
+NAME_SIZE = 32 # bytes per instrument name
+HEADER_DTYPE = np.dtype([("magic", "u4"), ("version", "u4"), ("slots", "u4"), ("slot_size", "u4")])
+SLOT_DTYPE = np.dtype({"names": ["seq", "time", "bid", "ask", "deep_bid", "deep_ask"],
+                       "formats": ["u8", "f8", "f8", "f8", "f8", "f8"],
+                       "offsets": [0, 8, 16, 24, 32, 40],
+                       "itemsize": 64}) # one cache line per slot
+
+Quote = namedtuple("Quote", ["seq", "time", "bid", "ask", "deep_bid", "deep_ask"])
+
+
+def _slots_offset(slots):
+    offset = HEADER_DTYPE.itemsize + NAME_SIZE * slots
+    return (offset + 63) // 64 * 64
+
+
+def board_size(slots):
+    return _slots_offset(slots) + SLOT_DTYPE.itemsize * slots
+
+
+# attached (not created) blocks must not be unlinked by this process's resource tracker on exit (POSIX).
+# Child processes (shards) share the tracker of the process that created the block, nothing to undo there
+def _untrack(memory):
+    if sys.platform != "win32" and multiprocessing.parent_process() is None:
+        from multiprocessing import resource_tracker
+        try:
+            resource_tracker.unregister(memory._name, "shared_memory")
+        except Exception:
+            pass
+
+
+class QuoteBoard:
+    # instruments: create the board (this process owns it and unlinks it on close). None: attach to an existing one
+    def __init__(self, name, instruments = None):
+        if instruments is None:
+            self.memory = shared_memory.SharedMemory(name=name)
+            _untrack(self.memory)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=board_size(len(instruments)))
+            self._format(instruments)
+        self.owner = instruments is not None
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.memory.buf)
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError(f"{name} is not a quote board")
+        slots = int(header["slots"])
+        names = np.ndarray(slots, dtype=f"S{NAME_SIZE}", buffer=self.memory.buf, offset=HEADER_DTYPE.itemsize)
+        self.instruments = [name.decode() for name in names.tolist()]
+        self.index = {name: i for i, name in enumerate(self.instruments)}
+        self.slots = np.ndarray(slots, dtype=SLOT_DTYPE, buffer=self.memory.buf, offset=_slots_offset(slots))
+        # field views, to avoid a record lookup per access
+        self.seq = self.slots["seq"]
+        self.time = self.slots["time"]
+        self.bid = self.slots["bid"]
+        self.ask = self.slots["ask"]
+        self.deep_bid = self.slots["deep_bid"]
+        self.deep_ask = self.slots["deep_ask"]
+
+    def _format(self, instruments):
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.memory.buf)
+        header[()] = (MAGIC, VERSION, len(instruments), SLOT_DTYPE.itemsize)
+        names = np.ndarray(len(instruments), dtype=f"S{NAME_SIZE}", buffer=self.memory.buf, offset=HEADER_DTYPE.itemsize)
+        names[:] = [instrument.encode() for instrument in instruments]
+        slots = np.ndarray(len(instruments), dtype=SLOT_DTYPE, buffer=self.memory.buf, offset=_slots_offset(len(instruments)))
+        slots[:] = (0, np.nan, np.nan, np.nan, np.nan, np.nan)
+
+# writer side. Instruments not on the board are ignored
+    def update(self, instrument, bid, ask, deep_bid = np.nan, deep_ask = np.nan, now = None):
+        i = self.index.get(instrument)
+        if i is None:
+            return
+        now = time.time() if now is None else now
+        self.seq[i] += 1 # odd: write in progress
+        self.time[i] = now
+        self.bid[i] = bid
+        self.ask[i] = ask
+        self.deep_bid[i] = deep_bid
+        self.deep_ask[i] = deep_ask
+        self.seq[i] += 1
+
+    def close(self):
+        # views into the buffer must be released before closing it
+        self.slots = self.seq = self.time = self.bid = self.ask = self.deep_bid = self.deep_ask = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# reader library for other processes: QuoteBoardReader(QUOTE_BOARD_NAME).read("NGQ3")
+class QuoteBoardReader(QuoteBoard):
+    def __init__(self, name):
+        super().__init__(name)
+
+# consistent copy of the instrument's slot, None if never written. Retries while the writer is in the slot
+    def read(self, instrument):
+        i = self.index[instrument]
+        seq = self.seq
+        while True:
+            before = int(seq[i])
+            if before & 1:
+                time.sleep(0)
+                continue
+            quote = Quote(before, float(self.time[i]), float(self.bid[i]), float(self.ask[i]), float(self.deep_bid[i]), float(self.deep_ask[i]))
+            if int(seq[i]) == before:
+                return quote if before else None
+
+    def read_all(self):
+        return {instrument: self.read(instrument) for instrument in self.instruments}
+
+# sequence numbers of all slots (a view, no copy): compare with a previous copy to find changed instruments
+    def sequences(self):
+        return self.seq
+
+    def changed(self, instrument, seq):
+        return int(self.seq[self.index[instrument]]) != seq
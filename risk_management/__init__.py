@@ -0,0 +1,2 @@
+from .metadata_cache import MetadataCache, InstrumentMeta, AccountMeta
+from .margin_estimator import MarginEstimator
\ No newline at end of file
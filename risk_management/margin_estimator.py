@@ -0,0 +1,57 @@
+# margin_estimator.py
+# local pre-trade margin check for a batch of orders using cached margins per lot and free margin.
+# a real what-if call is only needed if the estimate is close to the limit
+
+MARGIN_OK = "ok"
+MARGIN_INSUFFICIENT = "insufficient"
+MARGIN_NEAR_LIMIT = "near_limit" # confirm with the venue
+MARGIN_UNKNOWN = "unknown" # metadata missing, confirm with the venue
+
+
+# lots that add to the position if every order of the batch fills, worst side per symbol: {symbol : signed lots}
+# (positive - buys grow the position most). Grid orders sit on both sides, so only that side needs margin.
+# Shared by the estimate and the venue confirmation, so both net the batch the same way
+def worst_side(orders, positions):
+    buys, sells = {}, {}
+    for symbol, volume in orders:
+        if volume > 0:
+            buys[symbol] = buys.get(symbol, 0) + volume
+        else:
+            sells[symbol] = sells.get(symbol, 0) - volume
+    lots = {}
+    for symbol in set(buys) | set(sells):
+        position = positions.get(symbol, 0)
+        long_side, short_side = abs(position + buys.get(symbol, 0)), abs(position - sells.get(symbol, 0))
+        if long_side >= short_side:
+            lots[symbol] = max(long_side - abs(position), 0)
+        else:
+            lots[symbol] = -max(short_side - abs(position), 0)
+    return lots
+
+
+class MarginEstimator:
+    def __init__(self, cache, safety_buffer):
+        self.cache = cache # MetadataCache of the venue
+        self.safety_buffer = safety_buffer # share of free margin treated as "close to the limit"
+
+# extra initial margin if every order of the batch fills, worst side per symbol.
+# orders: iterable of (symbol, signed volume) - positive buys, negative sells. positions: symbol : signed position
+    def required_margin(self, orders, positions):
+        required = 0.0
+        for symbol, lots in worst_side(orders, positions).items():
+            meta = self.cache.instrument(symbol)
+            if meta is None:
+                return None
+            required += abs(lots) * meta.initial_margin
+        return required
+
+    def check_batch(self, orders, positions):
+        account = self.cache.account_meta()
+        required = self.required_margin(orders, positions)
+        if account is None or required is None:
+            return MARGIN_UNKNOWN, required
+        if required > account.free_margin:
+            return MARGIN_INSUFFICIENT, required
+        if required > account.free_margin * (1 - self.safety_buffer):
+            return MARGIN_NEAR_LIMIT, required
+        return MARGIN_OK, required
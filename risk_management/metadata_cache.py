@@ -0,0 +1,73 @@
+# metadata_cache.py
+# per-venue cache of instrument metadata (tick size, decimals, contract size, margins per lot) and account margin,
+# with TTL based refresh and invalidation on fills
+import time
+
+
+class InstrumentMeta:
+    __slots__ = ("symbol", "tick_size", "decimals", "contract_size", "initial_margin", "maintenance_margin", "updated")
+
+    def __init__(self, symbol, tick_size, decimals, contract_size, initial_margin, maintenance_margin):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.decimals = decimals
+        self.contract_size = contract_size
+        self.initial_margin = initial_margin # per lot
+        self.maintenance_margin = maintenance_margin # per lot
+        self.updated = time.monotonic()
+
+    def __repr__(self):
+        return f"InstrumentMeta({self.symbol}, tick={self.tick_size}, contract={self.contract_size}, initial={self.initial_margin}, maintenance={self.maintenance_margin})"
+
+
+class AccountMeta:
+    __slots__ = ("free_margin", "margin", "equity", "updated")
+
+    def __init__(self, free_margin, margin, equity):
+        self.free_margin = free_margin
+        self.margin = margin
+        self.equity = equity
+        self.updated = time.monotonic()
+
+    def __repr__(self):
+        return f"AccountMeta(free_margin={self.free_margin}, margin={self.margin}, equity={self.equity})"
+
+
+class MetadataCache:
+    def __init__(self, instrument_ttl, account_ttl):
+        self.instrument_ttl = instrument_ttl # seconds, margins per lot change rarely
+        self.account_ttl = account_ttl # seconds, free margin moves with prices
+        self.instruments = {} # symbol : InstrumentMeta
+        self.account = None
+
+# fresh entry or None if missing / expired
+    def instrument(self, symbol, now = None):
+        meta = self.instruments.get(symbol)
+        now = time.monotonic() if now is None else now
+        if meta is None or now - meta.updated > self.instrument_ttl:
+            return None
+        return meta
+
+    def account_meta(self, now = None):
+        now = time.monotonic() if now is None else now
+        if self.account is None or now - self.account.updated > self.account_ttl:
+            return None
+        return self.account
+
+    def put_instrument(self, meta):
+        self.instruments[meta.symbol] = meta
+
+    def put_account(self, account):
+        self.account = account
+
+# fills change used / free margin: drop the account entry only, instrument metadata does not depend on positions
+    def invalidate_account(self):
+        self.account = None
+
+# drop the account entry and the metadata of the symbol (None drops all)
+    def invalidate(self, symbol = None):
+        self.account = None
+        if symbol is None:
+            self.instruments.clear()
+        else:
+            self.instruments.pop(symbol, None)
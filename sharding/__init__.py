@@ -0,0 +1,2 @@
+from .coordinator import ShardCoordinator
+from .shard import ShardWorker, run_shard
\ No newline at end of file
@@ -0,0 +1,191 @@
+# coordinator.py
+# thin main process of the sharded runtime: starts a shard process per group of symbol pairs, forwards Telegram
+# commands to the shard owning the symbol, relays shard notifications to the bot and runs the trading hours scheduler.
+# Exposes the strategy methods used by TelegramBot, so the bot works with either
+import asyncio
+import itertools
+import multiprocessing
+from datetime import datetime
+from config import SHARD_START_TIMEOUT, SHARD_COMMAND_TIMEOUT
+from sharding.ipc import Channel, MSG_COMMAND, MSG_REPLY, MSG_NOTIFY, MSG_READY, MSG_CLOSED
+from sharding.shard import run_shard
+
+
+class ShardHandle:
+    def __init__(self, index, symbols):
+        self.index = index
+        self.symbols = symbols
+        self.process = None
+        self.channel = None
+        self.pid = None
+        self.ready = None # future, set on MSG_READY
+        self.pending = {} # command id : future of the reply
+        self.alive = False
+
+
+class ShardCoordinator:
+    def __init__(self, shards):
+        self.shards = [ShardHandle(index, symbols) for index, symbols in enumerate(shards)]
+        self.shard_of = {symbol: shard for shard in self.shards for symbol in shard.symbols}
+        self.symbols = list(self.shard_of)
+        self.command_ids = itertools.count(1)
+        self.active = set() # symbols started and not stopped, for the scheduler
+        self.listeners = []
+        self.scheduler_on = False
+        self.bot = None
+
+    async def start(self, timeout = SHARD_START_TIMEOUT):
+        context = multiprocessing.get_context("spawn") # same on Windows (MT5) and elsewhere
+        loop = asyncio.get_running_loop()
+        for shard in self.shards:
+            parent_connection, child_connection = context.Pipe()
+            # not daemonic: at exit the coordinator waits for the shards (they stop trading when it is gone) instead of killing them
+            shard.process = context.Process(target=run_shard, args=(shard.index, shard.symbols, child_connection), name=f"shard-{shard.index}")
+            shard.process.start()
+            child_connection.close()
+            shard.channel = Channel(parent_connection)
+            shard.channel.start()
+            shard.ready = loop.create_future()
+            self.listeners.append(asyncio.create_task(self.listen(shard)))
+        await asyncio.wait_for(asyncio.gather(*[shard.ready for shard in self.shards]), timeout)
+        print(f"{datetime.now()}: shards started: " + ", ".join(f"{shard.index} {shard.symbols} pid {shard.pid}" for shard in self.shards))
+
+    async def listen(self, shard):
+        while True:
+            message = await shard.channel.recv()
+            if message["type"] == MSG_READY:
+                shard.pid = message["pid"]
+                shard.alive = True
+                if not shard.ready.done():
+                    shard.ready.set_result(True)
+            elif message["type"] == MSG_REPLY:
+                future = shard.pending.pop(message["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+            elif message["type"] == MSG_NOTIFY:
+                self.notify(message["text"])
+            elif message["type"] == MSG_CLOSED:
+                shard.alive = False
+                self.active.difference_update(shard.symbols)
+                for future in shard.pending.values():
+                    if not future.done():
+                        future.set_result({"ok": False, "result": "shard stopped"})
+                shard.pending.clear()
+                if not shard.ready.done():
+                    shard.ready.set_exception(RuntimeError(f"shard {shard.index} {shard.symbols} exited while starting"))
+                print(f"{datetime.now()}: shard {shard.index} {shard.symbols} stopped")
+                self.notify(f"shard {shard.index} {shard.symbols} stopped")
+                return
+
+# send a command and wait for its reply. Returns (ok, result)
+    async def request(self, shard, name, *args, timeout = SHARD_COMMAND_TIMEOUT):
+        if not shard.alive:
+            return False, f"shard {shard.index} {shard.symbols} is not running"
+        command_id = next(self.command_ids)
+        future = asyncio.get_running_loop().create_future()
+        shard.pending[command_id] = future
+        shard.channel.send({"type": MSG_COMMAND, "id": command_id, "name": name, "args": args})
+        try:
+            reply = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            shard.pending.pop(command_id, None)
+            return False, f"shard {shard.index} {shard.symbols}: no reply to {name} in {timeout} seconds"
+        return reply["ok"], reply["result"]
+
+    async def request_all(self, name, *args):
+        return await asyncio.gather(*[self.request(shard, name, *args) for shard in self.shards])
+
+# strategy interface (TelegramBot)
+    async def start_grid_trading(self, symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose):
+        await self.start_symbol("grid", symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose)
+
+    async def start_limit_trading(self, symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose):
+        await self.start_symbol("limit_grid", symbol, spread_step, pose_step, number_of_steps, mid_spread, mid_pose)
+
+    async def start_symbol(self, name, symbol, *args):
+        if symbol not in self.shard_of:
+            self.notify(f"{symbol} is not traded by any shard")
+            return
+        ok, result = await self.request(self.shard_of[symbol], name, symbol, *args)
+        if not ok:
+            self.notify(f"{symbol} {name} not started: {result}")
+            return
+        self.active.add(symbol)
+        if not self.scheduler_on:
+            asyncio.create_task(self.scheduler())
+
+    async def stop_trading(self, symbol = None):
+        if symbol is None:
+            results = await self.request_all("stop")
+            self.active.clear()
+        elif symbol in self.shard_of:
+            results = [await self.request(self.shard_of[symbol], "stop", symbol)]
+            self.active.discard(symbol)
+        else:
+            results = [(False, f"{symbol} is not traded by any shard")]
+        for ok, result in results:
+            if not ok:
+                self.notify(f"stop_trading: {result}")
+
+    def set_timeout(self, timeout):
+        for shard in self.shards:
+            asyncio.create_task(self.request(shard, "set_timeout", timeout))
+
+    def set_risk_coef(self, risk_coef):
+        for shard in self.shards:
+            asyncio.create_task(self.request(shard, "set_risk_coef", risk_coef))
+
+    async def recentre(self, symbol, mid_spread, mid_pose):
+        if symbol not in self.shard_of:
+            return f"{symbol} is not traded by any shard"
+        ok, result = await self.request(self.shard_of[symbol], "recentre", symbol, mid_spread, mid_pose)
+        return result
+
+    async def status(self):
+        lines = []
+        for shard, (ok, result) in zip(self.shards, await self.request_all("status")):
+            lines.append(f"shard {shard.index} (pid {shard.pid}):")
+            lines.append(result if ok else f"  {result}")
+        return "\n".join(lines)
+
+    def set_bot(self, bot):
+        self.bot = bot
+
+    def notify(self, message):
+        if self.bot is not None:
+            asyncio.create_task(self.bot.send_message(message))
+
+# stop trading in all shards outside working hours (see MeanReversionStrategy.scheduler, not run in shards)
+    async def scheduler(self):
+        now = datetime.now()
+        stop_time = now.replace(hour = 23, minute = 45, second = 0, microsecond=0)  # 23:45 UTC
+        start_time = now.replace(hour = 9, minute = 0, second = 1, microsecond=0)  # 9:01:05 UTC
+        print(f"{datetime.now()}: starting scheduler. start_time = {start_time.time()}. stop_time = {stop_time.time()}")
+        self.notify(f"starting scheduler. start_time = {start_time.time()}. stop_time = {stop_time.time()}")
+        self.scheduler_on = True
+        while self.scheduler_on and self.active:
+            current_time = datetime.now()
+            if not (start_time <= current_time < stop_time):
+                print(f"{datetime.now()}: time outside the working hours")
+                self.scheduler_on = False
+                await self.stop_trading()
+            await asyncio.sleep(180)  # Check every 3 minutes
+        self.scheduler_on = False
+        print(f"{datetime.now()}: scheduler stopped at {datetime.now().time()}")
+        self.notify(f"scheduler stopped at {datetime.now().time().replace(microsecond=0)}")
+
+# runs until all shards exit
+    async def run(self):
+        await asyncio.gather(*self.listeners)
+
+# shards stop trading (open MOEX orders cancelled) and exit; terminated only if they don't exit in time
+    async def shutdown(self, timeout = SHARD_COMMAND_TIMEOUT):
+        self.scheduler_on = False
+        await self.request_all("shutdown")
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            await asyncio.to_thread(shard.process.join, timeout)
+            if shard.process.is_alive():
+                print(f"{datetime.now()}: shard {shard.index} {shard.symbols} did not exit in {timeout} seconds, terminating")
+                shard.process.terminate()
@@ -0,0 +1,53 @@
+# ipc.py
+# message channel between the coordinator and a shard process over a multiprocessing Pipe.
+# Messages are small dicts {"type": ..., ...}. recv() blocks in a reader thread and hands messages to the event loop,
+# so the loop is never blocked (and it works with the Windows proactor loop, which has no add_reader)
+import asyncio
+import threading
+
+MSG_COMMAND = "command" # coordinator -> shard: {"id", "name", "args"}
+MSG_REPLY = "reply" # shard -> coordinator: {"id", "ok", "result"}
+MSG_NOTIFY = "notify" # shard -> coordinator: {"text"} for the Telegram bot
+MSG_READY = "ready" # shard -> coordinator: connectors initialized {"symbols", "pid"}
+MSG_CLOSED = "closed" # put locally when the other side of the pipe is gone
+
+
+class Channel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock() # send is called from the loop and from the strategy's notify tasks
+        self.messages = None
+        self.reader = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.messages = asyncio.Queue()
+        self.reader = threading.Thread(target=self._read, args=(loop,), daemon=True)
+        self.reader.start()
+
+    def _read(self, loop):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                message = {"type": MSG_CLOSED}
+            try:
+                loop.call_soon_threadsafe(self.messages.put_nowait, message)
+            except RuntimeError: # loop closed
+                return
+            if message["type"] == MSG_CLOSED:
+                return
+
+    def send(self, message):
+        with self.lock:
+            try:
+                self.connection.send(message)
+                return True
+            except (OSError, EOFError, BrokenPipeError):
+                return False
+
+    async def recv(self):
+        return await self.messages.get()
+
+    def close(self):
+        self.connection.close()
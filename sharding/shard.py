@@ -0,0 +1,110 @@
+# shard.py
+# shard process: own MOEX (MT5) and IB connections, database handler and MeanReversionStrategy for a group of
+# symbol pairs, driven by commands from the coordinator. Strategy notifications go back to the coordinator's bot
+import asyncio
+import os
+import signal
+from datetime import datetime
+from config import INTERFACE_SYMBOLS, MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS
+from config import NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS, SHARD_IB_CLIENT_ID_BASE, QUOTE_BOARD_NAME
+from config import TICK_RECORDER_DIRECTORY, TICK_RECORDER_BOOK_DEPTH, TICK_RECORDER_CHUNK_RECORDS
+from sharding.ipc import Channel, MSG_COMMAND, MSG_REPLY, MSG_NOTIFY, MSG_READY, MSG_CLOSED
+
+
+# process target (module level, so it can be started with the spawn method).
+# Ctrl+C reaches the whole process group: only the coordinator handles it and shuts the shards down in order
+def run_shard(index, symbols, connection):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(ShardWorker(index, symbols, Channel(connection)).run())
+
+
+# stands in for the Telegram bot inside the shard (strategy.set_bot)
+class ShardNotifier:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send_message(self, message):
+        self.channel.send({"type": MSG_NOTIFY, "text": message})
+
+
+class ShardWorker:
+    def __init__(self, index, symbols, channel):
+        self.index = index
+        self.symbols = symbols # INTERFACE_SYMBOLS of the shard
+        self.channel = channel
+        self.strategy = None
+
+    async def initialize(self):
+        # imported here: the coordinator process never loads the connectors
+        from moex_connection import MoexAsyncWrapper
+        from nymex_connection import NymexAsyncWrapper
+        from data_processing import MeanReversionStrategy
+        from database import DatabaseHandler, TickRecorder
+        from quote_board import QuoteBoard
+
+        positions = [INTERFACE_SYMBOLS.index(symbol) for symbol in self.symbols]
+        db_handler = DatabaseHandler()
+        await db_handler.wait_until_ready()
+        moex_conn = MoexAsyncWrapper(MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, [MOEX_SYMBOLS[i] for i in positions], [MOEX_LOTS[i] for i in positions])
+        await moex_conn.initialize()
+        nymex_conn = NymexAsyncWrapper(SHARD_IB_CLIENT_ID_BASE + self.index, NYMEX_HOST, NYMEX_PORT, [NYMEX_CONTRACTS[i] for i in positions])
+        await nymex_conn.initialize()
+        # board created by the coordinator's process, the shard writes the slots of its own instruments
+        quote_board = QuoteBoard(QUOTE_BOARD_NAME) if QUOTE_BOARD_NAME else None
+        # files are per symbol, so shards record side by side into the same directory
+        recorder = TickRecorder(TICK_RECORDER_DIRECTORY, TICK_RECORDER_BOOK_DEPTH, TICK_RECORDER_CHUNK_RECORDS) if TICK_RECORDER_DIRECTORY else None
+        self.strategy = MeanReversionStrategy(moex_conn, nymex_conn, db_handler, symbols = self.symbols, scheduler = False, quote_board = quote_board, recorder = recorder)
+        self.strategy.set_bot(ShardNotifier(self.channel))
+
+    async def run(self):
+        self.channel.start()
+        print(f"{datetime.now()}: shard {self.index} {self.symbols} starting, pid {os.getpid()}")
+        await self.initialize()
+        asyncio.create_task(self.strategy.run())
+        self.channel.send({"type": MSG_READY, "symbols": self.symbols, "pid": os.getpid()})
+        while True:
+            message = await self.channel.recv()
+            if message["type"] == MSG_CLOSED:
+                print(f"{datetime.now()}: shard {self.index}: coordinator is gone, stopping trading")
+                await self.strategy.stop_trading()
+                break
+            if message["type"] == MSG_COMMAND:
+                if message["name"] == "shutdown":
+                    await self.strategy.stop_trading()
+                    self.channel.send({"type": MSG_REPLY, "id": message["id"], "ok": True, "result": None})
+                    break
+                asyncio.create_task(self.execute(message))
+        self.channel.close()
+        if self.strategy.quote_board is not None:
+            self.strategy.quote_board.close()
+        if self.strategy.recorder is not None:
+            self.strategy.recorder.close()
+        await self.strategy.moex_connector.close()
+        print(f"{datetime.now()}: shard {self.index} stopped")
+
+# commands are run as tasks: start_*_trading return only when trading stops, so they are answered once started
+    async def execute(self, message):
+        name, args = message["name"], message["args"]
+        try:
+            if name == "grid":
+                asyncio.create_task(self.strategy.start_grid_trading(*args))
+                result = None
+            elif name == "limit_grid":
+                asyncio.create_task(self.strategy.start_limit_trading(*args))
+                result = None
+            elif name == "stop":
+                result = await self.strategy.stop_trading(*args)
+            elif name == "set_timeout":
+                result = self.strategy.set_timeout(*args)
+            elif name == "set_risk_coef":
+                result = self.strategy.set_risk_coef(*args)
+            elif name == "recentre":
+                result = await self.strategy.recentre(*args)
+            elif name == "status":
+                result = await self.strategy.status()
+            else:
+                raise ValueError(f"unknown command {name}")
+            self.channel.send({"type": MSG_REPLY, "id": message["id"], "ok": True, "result": result})
+        except Exception as e:
+            print(f"{datetime.now()}: shard {self.index} command {name} failed: {e}")
+            self.channel.send({"type": MSG_REPLY, "id": message["id"], "ok": False, "result": str(e)})
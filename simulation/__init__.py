@@ -0,0 +1,2 @@
+from .fake_mt5 import FakeMetaTrader5, SymbolSpec, install_fake_mt5
+from .fake_ib import FakeIB
\ No newline at end of file
@@ -0,0 +1,54 @@
+# book_process.py
+# synthetic market around a random-walk mid price: keeps a ladder of synthetic limit orders on both sides
+# and sends synthetic market orders that trade through the book (and fill user orders standing at the top)
+import itertools
+import numpy as np
+from simulation.matching_engine import SimOrder, SIDE_BUY, SIDE_SELL
+
+
+class SyntheticBookProcess:
+    def __init__(self, symbol, mid, tick, levels = 20, level_volume = (1, 200), volatility = 2.0,
+                 trade_rate = 2.0, trade_volume = (1, 100), half_spread_ticks = 1, seed = None):
+        self.symbol = symbol
+        self.mid = mid
+        self.tick = tick
+        self.levels = levels # per side
+        self.level_volume = level_volume # synthetic volume per level, uniform integer range
+        self.volatility = volatility # mid price standard deviation in ticks per second
+        self.trade_rate = trade_rate # synthetic market orders per second
+        self.trade_volume = trade_volume
+        self.half_spread_ticks = half_spread_ticks
+        self.rng = np.random.default_rng(seed)
+        self.synthetic = ({}, {}) # side : {price : ticket} of the synthetic orders in the book
+        self._tickets = itertools.count(-1, -1) # synthetic orders have negative tickets
+
+# advance the market by dt seconds. Returns fills produced (user orders may be among them)
+    def step(self, book, dt, time_msc):
+        ticks = self.rng.normal(0, self.volatility * np.sqrt(dt))
+        self.mid = self.mid + round(ticks) * self.tick
+        fills = self.requote(book, time_msc)
+        for _ in range(self.rng.poisson(self.trade_rate * dt)):
+            side = SIDE_BUY if self.rng.random() < 0.5 else SIDE_SELL
+            volume = float(self.rng.integers(self.trade_volume[0], self.trade_volume[1] + 1))
+            fills += book.add(SimOrder(next(self._tickets), self.symbol, side, None, volume, user=False, time_msc=time_msc))
+        return fills
+
+# move the synthetic ladder to the current mid. Levels that stay keep their queue position
+    def requote(self, book, time_msc):
+        fills = []
+        for side in (SIDE_BUY, SIDE_SELL):
+            sign = -1 if side == SIDE_BUY else 1
+            wanted = {book.round(self.mid + sign * (self.half_spread_ticks + i) * self.tick) for i in range(self.levels)}
+            current = self.synthetic[side]
+            for price in list(current):
+                if price not in wanted or current[price] not in book.orders:
+                    book.cancel(current.pop(price))
+            for price in sorted(wanted, reverse=(side == SIDE_BUY)): # best prices first
+                if price in current:
+                    continue
+                volume = float(self.rng.integers(self.level_volume[0], self.level_volume[1] + 1))
+                order = SimOrder(next(self._tickets), self.symbol, side, price, volume, user=False, time_msc=time_msc)
+                fills += book.add(order) # crossing user orders get filled by the new synthetic level
+                if order.ticket in book.orders:
+                    current[price] = order.ticket
+        return fills
@@ -0,0 +1,331 @@
+# fake_ib.py
+# in-process stand-in for the ib_insync.IB surface used by NymexAsyncWrapper: connection, contract qualification,
+# bid / ask tickers streamed at a configurable rate, market orders with PendingSubmit -> Submitted -> Filled
+# transitions after configurable latencies, execution / position pushes, positions and what-if margins.
+#   nymex_conn = NymexAsyncWrapper(NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS, ib=FakeIB(tick_rate=1000))
+import asyncio
+import itertools
+import math
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+import numpy as np
+
+# records with the fields of their ib_insync counterparts that the connectors read
+ContractDetails = namedtuple("ContractDetails", ["contract", "minTick", "marketName"])
+OrderState = namedtuple("OrderState", ["status", "initMarginChange", "maintMarginChange", "equityWithLoanChange", "commission"])
+AccountValue = namedtuple("AccountValue", ["account", "tag", "value", "currency", "modelCode"])
+Position = namedtuple("Position", ["account", "contract", "position", "avgCost"])
+Execution = namedtuple("Execution", ["execId", "time", "acctNumber", "side", "shares", "price", "orderId", "cumQty", "avgPrice"])
+Fill = namedtuple("Fill", ["contract", "execution", "commissionReport", "time"])
+
+ACCOUNT = "DU0000000"
+DEFAULT_MIDS = {"NG": 2.6, "MGC": 1950.0, "GC": 1950.0, "BZ": 75.0, "CL": 75.0}
+DEFAULT_MARGIN_RATE = 0.1
+
+
+class Event:
+    # the part of eventkit.Event used here: += / -= handlers and emit
+    def __init__(self, name = ""):
+        self.name = name
+        self.handlers = []
+
+    def connect(self, handler):
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+        return self
+
+    def disconnect(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+        return self
+
+    __iadd__ = connect
+    __isub__ = disconnect
+
+    def emit(self, *args):
+        for handler in list(self.handlers):
+            handler(*args)
+
+    def __len__(self):
+        return len(self.handlers)
+
+
+class Ticker:
+    def __init__(self, contract):
+        self.contract = contract
+        self.time = None
+        self.bid = math.nan
+        self.ask = math.nan
+        self.bidSize = math.nan
+        self.askSize = math.nan
+        self.last = math.nan
+        self.tickByTicks = []
+        self.updateEvent = Event("updateEvent")
+
+    def __repr__(self):
+        return f"Ticker({self.contract.localSymbol}, bid={self.bid}, ask={self.ask})"
+
+
+class OrderStatus:
+    def __init__(self, order_id, quantity):
+        self.orderId = order_id
+        self.status = "PendingSubmit"
+        self.filled = 0.0
+        self.remaining = quantity
+        self.avgFillPrice = 0.0
+
+
+class Trade:
+    def __init__(self, contract, order):
+        self.contract = contract
+        self.order = order
+        self.orderStatus = OrderStatus(order.orderId, order.totalQuantity)
+        self.fills = []
+        self.log = []
+        self.statusEvent = Event("statusEvent")
+        self.fillEvent = Event("fillEvent")
+        self.filledEvent = Event("filledEvent")
+        self.cancelledEvent = Event("cancelledEvent")
+
+    def isDone(self):
+        return self.orderStatus.status in ("Filled", "Cancelled", "ApiCancelled", "Inactive")
+
+
+class _Market:
+    # random-walk mid with a fixed half spread, per contract
+    def __init__(self, mid, tick, half_spread_ticks, volatility, rng):
+        self.mid = mid
+        self.tick = tick
+        self.half_spread = half_spread_ticks * tick
+        self.volatility = volatility # ticks per second
+        self.rng = rng
+
+    def step(self, dt):
+        self.mid += round(self.rng.normal(0, self.volatility * math.sqrt(dt))) * self.tick
+        return self.bid, self.ask
+
+    @property
+    def bid(self):
+        return round(self.mid - self.half_spread, 10)
+
+    @property
+    def ask(self):
+        return round(self.mid + self.half_spread, 10)
+
+
+class FakeIB:
+    def __init__(self, tick_rate = 10.0, batch_interval = 0.005, submit_latency = 0.01, fill_latency = 0.05,
+                 position_latency = 0.01, snapshot_latency = 0.02, volatility = 2.0, tick = 0.001, half_spread_ticks = 1,
+                 net_liquidation = 1_000_000.0, mids = None, seed = None):
+        self.tick_rate = tick_rate # bid / ask ticks per second per subscribed contract
+        self.batch_interval = batch_interval # seconds between pendingTickersEvent batches, like network reads
+        self.submit_latency = submit_latency # placeOrder -> Submitted
+        self.fill_latency = fill_latency # Submitted -> Filled (market orders)
+        self.position_latency = position_latency # fill -> positionEvent
+        self.snapshot_latency = snapshot_latency
+        self.volatility = volatility
+        self.tick = tick
+        self.half_spread_ticks = half_spread_ticks
+        self.net_liquidation = net_liquidation # account equity, available funds = equity - initial margin
+        self.mids = mids or {} # localSymbol or symbol : mid price
+        self.rng = np.random.default_rng(seed)
+
+        self.pendingTickersEvent = Event("pendingTickersEvent")
+        self.orderStatusEvent = Event("orderStatusEvent")
+        self.execDetailsEvent = Event("execDetailsEvent")
+        self.positionEvent = Event("positionEvent")
+        self.connectedEvent = Event("connectedEvent")
+        self.disconnectedEvent = Event("disconnectedEvent")
+
+        self.connected = False
+        self.tickers = {} # localSymbol : Ticker
+        self.markets = {} # localSymbol : _Market
+        self.streaming = set() # localSymbols with tick-by-tick subscriptions
+        self.trades = {} # orderId : Trade
+        self.position_book = {} # localSymbol : [contract, position, avg cost]
+        self.pending = set()
+        self.order_ids = itertools.count(1)
+        self.exec_ids = itertools.count(1)
+        self.conids = itertools.count(100000)
+        self.ticks_sent = 0
+        self.batches_sent = 0
+        self.stream_task = None
+
+    async def connectAsync(self, host = "127.0.0.1", port = 4002, clientId = 1, timeout = 4, **kwargs):
+        self.connected = True
+        self.stream_task = asyncio.create_task(self._stream())
+        self.connectedEvent.emit()
+        return self
+
+    def isConnected(self):
+        return self.connected
+
+    def disconnect(self):
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+            self.stream_task = None
+        if self.connected:
+            self.connected = False
+            self.disconnectedEvent.emit()
+
+    async def qualifyContractsAsync(self, *contracts):
+        for contract in contracts:
+            if not getattr(contract, "conId", 0):
+                contract.conId = next(self.conids)
+            self._market(contract)
+        return list(contracts)
+
+    async def reqContractDetailsAsync(self, contract):
+        return [ContractDetails(contract, self.tick, contract.exchange)]
+
+    def _market(self, contract):
+        symbol = contract.localSymbol
+        market = self.markets.get(symbol)
+        if market is None:
+            mid = self.mids.get(symbol, self.mids.get(contract.symbol, DEFAULT_MIDS.get(contract.symbol, 100.0)))
+            market = self.markets[symbol] = _Market(mid, self.tick, self.half_spread_ticks, self.volatility, self.rng)
+        return market
+
+    def _ticker(self, contract):
+        ticker = self.tickers.get(contract.localSymbol)
+        if ticker is None:
+            ticker = self.tickers[contract.localSymbol] = Ticker(contract)
+        return ticker
+
+    def _update(self, ticker, bid, ask, now):
+        ticker.time = now
+        ticker.bid, ticker.ask = bid, ask
+        ticker.bidSize, ticker.askSize = 1.0, 1.0
+        self.pending.add(ticker)
+
+# pending tickers are emitted in batches, once per batch_interval, as ib_insync does once per socket read
+    def _flush(self):
+        if not self.pending:
+            return
+        tickers, self.pending = self.pending, set()
+        for ticker in tickers:
+            ticker.updateEvent.emit(ticker)
+        self.pendingTickersEvent.emit(tickers)
+        for ticker in tickers:
+            ticker.tickByTicks = []
+        self.batches_sent += 1
+
+    async def _stream(self):
+        previous = time.monotonic()
+        owed = {} # fractional ticks carried to the next batch
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            current = time.monotonic()
+            dt, previous = current - previous, current
+            now = datetime.now(timezone.utc)
+            for symbol in list(self.streaming):
+                ticks = owed.get(symbol, 0.0) + self.tick_rate * dt
+                count = int(ticks)
+                owed[symbol] = ticks - count
+                ticker, market = self.tickers[symbol], self.markets[symbol]
+                for _ in range(count):
+                    bid, ask = market.step(1 / self.tick_rate)
+                    ticker.tickByTicks.append((now, bid, ask))
+                    self._update(ticker, bid, ask, now)
+                self.ticks_sent += count
+            self._flush()
+
+    def reqMktData(self, contract, genericTickList = "", snapshot = False, regulatorySnapshot = False, mktDataOptions = None):
+        ticker = self._ticker(contract)
+        market = self._market(contract)
+        def send_snapshot():
+            self._update(ticker, market.bid, market.ask, datetime.now(timezone.utc))
+            self._flush()
+        asyncio.get_running_loop().call_later(self.snapshot_latency, send_snapshot)
+        if not snapshot:
+            self.streaming.add(contract.localSymbol)
+        return ticker
+
+    def cancelMktData(self, contract):
+        self.streaming.discard(contract.localSymbol)
+
+    def reqTickByTickData(self, contract, tickType, numberOfTicks = 0, ignoreSize = False):
+        self._market(contract)
+        self.streaming.add(contract.localSymbol)
+        return self._ticker(contract)
+
+    def cancelTickByTickData(self, contract, tickType):
+        self.streaming.discard(contract.localSymbol)
+
+    def placeOrder(self, contract, order):
+        if not getattr(order, "orderId", 0):
+            order.orderId = next(self.order_ids)
+        trade = self.trades[order.orderId] = Trade(contract, order)
+        self._market(contract)
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.submit_latency, self._submitted, trade)
+        return trade
+
+    def cancelOrder(self, order):
+        trade = self.trades.get(order.orderId)
+        if trade is not None and not trade.isDone():
+            self._set_status(trade, "Cancelled")
+            trade.cancelledEvent.emit(trade)
+        return trade
+
+    def _set_status(self, trade, status):
+        trade.orderStatus.status = status
+        trade.statusEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+
+    def _submitted(self, trade):
+        if trade.isDone():
+            return
+        self._set_status(trade, "Submitted")
+        if getattr(trade.order, "orderType", "MKT") == "MKT":
+            asyncio.get_running_loop().call_later(self.fill_latency, self._fill, trade)
+
+    def _fill(self, trade):
+        if trade.isDone():
+            return
+        contract, order = trade.contract, trade.order
+        market = self.markets[contract.localSymbol]
+        buy = order.action.upper() == "BUY"
+        price = market.ask if buy else market.bid
+        quantity = order.totalQuantity
+        now = datetime.now(timezone.utc)
+        execution = Execution(f"fake.{next(self.exec_ids)}", now, ACCOUNT, "BOT" if buy else "SLD", quantity, price,
+                              order.orderId, quantity, price)
+        fill = Fill(contract, execution, None, now)
+        trade.fills.append(fill)
+        status = trade.orderStatus
+        status.filled, status.remaining, status.avgFillPrice = quantity, 0.0, price
+
+        entry = self.position_book.setdefault(contract.localSymbol, [contract, 0.0, 0.0])
+        signed = quantity if buy else -quantity
+        if entry[1] * signed >= 0 and entry[1] + signed != 0:
+            entry[2] = (entry[2] * abs(entry[1]) + price * quantity) / (abs(entry[1]) + quantity)
+        entry[1] += signed
+
+        self.execDetailsEvent.emit(trade, fill)
+        trade.fillEvent.emit(trade, fill)
+        self._set_status(trade, "Filled")
+        trade.filledEvent.emit(trade)
+        asyncio.get_running_loop().call_later(self.position_latency, self.positionEvent.emit, self._position(contract.localSymbol))
+
+    def _position(self, symbol):
+        contract, position, avg_cost = self.position_book[symbol]
+        return Position(ACCOUNT, contract, position, avg_cost)
+
+    def positions(self, account = ""):
+        return [self._position(symbol) for symbol, entry in self.position_book.items() if entry[1] != 0]
+
+    def _margin_per_lot(self, contract):
+        market = self._market(contract)
+        return market.mid * float(getattr(contract, "multiplier", "") or 1) * DEFAULT_MARGIN_RATE
+
+    async def whatIfOrderAsync(self, contract, order):
+        margin = self._margin_per_lot(contract) * order.totalQuantity
+        return OrderState("PreSubmitted", str(margin), str(margin * 0.9), str(-margin), "0")
+
+    def accountValues(self, account = ""):
+        margin = sum(abs(entry[1]) * self._margin_per_lot(entry[0]) for entry in self.position_book.values())
+        return [AccountValue(ACCOUNT, "AvailableFunds", str(self.net_liquidation - margin), "USD", ""),
+                AccountValue(ACCOUNT, "FullInitMarginReq", str(margin), "USD", ""),
+                AccountValue(ACCOUNT, "NetLiquidation", str(self.net_liquidation), "USD", "")]
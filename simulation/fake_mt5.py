@@ -0,0 +1,454 @@
+# fake_mt5.py
+# drop-in stand-in for the MetaTrader5 package: same calls and result records as the terminal API used by
+# MoexAsyncWrapper, backed by a matching engine and a synthetic book process per symbol.
+#   from simulation import install_fake_mt5
+#   fake = install_fake_mt5(latency=0.002)   # before importing moex_connection
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime
+from fnmatch import fnmatch
+import numpy as np
+from config import MOEX_SYMBOLS, SYMBOL_DECIMALS
+from simulation.matching_engine import OrderBook, SimOrder, SIDE_BUY, SIDE_SELL
+from simulation.book_process import SyntheticBookProcess
+
+# result records, field names as in the MetaTrader5 package (only the fields the connectors read and a few more)
+BookInfo = namedtuple("BookInfo", ["type", "price", "volume", "volume_dbl"])
+OrderSendResult = namedtuple("OrderSendResult", ["retcode", "deal", "order", "volume", "price", "bid", "ask", "comment",
+                                                 "request_id", "retcode_external", "request"])
+TradeOrder = namedtuple("TradeOrder", ["ticket", "time_setup", "time_setup_msc", "time_done", "time_done_msc", "type",
+                                       "state", "volume_initial", "volume_current", "price_open", "price_current", "symbol", "comment"])
+TradeDeal = namedtuple("TradeDeal", ["ticket", "order", "time", "time_msc", "type", "entry", "position_id", "volume",
+                                     "price", "symbol", "comment"])
+TradePosition = namedtuple("TradePosition", ["ticket", "time", "time_msc", "type", "volume", "price_open", "price_current", "symbol"])
+SymbolInfo = namedtuple("SymbolInfo", ["name", "digits", "trade_tick_size", "trade_contract_size", "margin_initial",
+                                       "margin_maintenance", "volume_min", "volume_step", "bid", "ask"])
+Tick = namedtuple("Tick", ["time", "bid", "ask", "last", "volume", "time_msc"])
+AccountInfo = namedtuple("AccountInfo", ["login", "server", "currency", "balance", "equity", "margin", "margin_free"])
+TerminalInfo = namedtuple("TerminalInfo", ["connected", "trade_allowed", "name"])
+
+# instrument defaults: mid price and initial margin per lot by symbol prefix
+DEFAULT_MIDS = {"NG": 2.6, "GOLD": 1950.0, "BR": 75.0}
+DEFAULT_MARGIN_RATE = 0.15
+
+
+class SymbolSpec:
+    __slots__ = ("symbol", "mid", "digits", "tick", "contract_size", "margin_initial", "process")
+
+    def __init__(self, symbol, mid, digits, contract_size = 1.0, margin_initial = None, tick = None, **process):
+        self.symbol = symbol
+        self.mid = mid
+        self.digits = digits
+        self.tick = tick or 10 ** -digits
+        self.contract_size = contract_size
+        self.margin_initial = margin_initial if margin_initial is not None else mid * contract_size * DEFAULT_MARGIN_RATE
+        self.process = process # SyntheticBookProcess keyword arguments (levels, volatility, trade_rate, ...)
+
+
+# specs for the configured MOEX symbols
+def default_specs(**process):
+    specs = []
+    for symbol, digits in zip(MOEX_SYMBOLS, SYMBOL_DECIMALS):
+        mid = next((value for prefix, value in DEFAULT_MIDS.items() if symbol.startswith(prefix)), 100.0)
+        specs.append(SymbolSpec(symbol, mid, digits, **process))
+    return specs
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+class FakeMetaTrader5:
+    # constants used by the connectors, values as in the MetaTrader5 package
+    TRADE_ACTION_DEAL = 1
+    TRADE_ACTION_PENDING = 5
+    TRADE_ACTION_SLTP = 6
+    TRADE_ACTION_MODIFY = 7
+    TRADE_ACTION_REMOVE = 8
+    ORDER_TYPE_BUY = 0
+    ORDER_TYPE_SELL = 1
+    ORDER_TYPE_BUY_LIMIT = 2
+    ORDER_TYPE_SELL_LIMIT = 3
+    ORDER_TIME_GTC = 0
+    ORDER_TIME_DAY = 1
+    ORDER_FILLING_FOK = 0
+    ORDER_FILLING_IOC = 1
+    ORDER_FILLING_RETURN = 2
+    ORDER_STATE_PLACED = 1
+    ORDER_STATE_CANCELED = 2
+    ORDER_STATE_PARTIAL = 3
+    ORDER_STATE_FILLED = 4
+    ORDER_STATE_REJECTED = 5
+    POSITION_TYPE_BUY = 0
+    POSITION_TYPE_SELL = 1
+    DEAL_TYPE_BUY = 0
+    DEAL_TYPE_SELL = 1
+    DEAL_ENTRY_IN = 0
+    DEAL_ENTRY_OUT = 1
+    BOOK_TYPE_SELL = 1
+    BOOK_TYPE_BUY = 2
+    TRADE_RETCODE_REJECT = 10006
+    TRADE_RETCODE_DONE = 10009
+    TRADE_RETCODE_DONE_PARTIAL = 10010
+    TRADE_RETCODE_INVALID = 10013
+    TRADE_RETCODE_INVALID_VOLUME = 10014
+    TRADE_RETCODE_INVALID_PRICE = 10015
+    TRADE_RETCODE_MARKET_CLOSED = 10018
+    TRADE_RETCODE_NO_MONEY = 10019
+    RES_S_OK = 1
+    RES_E_FAIL = -1
+    RES_E_INVALID_PARAMS = -2
+    RES_E_NOT_FOUND = -4
+
+    def __init__(self, specs = None, latency = 0.0, jitter = 0.0, step_interval = 0.05, max_catch_up = 200,
+                 auto_advance = True, book_depth = 20, balance = 10_000_000.0, seed = None):
+        self.specs = {spec.symbol: spec for spec in (specs or default_specs())}
+        # per call latency in seconds: a number for every call or {"order_send": 0.005, ...}, plus uniform jitter
+        self.latency = latency
+        self.jitter = jitter
+        self.step_interval = step_interval # seconds of market time per synthetic book step
+        self.max_catch_up = max_catch_up # steps replayed at most after a pause, older market time is skipped
+        self.auto_advance = auto_advance # False: the market moves only on advance(), for reproducible runs
+        self.book_depth = book_depth # levels per side returned by market_book_get
+        self.balance = balance
+        self.market_open = True
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.RLock() # the connectors call from one thread, tests may not
+
+        self.books = {}
+        self.processes = {}
+        for n, spec in enumerate(self.specs.values()):
+            self.books[spec.symbol] = OrderBook(spec.symbol, spec.digits)
+            process_seed = None if seed is None else seed + n + 1
+            self.processes[spec.symbol] = SyntheticBookProcess(spec.symbol, spec.mid, spec.tick, seed=process_seed, **spec.process)
+        self.subscribed = set() # market_book_add symbols
+        self.active = {} # ticket : user SimOrder in the book
+        self.history_orders = [] # TradeOrder, time_done ascending
+        self.history_order_times = []
+        self.deals = [] # TradeDeal, time ascending
+        self.deal_times = []
+        self.positions = {symbol: [0.0, 0.0] for symbol in self.specs} # symbol : [signed volume, average price]
+        self.position_times = {}
+        self.next_ticket = 1
+        self.initialized = False
+        self.error = (self.RES_S_OK, "Success")
+        self.calls = {} # call name : count, for load tests
+        self.last_step = time.monotonic()
+        self.clock_offset = 0.0 # seconds added to wall time by advance()
+        for symbol in self.specs:
+            self.processes[symbol].requote(self.books[symbol], self._now_msc())
+
+# move every synthetic book forward by seconds of market time
+    def advance(self, seconds):
+        with self.lock:
+            steps = max(int(round(seconds / self.step_interval)), 1)
+            self.clock_offset += seconds
+            self._run_steps(steps)
+
+    def set_market_open(self, is_open):
+        self.market_open = is_open
+
+    def _run_steps(self, steps):
+        for _ in range(steps):
+            time_msc = self._now_msc()
+            for symbol, process in self.processes.items():
+                self._apply_fills(process.step(self.books[symbol], self.step_interval, time_msc), time_msc)
+
+    def _enter(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        latency = self.latency.get(name, 0.0) if isinstance(self.latency, dict) else self.latency
+        if self.jitter:
+            latency += self.rng.uniform(0, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+        if self.auto_advance:
+            now = time.monotonic()
+            steps = int((now - self.last_step) / self.step_interval)
+            if steps > 0:
+                self.last_step += steps * self.step_interval
+                self._run_steps(min(steps, self.max_catch_up))
+        self.error = (self.RES_S_OK, "Success")
+
+    def _fail(self, code, message):
+        self.error = (code, message)
+        return None
+
+    def _now_msc(self):
+        return int((time.time() + self.clock_offset) * 1000)
+
+    def _ticket(self):
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        return ticket
+
+    def _apply_fills(self, fills, time_msc):
+        for fill in fills:
+            for order in (fill.resting, fill.aggressor):
+                if order.user:
+                    self._deal(order, fill.price, fill.volume, time_msc)
+            if fill.resting.user and fill.resting.volume_current <= 0:
+                self._archive(fill.resting, self.ORDER_STATE_FILLED, time_msc)
+
+    def _deal(self, order, price, volume, time_msc):
+        position = self.positions[order.symbol]
+        signed = volume if order.side == SIDE_BUY else -volume
+        entry = self.DEAL_ENTRY_IN if position[0] * signed >= 0 else self.DEAL_ENTRY_OUT
+        if entry == self.DEAL_ENTRY_IN:
+            position[1] = (position[1] * abs(position[0]) + price * volume) / (abs(position[0]) + volume)
+        elif abs(signed) > abs(position[0]): # reversal, the rest opens at the deal price
+            position[1] = price
+        position[0] += signed
+        if position[0] == 0:
+            position[1] = 0.0
+        self.position_times.setdefault(order.symbol, time_msc)
+        deal_type = self.DEAL_TYPE_BUY if order.side == SIDE_BUY else self.DEAL_TYPE_SELL
+        deal = TradeDeal(self._ticket(), order.ticket, time_msc // 1000, time_msc, deal_type, entry, 0, volume, price, order.symbol, "")
+        self.deals.append(deal)
+        self.deal_times.append(deal.time)
+
+    def _archive(self, order, state, time_msc):
+        self.active.pop(order.ticket, None)
+        order.state = state
+        order.time_done_msc = time_msc
+        record = self._order_record(order)
+        self.history_orders.append(record)
+        self.history_order_times.append(record.time_done)
+
+    def _order_record(self, order):
+        return TradeOrder(order.ticket, order.time_setup_msc // 1000, order.time_setup_msc, order.time_done_msc // 1000,
+                          order.time_done_msc, order.type, order.state, order.volume_initial, order.volume_current,
+                          order.price or 0.0, order.price or 0.0, order.symbol, "")
+
+    def _top(self, symbol):
+        book = self.books[symbol]
+        return book.best(SIDE_BUY) or 0.0, book.best(SIDE_SELL) or 0.0
+
+    def initialize(self, *args, **kwargs):
+        with self.lock:
+            self._enter("initialize")
+            self.initialized = True
+            return True
+
+    def shutdown(self):
+        with self.lock:
+            self.initialized = False
+            self.subscribed.clear()
+            return True
+
+    def last_error(self):
+        return self.error
+
+    def version(self):
+        return (500, 3815, "simulation")
+
+    def terminal_info(self):
+        return TerminalInfo(self.initialized, True, "simulated MetaTrader 5")
+
+    def account_info(self):
+        with self.lock:
+            self._enter("account_info")
+            margin = sum(abs(volume) * self.specs[symbol].margin_initial for symbol, (volume, _) in self.positions.items())
+            equity = self.balance + sum(self._profit(symbol) for symbol in self.positions)
+            return AccountInfo(0, "simulation", "RUB", self.balance, equity, margin, equity - margin)
+
+    def _profit(self, symbol):
+        volume, price_open = self.positions[symbol]
+        if volume == 0:
+            return 0.0
+        bid, ask = self._top(symbol)
+        price_current = bid if volume > 0 else ask
+        return (price_current - price_open) * volume * self.specs[symbol].contract_size if price_current else 0.0
+
+    def symbol_info(self, symbol):
+        with self.lock:
+            self._enter("symbol_info")
+            spec = self.specs.get(symbol)
+            if spec is None:
+                return self._fail(self.RES_E_NOT_FOUND, f"Symbol {symbol} not found")
+            bid, ask = self._top(symbol)
+            return SymbolInfo(symbol, spec.digits, spec.tick, spec.contract_size, spec.margin_initial, spec.margin_initial,
+                              1.0, 1.0, bid, ask)
+
+    def symbol_info_tick(self, symbol):
+        with self.lock:
+            self._enter("symbol_info_tick")
+            if symbol not in self.specs:
+                return self._fail(self.RES_E_NOT_FOUND, f"Symbol {symbol} not found")
+            bid, ask = self._top(symbol)
+            time_msc = self._now_msc()
+            return Tick(time_msc // 1000, bid, ask, 0.0, 0, time_msc)
+
+    def order_calc_margin(self, action, symbol, volume, price):
+        with self.lock:
+            self._enter("order_calc_margin")
+            spec = self.specs.get(symbol)
+            if spec is None:
+                return self._fail(self.RES_E_NOT_FOUND, f"Symbol {symbol} not found")
+            return spec.margin_initial * volume
+
+    def market_book_add(self, symbol):
+        with self.lock:
+            self._enter("market_book_add")
+            if symbol not in self.specs:
+                return self._fail(self.RES_E_NOT_FOUND, f"Symbol {symbol} not found") or False
+            self.subscribed.add(symbol)
+            return True
+
+    def market_book_release(self, symbol):
+        with self.lock:
+            self._enter("market_book_release")
+            if symbol not in self.subscribed:
+                return self._fail(self.RES_E_FAIL, f"Market book for {symbol} not subscribed") or False
+            self.subscribed.discard(symbol)
+            return True
+
+# asks from the highest price down, then bids from the highest price down, as the terminal returns them
+    def market_book_get(self, symbol):
+        with self.lock:
+            self._enter("market_book_get")
+            if symbol not in self.subscribed:
+                return self._fail(self.RES_E_FAIL, f"Market book for {symbol} not subscribed")
+            book = self.books[symbol]
+            asks = book.depth(SIDE_SELL, self.book_depth)[::-1]
+            bids = book.depth(SIDE_BUY, self.book_depth)
+            return tuple([BookInfo(self.BOOK_TYPE_SELL, price, int(volume), volume) for price, volume in asks] +
+                         [BookInfo(self.BOOK_TYPE_BUY, price, int(volume), volume) for price, volume in bids])
+
+    def orders_get(self, symbol = None, group = None, ticket = None):
+        with self.lock:
+            self._enter("orders_get")
+            if ticket is not None:
+                orders = [self.active[ticket]] if ticket in self.active else []
+            else:
+                orders = [order for order in self.active.values()
+                          if (symbol is None or order.symbol == symbol) and (group is None or fnmatch(order.symbol, group))]
+            return tuple(self._order_record(order) for order in orders)
+
+    def history_orders_get(self, date_from = None, date_to = None, group = None, ticket = None, position = None):
+        with self.lock:
+            self._enter("history_orders_get")
+            if ticket is not None:
+                return tuple(order for order in self.history_orders if order.ticket == ticket)
+            start = bisect_left(self.history_order_times, _timestamp(date_from))
+            end = bisect_right(self.history_order_times, _timestamp(date_to))
+            return tuple(order for order in self.history_orders[start:end] if group is None or fnmatch(order.symbol, group))
+
+    def history_deals_get(self, date_from = None, date_to = None, group = None, ticket = None, position = None):
+        with self.lock:
+            self._enter("history_deals_get")
+            if ticket is not None:
+                return tuple(deal for deal in self.deals if deal.order == ticket)
+            start = bisect_left(self.deal_times, _timestamp(date_from))
+            end = bisect_right(self.deal_times, _timestamp(date_to))
+            return tuple(deal for deal in self.deals[start:end] if group is None or fnmatch(deal.symbol, group))
+
+# netting account: one position per symbol
+    def positions_get(self, symbol = None, group = None, ticket = None):
+        with self.lock:
+            self._enter("positions_get")
+            positions = []
+            for n, (name, (volume, price_open)) in enumerate(self.positions.items()):
+                if volume == 0 or (symbol is not None and name != symbol) or (group is not None and not fnmatch(name, group)):
+                    continue
+                bid, ask = self._top(name)
+                time_msc = self.position_times.get(name, 0)
+                position_type = self.POSITION_TYPE_BUY if volume > 0 else self.POSITION_TYPE_SELL
+                positions.append(TradePosition(n + 1, time_msc // 1000, time_msc, position_type, abs(volume), price_open,
+                                               bid if volume > 0 else ask, name))
+            return tuple(positions)
+
+    def order_send(self, request):
+        with self.lock:
+            self._enter("order_send")
+            action = request.get("action")
+            if not self.market_open:
+                return self._result(self.TRADE_RETCODE_MARKET_CLOSED, request, comment="Market closed")
+            if action in (self.TRADE_ACTION_DEAL, self.TRADE_ACTION_PENDING):
+                return self._send_new(request)
+            if action == self.TRADE_ACTION_MODIFY:
+                return self._send_modify(request)
+            if action == self.TRADE_ACTION_REMOVE:
+                return self._send_remove(request)
+            self.error = (self.RES_E_INVALID_PARAMS, "Invalid action")
+            return self._result(self.TRADE_RETCODE_INVALID, request, comment="Invalid request")
+
+    def _result(self, retcode, request, order = 0, deal = 0, volume = 0.0, price = 0.0, comment = "Request executed"):
+        bid, ask = self._top(request["symbol"]) if request.get("symbol") in self.specs else (0.0, 0.0)
+        return OrderSendResult(retcode, deal, order, volume, price, bid, ask, comment, 0, 0, request)
+
+    def _send_new(self, request):
+        symbol = request.get("symbol")
+        order_type = request.get("type")
+        volume = float(request.get("volume", 0.0))
+        if symbol not in self.books:
+            return self._result(self.TRADE_RETCODE_INVALID, request, comment="Unknown symbol")
+        if volume <= 0:
+            return self._result(self.TRADE_RETCODE_INVALID_VOLUME, request, comment="Invalid volume")
+        market = request["action"] == self.TRADE_ACTION_DEAL
+        if market and order_type not in (self.ORDER_TYPE_BUY, self.ORDER_TYPE_SELL) or \
+                not market and order_type not in (self.ORDER_TYPE_BUY_LIMIT, self.ORDER_TYPE_SELL_LIMIT):
+            return self._result(self.TRADE_RETCODE_INVALID, request, comment="Invalid order type")
+        price = None if market else request.get("price")
+        if not market and (price is None or price <= 0):
+            return self._result(self.TRADE_RETCODE_INVALID_PRICE, request, comment="Invalid price")
+
+        time_msc = self._now_msc()
+        side = SIDE_BUY if order_type % 2 == 0 else SIDE_SELL
+        order = SimOrder(self._ticket(), symbol, side, price, volume, type=order_type, time_msc=time_msc)
+        first_deal = self.next_ticket
+        fills = self.books[symbol].add(order)
+        self._apply_fills(fills, time_msc)
+        filled = volume - order.volume_current
+        if market:
+            if filled == 0:
+                order.state = self.ORDER_STATE_REJECTED
+                return self._result(self.TRADE_RETCODE_REJECT, request, order=order.ticket, comment="No liquidity")
+            order.price = round(sum(fill.price * fill.volume for fill in fills) / filled, self.specs[symbol].digits)
+            # filling RETURN on a market order: the rest is cancelled, the book has no more liquidity
+            self._archive(order, self.ORDER_STATE_FILLED if order.volume_current == 0 else self.ORDER_STATE_PARTIAL, time_msc)
+            retcode = self.TRADE_RETCODE_DONE if order.volume_current == 0 else self.TRADE_RETCODE_DONE_PARTIAL
+            return self._result(retcode, request, order=order.ticket, deal=first_deal, volume=filled, price=order.price)
+        if order.volume_current > 0:
+            order.state = self.ORDER_STATE_PLACED
+            self.active[order.ticket] = order
+        else:
+            self._archive(order, self.ORDER_STATE_FILLED, time_msc)
+        return self._result(self.TRADE_RETCODE_DONE, request, order=order.ticket, volume=volume, price=order.price)
+
+    def _send_modify(self, request):
+        ticket = request.get("order")
+        order = self.active.get(ticket)
+        price = request.get("price")
+        if order is None:
+            return self._result(self.TRADE_RETCODE_INVALID, request, order=ticket or 0, comment="Order not found")
+        if price is None or price <= 0:
+            return self._result(self.TRADE_RETCODE_INVALID_PRICE, request, order=ticket, comment="Invalid price")
+        if "volume" in request and request["volume"] != order.volume_current: # pending order volume can't be modified
+            return self._result(self.TRADE_RETCODE_INVALID_VOLUME, request, order=ticket, comment="Invalid volume")
+        time_msc = self._now_msc()
+        _, fills = self.books[order.symbol].modify(ticket, price)
+        self._apply_fills(fills, time_msc)
+        if order.volume_current <= 0 and ticket in self.active:
+            self._archive(order, self.ORDER_STATE_FILLED, time_msc)
+        return self._result(self.TRADE_RETCODE_DONE, request, order=ticket, volume=order.volume_current, price=order.price)
+
+    def _send_remove(self, request):
+        ticket = request.get("order")
+        order = self.active.get(ticket)
+        if order is None:
+            return self._result(self.TRADE_RETCODE_INVALID, request, order=ticket or 0, comment="Order not found")
+        self.books[order.symbol].cancel(ticket)
+        self._archive(order, self.ORDER_STATE_CANCELED, self._now_msc())
+        return self._result(self.TRADE_RETCODE_DONE, request, order=ticket)
+
+
+# register the fake as the MetaTrader5 module. Call before anything imports MetaTrader5
+def install_fake_mt5(fake = None, **kwargs):
+    fake = fake or FakeMetaTrader5(**kwargs)
+    sys.modules["MetaTrader5"] = fake
+    return fake
@@ -0,0 +1,135 @@
+# matching_engine.py
+# price-time priority limit order book used by the MetaTrader5 / IB stand-ins
+from bisect import bisect_left, insort
+from collections import deque
+
+SIDE_BUY = 0
+SIDE_SELL = 1
+
+
+class SimOrder:
+    __slots__ = ("ticket", "symbol", "side", "type", "price", "volume_initial", "volume_current", "user",
+                 "time_setup_msc", "time_done_msc", "state")
+
+    def __init__(self, ticket, symbol, side, price, volume, user = True, type = None, time_msc = 0):
+        self.ticket = ticket
+        self.symbol = symbol
+        self.side = side
+        self.type = type # venue order type (mt5 ORDER_TYPE_*), kept for reports
+        self.price = price # None for market orders
+        self.volume_initial = volume
+        self.volume_current = volume
+        self.user = user # False for synthetic liquidity
+        self.time_setup_msc = time_msc
+        self.time_done_msc = 0
+        self.state = None
+
+
+class Fill:
+    __slots__ = ("resting", "aggressor", "price", "volume")
+
+    def __init__(self, resting, aggressor, price, volume):
+        self.resting = resting
+        self.aggressor = aggressor
+        self.price = price
+        self.volume = volume
+
+
+class OrderBook:
+    def __init__(self, symbol, digits):
+        self.symbol = symbol
+        self.digits = digits
+        self.levels = ({}, {}) # side : {price : deque of resting orders}
+        self.prices = ([], []) # side : sorted prices (ascending) with resting orders
+        self.orders = {} # ticket : resting SimOrder
+
+    def round(self, price):
+        return round(price, self.digits)
+
+    def best(self, side):
+        prices = self.prices[side]
+        if not prices:
+            return None
+        return prices[-1] if side == SIDE_BUY else prices[0]
+
+# match the order against the opposite side, rest the remainder of a limit order. Returns list of Fill
+    def add(self, order):
+        if order.price is not None:
+            order.price = self.round(order.price)
+        fills = self._match(order)
+        if order.volume_current > 0 and order.price is not None:
+            self._rest(order)
+        return fills
+
+    def _crosses(self, order, price):
+        if order.price is None:
+            return True
+        return price <= order.price if order.side == SIDE_BUY else price >= order.price
+
+    def _match(self, order):
+        fills = []
+        opposite = SIDE_SELL if order.side == SIDE_BUY else SIDE_BUY
+        levels, prices = self.levels[opposite], self.prices[opposite]
+        while order.volume_current > 0 and prices:
+            price = prices[0] if opposite == SIDE_SELL else prices[-1]
+            if not self._crosses(order, price):
+                break
+            level = levels[price]
+            while level and order.volume_current > 0:
+                resting = level[0]
+                volume = min(resting.volume_current, order.volume_current)
+                resting.volume_current -= volume
+                order.volume_current -= volume
+                fills.append(Fill(resting, order, price, volume))
+                if resting.volume_current <= 0:
+                    level.popleft()
+                    del self.orders[resting.ticket]
+            if not level:
+                del levels[price]
+                prices.pop(0 if opposite == SIDE_SELL else -1)
+        return fills
+
+    def _rest(self, order):
+        levels, prices = self.levels[order.side], self.prices[order.side]
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = deque()
+            insort(prices, order.price)
+        level.append(order)
+        self.orders[order.ticket] = order
+
+    def cancel(self, ticket):
+        order = self.orders.pop(ticket, None)
+        if order is None:
+            return None
+        levels, prices = self.levels[order.side], self.prices[order.side]
+        level = levels[order.price]
+        level.remove(order)
+        if not level:
+            del levels[order.price]
+            del prices[bisect_left(prices, order.price)]
+        return order
+
+# new price loses time priority, as on the exchange. Returns (order, fills) or (None, [])
+    def modify(self, ticket, price):
+        order = self.cancel(ticket)
+        if order is None:
+            return None, []
+        order.price = self.round(price)
+        return order, self.add(order)
+
+# resting volume can be reduced without losing priority
+    def reduce(self, ticket, volume):
+        order = self.orders.get(ticket)
+        if order is None:
+            return None
+        if volume >= order.volume_current:
+            return self.cancel(ticket)
+        order.volume_current -= volume
+        return order
+
+# aggregated levels, best first: [(price, volume), ...] for one side
+    def depth(self, side, max_levels):
+        levels, prices = self.levels[side], self.prices[side]
+        selected = prices[::-1][:max_levels] if side == SIDE_BUY else prices[:max_levels]
+        return [(price, sum(order.volume_current for order in levels[price])) for price in selected]
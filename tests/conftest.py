@@ -0,0 +1,7 @@
+# conftest.py
+# tests run against the in-process fakes: FakeMetaTrader5 is installed as the MetaTrader5 module before any connector
+# is imported, with the market moving only on advance(). Run from the project root:
+#   python -m pytest tests
+from simulation import install_fake_mt5
+
+install_fake_mt5(auto_advance=False, seed=1)
@@ -0,0 +1,36 @@
+# test_history_cache.py
+# MT5 does not say which time history_orders_get(from, to) selects on. The fake selects on time_done; here it is
+# switched to time_setup, where an old order cancelled now falls outside the cache's incremental range
+import asyncio
+import MetaTrader5 as mt5
+from config import MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS
+from moex_connection.moex_async_wrapper import MoexAsyncWrapper
+from simulation.fake_mt5 import _timestamp
+
+HOUR = 3600
+
+
+def history_by_setup_time(date_from = None, date_to = None, group = None, ticket = None, position = None):
+    if ticket is not None:
+        return tuple(order for order in mt5.history_orders if order.ticket == ticket)
+    return tuple(order for order in mt5.history_orders if _timestamp(date_from) <= order.time_setup <= _timestamp(date_to))
+
+
+def test_wait_finds_old_order_cancelled_now(monkeypatch):
+    symbol = MOEX_SYMBOLS[0]
+    moex_connector = MoexAsyncWrapper(MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS)
+    monkeypatch.setattr(mt5, "history_orders_get", history_by_setup_time)
+    placed = mt5.order_send({"action": mt5.TRADE_ACTION_PENDING, "symbol": symbol, "type": mt5.ORDER_TYPE_BUY_LIMIT,
+                             "volume": 1.0, "price": 1.0})
+    assert placed.retcode == mt5.TRADE_RETCODE_DONE
+
+    async def run():
+        monkeypatch.setattr(mt5, "clock_offset", mt5.clock_offset + 2 * HOUR)
+        moex_connector.hist_orders.high_water = int(mt5._now_msc() / 1000) # orders done two hours later were seen
+        assert (await moex_connector.cancel_order(placed.order))[0].retcode == mt5.TRADE_RETCODE_DONE
+        found = await moex_connector.wait_hist_orders(symbol, [placed.order], timeout=1)
+        await moex_connector.close()
+        return found
+
+    assert asyncio.run(run())
+    assert placed.order in moex_connector.hist_orders.orders[symbol]
@@ -0,0 +1,94 @@
+# test_matching.py
+import math
+from backtesting.matching import QueueMatcher
+from data_processing.order_ladder import ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_SELL_LIMIT
+
+
+# buy order resting at the best bid 2.600 behind 10 lots
+def resting_buy(volume = 5.0):
+    matcher = QueueMatcher()
+    matcher.on_book(2.600, 2.605, 10.0, 10.0)
+    order = matcher.new_order(0, ORDER_TYPE_BUY_LIMIT, 2.600, volume)
+    assert matcher.activate(order) == []
+    assert order.queue_ahead == 10.0
+    return matcher, order
+
+
+def test_order_at_best_queues_behind_level_volume():
+    matcher, order = resting_buy()
+    assert matcher.on_book(2.600, 2.605, 4.0, 10.0) == [] # 6 traded ahead
+    assert order.queue_ahead == 4.0
+    assert matcher.on_book(2.600, 2.605, 1.0, 10.0) == [] # 3 more traded, 1 still ahead
+    assert order.queue_ahead == 1.0
+
+
+def test_volume_decrease_past_queue_fills_order():
+    matcher, order = resting_buy()
+    assert matcher.on_book(2.600, 2.605, 3.0, 10.0) == [] # 7 of 10 ahead
+    assert matcher.on_book(2.600, 2.605, 0.0, 10.0) == [] # the last 3 ahead
+    assert order.queue_ahead == 0.0
+    matcher.on_book(2.600, 2.605, 8.0, 10.0) # new volume joins behind
+    fills = matcher.on_book(2.600, 2.605, 6.0, 10.0) # 2 traded, all of them with the order
+    assert fills == [(order, 2.600, 2.0)]
+    assert order.volume_current == 3.0 and order.ticket in matcher.orders
+
+
+def test_queue_ahead_is_capped_by_level_volume():
+    matcher, order = resting_buy()
+    matcher.on_book(2.600, 2.605, 12.0, 10.0) # more joins behind: the queue ahead does not grow
+    assert order.queue_ahead == 10.0
+    matcher.on_book(2.600, 2.605, 2.0, 10.0) # cancels ahead
+    assert order.queue_ahead == 0.0
+    assert matcher.on_book(2.600, 2.605, 0.0, 10.0) == [(order, 2.600, 2.0)]
+
+
+def test_trade_through_fills_in_full_at_order_price():
+    matcher, order = resting_buy()
+    assert matcher.on_book(2.595, 2.600, 5.0, 7.0) == [(order, 2.600, 5.0)]
+    assert matcher.orders == {}
+
+
+def test_order_inside_spread_is_first_in_queue():
+    matcher = QueueMatcher()
+    matcher.on_book(2.600, 2.610, 10.0, 10.0)
+    order = matcher.new_order(0, ORDER_TYPE_SELL_LIMIT, 2.605, 5.0)
+    matcher.activate(order)
+    assert order.queue_ahead == 0.0
+    matcher.on_book(2.600, 2.605, 10.0, 5.0) # others join at the order's price, behind it
+    assert matcher.on_book(2.600, 2.605, 10.0, 2.0) == [(order, 2.605, 3.0)]
+
+
+def test_marketable_order_fills_at_touch_on_arrival():
+    matcher = QueueMatcher()
+    matcher.on_book(2.600, 2.605, 10.0, 10.0)
+    order = matcher.new_order(0, ORDER_TYPE_BUY_LIMIT, 2.610, 5.0)
+    assert matcher.activate(order) == [(order, 2.605, 5.0)]
+    assert matcher.orders == {}
+
+
+def test_unknown_level_volume_fills_only_on_trade_through():
+    matcher = QueueMatcher()
+    matcher.on_book(2.600, 2.605, math.nan, math.nan)
+    order = matcher.new_order(0, ORDER_TYPE_BUY_LIMIT, 2.600, 5.0)
+    matcher.activate(order)
+    assert matcher.on_book(2.600, 2.605, math.nan, math.nan) == []
+    assert matcher.on_book(2.595, 2.600, math.nan, math.nan) == [(order, 2.600, 5.0)]
+
+
+def test_modify_loses_queue_position_and_cancel_removes_order():
+    matcher, order = resting_buy()
+    matcher.on_book(2.600, 2.605, 2.0, 10.0)
+    matcher.on_book(2.600, 2.605, 9.0, 10.0) # 7 join behind the order
+    assert order.queue_ahead == 2.0
+    assert matcher.modify(order.ticket, 2.600, 3.0) == []
+    assert order.queue_ahead == 9.0 and order.volume_current == 3.0 # back of the queue
+    assert matcher.cancel(order.ticket) is order
+    assert matcher.on_book(2.595, 2.600, 1.0, 1.0) == []
+
+
+def test_inactive_order_is_not_filled():
+    matcher = QueueMatcher()
+    matcher.on_book(2.600, 2.605, 10.0, 10.0)
+    order = matcher.new_order(0, ORDER_TYPE_BUY_LIMIT, 2.600, 5.0)
+    assert matcher.on_book(2.595, 2.600, 1.0, 1.0) == [] # still on the way to the exchange
+    assert order.ticket in matcher.orders
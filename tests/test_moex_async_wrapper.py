@@ -0,0 +1,22 @@
+# test_moex_async_wrapper.py
+import asyncio
+import gc
+import MetaTrader5 as mt5
+import pytest
+from config import MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS
+from moex_connection.moex_async_wrapper import MoexAsyncWrapper
+
+
+def test_close_shuts_terminal_down_once_and_del_does_not_block():
+    moex_connector = MoexAsyncWrapper(MOEX_LOGIN, MOEX_PASSWORD, MOEX_SERVER, MOEX_SYMBOLS, MOEX_LOTS)
+    assert mt5.terminal_info().connected
+
+    async def run():
+        await moex_connector.close()
+        await moex_connector.close()
+        with pytest.raises(RuntimeError):
+            await moex_connector.load_positions()
+    asyncio.run(run())
+    assert not mt5.terminal_info().connected
+    del moex_connector
+    gc.collect() # __del__ after close must not raise
@@ -0,0 +1,25 @@
+# test_nymex_async_wrapper.py
+import asyncio
+from config import NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS
+from nymex_connection.nymex_async_wrapper import NymexAsyncWrapper
+from simulation import FakeIB
+
+
+# the same Ticker comes back on a new subscription: its quote from before the unsubscribe must not be taken as current
+def test_resubscribe_waits_for_a_fresh_quote():
+    async def run():
+        ib = FakeIB(tick_rate=1.0, volatility=0.0, seed=1)
+        nymex_conn = NymexAsyncWrapper(NYMEX_API_KEY, NYMEX_HOST, NYMEX_PORT, NYMEX_CONTRACTS[:1], ib=ib)
+        await nymex_conn.initialize()
+        contract = nymex_conn.contracts[0]
+        symbol = contract.localSymbol
+        try:
+            assert await nymex_conn.subscribe_bid_ask(contract, timeout=1)
+            old_bid = nymex_conn.current_bid[symbol]
+            await nymex_conn.unsubscribe_bid_ask(contract)
+            ib.markets[symbol].mid += 0.1
+            assert await nymex_conn.subscribe_bid_ask(contract, timeout=1)
+            assert nymex_conn.current_bid[symbol] == ib.markets[symbol].bid != old_bid
+        finally:
+            ib.disconnect()
+    asyncio.run(run())
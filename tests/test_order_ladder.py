@@ -0,0 +1,56 @@
+# test_order_ladder.py
+import numpy as np
+import pytest
+from data_processing.order_ladder import OrderLadder, ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_SELL_LIMIT
+from moex_connection.open_orders import OrderRecord
+
+SYMBOL = "NG-7.23"
+TICK_SIZE = 0.001
+
+
+# one buy level and one sell level with live orders 11 and 12 at the given prices
+def ladder_and_live(buy_price, sell_price, volume = 5.0):
+    ladder = OrderLadder(2)
+    ladder.update(np.array([ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_SELL_LIMIT]), np.array([2.600, 2.700]), np.array([volume, volume]))
+    ladder.set_ticket(0, 11)
+    ladder.set_ticket(1, 12)
+    live = {11: OrderRecord(11, SYMBOL, ORDER_TYPE_BUY_LIMIT, 5.0, 5.0, buy_price),
+            12: OrderRecord(12, SYMBOL, ORDER_TYPE_SELL_LIMIT, 5.0, 5.0, sell_price)}
+    return ladder, live
+
+
+def test_orders_at_target_are_kept():
+    ladder, live = ladder_and_live(2.600, 2.700)
+    assert ladder.reconcile(live, TICK_SIZE, 0) == ([], [], [])
+
+
+# prices whose float difference is not a whole number of ticks (2.6 - 2.597 = 0.0030000000000001137)
+@pytest.mark.parametrize("tolerance_ticks", [1, 2, 3])
+def test_orders_at_tolerance_edge_are_kept(tolerance_ticks):
+    edge = tolerance_ticks * TICK_SIZE
+    ladder, live = ladder_and_live(round(2.600 - edge, 3), round(2.700 + edge, 3))
+    assert ladder.reconcile(live, TICK_SIZE, tolerance_ticks) == ([], [], [])
+
+
+@pytest.mark.parametrize("tolerance_ticks", [0, 1, 2])
+def test_orders_past_tolerance_are_repriced_to_target(tolerance_ticks):
+    past = (tolerance_ticks + 1) * TICK_SIZE
+    ladder, live = ladder_and_live(round(2.600 - past, 3), round(2.700 + past, 3))
+    assert ladder.reconcile(live, TICK_SIZE, tolerance_ticks) == ([], [(11, 2.600, None), (12, 2.700, None)], [])
+
+
+def test_orders_ahead_of_target_are_repriced():
+    ladder, live = ladder_and_live(2.601, 2.699)
+    assert ladder.reconcile(live, TICK_SIZE, 5) == ([], [(11, 2.600, None), (12, 2.700, None)], [])
+
+
+def test_volume_change_replaces_or_modifies():
+    ladder, live = ladder_and_live(2.600, 2.700, volume=3.0)
+    assert ladder.reconcile(live, TICK_SIZE, 1) == ([11, 12], [], [0, 1])
+    assert ladder.reconcile(live, TICK_SIZE, 1, modify_volume=True) == ([], [(11, 2.600, 3.0), (12, 2.700, 3.0)], [])
+
+
+def test_dropped_level_is_cancelled():
+    ladder, live = ladder_and_live(2.600, 2.700)
+    ladder.update(ladder.types, ladder.prices, np.array([5.0, 0.0]))
+    assert ladder.reconcile(live, TICK_SIZE, 1) == ([12], [], [])
@@ -0,0 +1,77 @@
+# test_position_book.py
+# IB does not order execDetailsEvent against positionEvent: positions and waiters follow the position stream only,
+# whichever of the two events comes first
+import asyncio
+from collections import namedtuple
+from nymex_connection.position_book import PositionBook
+from simulation.fake_ib import ACCOUNT, Execution, Fill, Position
+
+SYMBOL = "NGZ6"
+Contract = namedtuple("Contract", ["localSymbol"])
+CONTRACT = Contract(SYMBOL)
+
+
+def execution(exec_id, side, shares):
+    return Fill(CONTRACT, Execution(exec_id, None, ACCOUNT, side, shares, 2.6, 1, shares, 2.6), None, None)
+
+def position(volume, contract = CONTRACT):
+    return Position(ACCOUNT, contract, volume, 2.6)
+
+def book():
+    return PositionBook([SYMBOL], {})
+
+
+def test_execution_before_position_is_counted_once():
+    positions = book()
+    positions.on_position(position(1))
+    positions.on_execution(None, execution("e1", "BOT", 2))
+    assert positions.positions[SYMBOL] == 1
+    assert positions.provisional_position(SYMBOL) == 3
+    positions.on_position(position(3))
+    assert positions.positions[SYMBOL] == 3
+    assert positions.provisional_position(SYMBOL) == 3
+
+
+def test_execution_after_position_does_not_move_position():
+    positions = book()
+    positions.on_position(position(-2))
+    version = positions.versions[SYMBOL]
+    positions.on_execution(None, execution("e1", "SLD", 2)) # already included in -2
+    assert positions.positions[SYMBOL] == -2
+    assert positions.versions[SYMBOL] == version
+    positions.on_position(position(-2))
+    assert positions.provisional_position(SYMBOL) == -2
+
+
+def test_repeated_execution_is_skipped():
+    positions = book()
+    positions.on_execution(None, execution("e1", "BOT", 1))
+    positions.on_execution(None, execution("e1", "BOT", 1))
+    assert positions.provisional_position(SYMBOL) == 1
+    positions.on_position(position(1))
+    positions.on_execution(None, execution("e1", "BOT", 1)) # late repeat after the position took it
+    assert positions.provisional_position(SYMBOL) == 1
+
+
+def test_snapshot_sets_missing_symbols_flat_and_skips_others():
+    positions = book()
+    positions.on_position(position(2))
+    positions.on_position(position(5, Contract("CLZ6")))
+    assert "CLZ6" not in positions.positions
+    positions.apply_snapshot([])
+    assert positions.positions[SYMBOL] == 0
+
+
+def test_waiter_resolves_on_position_not_on_execution():
+    async def run():
+        positions = book()
+        positions.on_position(position(0))
+        waiter = positions.add_waiter(SYMBOL, 2)
+        positions.on_execution(None, execution("e1", "BOT", 2))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        positions.on_position(position(2))
+        assert await asyncio.wait_for(waiter, 1)
+        assert positions.add_waiter(SYMBOL, 2).done() # already there
+        assert positions.waiters == []
+    asyncio.run(run())
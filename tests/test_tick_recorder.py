@@ -0,0 +1,89 @@
+# test_tick_recorder.py
+import os
+from collections import namedtuple
+import numpy as np
+import pytest
+from database.tick_recorder import (TickRecorder, RecordFile, read_records, read_header, record_path, HEADER_SIZE, NS_PER_DAY,
+                                    KIND_IB, KIND_MOEX_BOOK, IB_RECORD_DTYPE)
+
+SYMBOL = "NG-7.23"
+DAY = 20000 # 2024-10-04
+Ticker = namedtuple("Ticker", ["bid", "ask", "bidSize", "askSize"])
+
+
+def ib_record(n):
+    return (n, 2.6 + n, 2.7 + n, 1.0, 2.0)
+
+
+def test_file_grows_by_chunks(tmp_path):
+    path = str(tmp_path / "a.ib.bin")
+    record_file = RecordFile(path, KIND_IB, 0, chunk_records=4)
+    for n in range(10):
+        record_file.append(ib_record(n))
+    assert record_file.capacity == 12
+    assert read_records(path)["time"].tolist() == list(range(10)) # readable while the writer is open
+    record_file.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 10 * IB_RECORD_DTYPE.itemsize # preallocated tail cut
+
+
+def test_restart_continues_after_complete_records(tmp_path):
+    path = str(tmp_path / "a.ib.bin")
+    record_file = RecordFile(path, KIND_IB, 0, chunk_records=4)
+    for n in range(3):
+        record_file.append(ib_record(n))
+    record_file.close()
+    record_file = RecordFile(path, KIND_IB, 0, chunk_records=4)
+    assert record_file.count == 3
+    for n in range(3, 6):
+        record_file.append(ib_record(n))
+    record_file.close()
+    assert read_records(path)["time"].tolist() == list(range(6))
+
+
+# a writer killed without close leaves the preallocated tail: the header count decides what was written
+def test_restart_after_crash_ignores_preallocated_tail(tmp_path):
+    path = str(tmp_path / "a.ib.bin")
+    record_file = RecordFile(path, KIND_IB, 0, chunk_records=8)
+    for n in range(5):
+        record_file.append(ib_record(n))
+    record_file.flush()
+    record_file._unmap() # process gone: no close, the file keeps 8 records of space
+    record_file.file.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 8 * IB_RECORD_DTYPE.itemsize
+    assert read_header(path)[2] == 5
+    restarted = RecordFile(path, KIND_IB, 0, chunk_records=8)
+    restarted.append(ib_record(5))
+    restarted.close()
+    assert read_records(path)["time"].tolist() == list(range(6))
+
+
+def test_restart_with_other_layout_is_refused(tmp_path):
+    path = str(tmp_path / "a.book.bin")
+    RecordFile(path, KIND_MOEX_BOOK, 5, chunk_records=4).close()
+    with pytest.raises(ValueError):
+        RecordFile(path, KIND_MOEX_BOOK, 10, chunk_records=4)
+
+
+def test_recorder_rolls_over_at_utc_midnight(tmp_path):
+    recorder = TickRecorder(str(tmp_path), book_depth=3, chunk_records=4)
+    before, after = (DAY + 1) * NS_PER_DAY - 1, (DAY + 1) * NS_PER_DAY
+    recorder.record_ib(SYMBOL, Ticker(2.6, 2.7, 1.0, 2.0), now=before)
+    old_file = recorder.files[(SYMBOL, KIND_IB)][1]
+    recorder.record_ib(SYMBOL, Ticker(2.61, 2.71, 1.0, 2.0), now=after)
+    assert old_file.map is None # closed by the rollover
+    recorder.close()
+    assert read_records(record_path(str(tmp_path), SYMBOL, KIND_IB, DAY))["time"].tolist() == [before]
+    assert read_records(record_path(str(tmp_path), SYMBOL, KIND_IB, DAY + 1))["time"].tolist() == [after]
+
+
+def test_book_levels_are_padded_to_depth(tmp_path):
+    recorder = TickRecorder(str(tmp_path), book_depth=3, chunk_records=4)
+    now = DAY * NS_PER_DAY
+    levels = ([2.61, 2.62], [5.0, 6.0], [2.60], [7.0])
+    recorder.record_moex_book(SYMBOL, 2.60, 2.61, 2.59, 2.62, levels, now=now)
+    recorder.record_moex_book(SYMBOL, np.nan, np.nan, np.nan, np.nan, None, now=now + 1) # book unavailable
+    recorder.close()
+    records = recorder.read(SYMBOL, KIND_MOEX_BOOK, "20241004")
+    assert records["ask_prices"][0][:2].tolist() == [2.61, 2.62] and np.isnan(records["ask_prices"][0][2])
+    assert records["bid_volumes"][0][0] == 7.0 and np.isnan(records["bid_volumes"][0][1:]).all()
+    assert np.isnan(records["ask_prices"][1]).all()
@@ -16,6 +16,8 @@ class TelegramBot():
         self.dp.message_handler(UserIdFilter(self.my_chats), commands=['stop'])(self.cmd_stop)
         self.dp.message_handler(UserIdFilter(self.my_chats), commands=['set_freq'])(self.cmd_set_freq)
         self.dp.message_handler(UserIdFilter(self.my_chats), commands=['set_risk'])(self.cmd_set_risk)
+        self.dp.message_handler(UserIdFilter(self.my_chats), commands=['status'])(self.cmd_status)
+        self.dp.message_handler(UserIdFilter(self.my_chats), commands=['recentre'])(self.cmd_recentre)
         self.dp.message_handler(UserIdFilter(self.my_chats))(self.echo_message)
 
 
@@ -69,7 +71,7 @@ class TelegramBot():
         """
         _, new_timeout = message.text.split()
         new_timeout = float(new_timeout)
-        self.strategy.timeout = new_timeout
+        self.strategy.set_timeout(new_timeout)
         await message.answer(f"New timeoute set to: {new_timeout}")
 
     async def cmd_set_risk(self, message: types.Message):
@@ -78,11 +80,24 @@ class TelegramBot():
         """
         _, new_risk_coef = message.text.split()
         new_risk_coef = float(new_risk_coef)
-        self.strategy.risk_coef = new_risk_coef
-        for symbol in self.strategy.symbols:
-            self.strategy.max_risk[symbol] = self.strategy.moex_connector.lots_dict[symbol] * self.strategy.risk_coef
+        self.strategy.set_risk_coef(new_risk_coef)
         await message.answer(f"New risk_coef set to: {new_risk_coef}")
 
+    async def cmd_recentre(self, message: types.Message):
+        text_parts = message.text.split()
+        if len(text_parts) < 4:
+            await message.reply("Please provide all required arguments: /recentre symbol mid_spread mid_pose")
+            return
+
+        symbol, mid_spread, mid_pose = text_parts[1], float(text_parts[2]), float(text_parts[3])
+        await message.reply(await self.strategy.recentre(symbol, mid_spread, mid_pose))
+
+    async def cmd_status(self, message: types.Message):
+        """
+        Trading state and positions per symbol (from all shards in the sharded runtime)
+        """
+        await message.answer(await self.strategy.status())
+
     async def echo_message(self, msg: types.Message):
         await self.bot.send_message(msg.from_user.id, msg.text)
 